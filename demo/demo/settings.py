@@ -22,6 +22,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that it measures the other middleware too. Only used when
+    # INSTRUMENTATION_ENABLED is set.
+    'store.instrumentation.InstrumentationMiddleware',
+    # only used with a DATABASE_READ_REPLICA
+    'store.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,13 +57,42 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'demo.wsgi.application'
 
+# Connections to PostgreSQL are kept open and reused by the requests of a
+# thread for this many seconds instead of being opened for every request,
+# and checked before being reused. Set DATABASE_POOL to use the connection
+# pool of psycopg instead, which needs psycopg 3 (with its pool extra) and
+# replaces the persistent connections.
+DATABASE_CONN_MAX_AGE = 600
+DATABASE_POOL = False
+
+# Host of a read replica of the PostgreSQL database (e.g. a hot standby).
+# When set, the reads of the product list, the product stats and the
+# storefront go there, see store/routers.py
+DATABASE_REPLICA_HOST = None
+# How long the reads of a client stay on the primary after it wrote
+# something, so that it reads its own writes while the replica catches up
+DATABASE_REPLICA_STICKY_SECONDS = 5
+
 if sys.argv[1] == 'test':
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-        }
+            # A file rather than the default in-memory database, which
+            # rejects concurrent writes instead of waiting, for the tests
+            # with threads. The transactions take the write lock when they
+            # start, so that two of them never wait on each other.
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 30},
+            'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
+        },
+        # stands in for the replica in the tests of the router, which turn
+        # on DATABASE_READ_REPLICA
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        },
     }
+    DATABASE_READ_REPLICA = None
 else:
     DATABASES = {
         'default': {
@@ -68,8 +102,27 @@ else:
             'PASSWORD': 'postgres',
             'HOST': '127.0.0.1',
             'PORT': '5432',
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'pool': True} if DATABASE_POOL else {},
         }
     }
+    DATABASE_READ_REPLICA = None
+    if DATABASE_REPLICA_HOST:
+        DATABASES['replica'] = dict(DATABASES['default'],
+                                    HOST=DATABASE_REPLICA_HOST,
+                                    TEST={'MIRROR': 'default'})
+        DATABASE_READ_REPLICA = 'replica'
+
+DATABASE_ROUTERS = ['store.routers.PrimaryReplicaRouter']
+
+# The product responses are cached here. Use a cache shared by all the
+# processes (e.g. memcached or redis) when running more than one.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -96,3 +149,78 @@ STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.abspath(os.path.join(BASE_DIR, 'store', 'uploads'))
 MEDIA_URL = '/uploads/'
+
+# Pagination used by the products list endpoint when the client doesn't ask for
+# one: 'offset' (limit/offset) or 'cursor' (keyset)
+PRODUCTS_PAGINATION = 'offset'
+
+# Dotted path of the full-text search backend used by the products list
+# endpoint. When empty it is picked from the database vendor, see
+# store/search.py
+PRODUCTS_SEARCH_BACKEND = None
+
+# Maximum number of seconds a product response stays in the cache
+PRODUCTS_CACHE_TIMEOUT = 300
+
+# Maximum number of products in a request to the bulk endpoint
+PRODUCTS_BULK_MAX_ITEMS = 10000
+
+# Number of products read and serialized at a time by the export endpoint
+PRODUCTS_EXPORT_CHUNK_SIZE = 2000
+
+# Widths of the resized variants of the product photos, generated by a pool
+# of PRODUCT_PHOTO_WORKERS threads after a photo is saved, or in the request
+# when PRODUCT_PHOTO_INLINE is set. See store/images.py
+PRODUCT_PHOTO_WIDTHS = (320, 640, 1280)
+PRODUCT_PHOTO_WORKERS = 2
+PRODUCT_PHOTO_INLINE = False
+
+# Maximum size in bytes of the uploaded attachments, like the warranty of
+# the products. The uploads are stopped as soon as they go over it.
+ATTACHMENT_MAX_SIZE = 1024 * 1024
+FILE_UPLOAD_HANDLERS = [
+    'store.attachments.AttachmentUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Measures the requests (time, queries, serialization, cache) and exposes
+# them at /metrics to the INTERNAL_IPS, see store/instrumentation.py. The
+# queries repeated more than INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times in a
+# request are logged as a likely N+1 pattern.
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 10
+INTERNAL_IPS = ['127.0.0.1']
+
+# Serve the product list pages from the denormalized read model (see
+# store/listings.py), which is then maintained on every write. Run
+# manage.py rebuild_product_listings after turning it on.
+PRODUCTS_READ_MODEL = False
+
+# Number of products per page of the storefront index
+STOREFRONT_PAGE_SIZE = 24
+
+# Serialize the product list and export pages from rows instead of model
+# instances, see ProductRowSerializer in store/serializers.py
+PRODUCTS_ROW_SERIALIZER = True
+
+# JSON is rendered with orjson when it is installed, see store/renderers.py
+# The product writes and searches and the cart changes are throttled per
+# client with token buckets shared through the cache, see
+# store/throttling.py. A rate of None turns a throttle off.
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'store.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'product_create': '60/min',
+        'product_update': '120/min',
+        'product_search': '120/min',
+        'cart_update': '300/min',
+    },
+    # The clients connect to Django directly, so the X-Forwarded-For header
+    # is ignored when telling them apart for the throttles. Behind proxies,
+    # this is their number: the address added by the closest one is used.
+    'NUM_PROXIES': 0,
+}
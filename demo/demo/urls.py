@@ -4,22 +4,52 @@ from django.contrib import admin
 from django.urls import path
 
 import store.api_views
+import store.async_views
 import store.views
+from store.routers import replica_reads
 
+# The reads of the views wrapped with replica_reads() can be served by the
+# read replica, see store/routers.py
 urlpatterns = \
     [
-        path('api/v1/products/', store.api_views.ProductList.as_view()),
+        path('api/v1/products/',
+             replica_reads(store.api_views.ProductList.as_view())),
         path('api/v1/products/new', store.api_views.ProductCreate.as_view()),
+        path('api/v1/products/export.<str:export_format>',
+             replica_reads(store.api_views.ProductExport.as_view())),
+        path('api/v1/products/bulk',
+             store.api_views.ProductBulk.as_view()),
         path('api/v1/products/<int:id>/',
              store.api_views.ProductRetrieveUpdateDestroy.as_view()),
+        path('api/v1/products/<int:id>/warranty',
+             store.api_views.ProductWarranty.as_view(),
+             name='product-warranty'),
         path('api/v1/products/<int:id>/stats',
-             store.api_views.ProductStats.as_view()),
+             replica_reads(store.api_views.ProductStats.as_view())),
+        path('api/v1/products/cache/stats',
+             store.api_views.ProductCacheStats.as_view()),
+        path('api/v1/throttle/stats',
+             store.api_views.ThrottleStats.as_view()),
+        path('api/v1/carts/<int:cart_id>/items/',
+             store.api_views.CartItemList.as_view()),
+        path('api/v1/carts/<int:cart_id>/items/<int:product_id>',
+             store.api_views.CartItemDestroy.as_view()),
+        path('api/v1/carts/<int:cart_id>/items/<int:product_id>/increment',
+             store.api_views.CartItemIncrement.as_view()),
+        # the product reads as async views, for the ASGI deployment
+        path('api/v1/async/products/',
+             replica_reads(store.async_views.AsyncProductList.as_view())),
+        path('api/v1/async/products/<int:id>/',
+             store.async_views.AsyncProductDetail.as_view()),
+        path('api/v1/async/products/<int:id>/stats',
+             replica_reads(store.async_views.AsyncProductStats.as_view())),
 
         path('admin/', admin.site.urls),
+        path('metrics', store.views.metrics),
 
-        path('products/<int:product_id>/', store.views.show,
+        path('products/<int:product_id>/', replica_reads(store.views.show),
              name='show-product'),
         path('cart/', store.views.cart, name='shopping-cart'),
-        path('', store.views.index, name='list-products'),
+        path('', replica_reads(store.views.index), name='list-products'),
     ] \
     + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
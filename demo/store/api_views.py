@@ -1,16 +1,42 @@
 #!usr/bin/env python3
-from django.core.cache import cache
+from datetime import datetime
+
+from django.conf import settings
+from django.core.signing import BadSignature, Signer
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import Http404, HttpResponse, HttpResponseRedirect, \
+    StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.exceptions import ValidationError
-from rest_framework.filters import SearchFilter
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.generics import ListAPIView, CreateAPIView, \
     RetrieveUpdateDestroyAPIView, GenericAPIView
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.pagination import BasePagination, \
+    LimitOffsetPagination
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
-from store.models import Product
-from store.serializers import ProductSerializer, ProductStatsSerializer
+from store import cache as product_cache
+from store import carts, listings
+from store import stats
+from store.export import chunked, csv_lines, ndjson_lines
+from store.models import Product, ProductListing, ShoppingCart, \
+    ShoppingCartItem
+from store.search import ProductSearchFilter
+from store.serializers import CartItemIncrementSerializer, \
+    CartItemSerializer, ProductListingSerializer, ProductRowSerializer, \
+    ProductSerializer, ProductStatsSerializer
+from store.throttling import CartThrottle, ProductBulkCreateThrottle, \
+    ProductBulkUpdateThrottle, ProductCreateThrottle, ProductSearchThrottle, \
+    ProductUpdateThrottle, throttle_stats
 
 
 # Page number and limit offset pagination are good for small- to medium-sized
@@ -19,20 +45,341 @@ from store.serializers import ProductSerializer, ProductStatsSerializer
 class ProductsPagination(LimitOffsetPagination):
     default_limit = 10
     max_limit = 100
+    # set by paginate_queryset() and apaginate_queryset()
+    request = limit = count = offset = None
+
+    # paginate_queryset() for the async views
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [product async for product in
+                queryset[self.offset:self.offset + self.limit]]
+
+
+# Keyset pagination seeks straight to the rows after the last one of the
+# previous page through the ordering columns, so deep pages cost the same as
+# the first one, and it doesn't need to run a COUNT(*) query on every page.
+# The position is handed to the client as an opaque signed cursor, which means
+# that only forward links can be followed.
+#   "next": "http://127.0.0.1:8000/api/v1/products/?cursor=eyJvIjoiaWQ...",
+#   "results": [ ... ]
+class ProductsKeysetPagination(BasePagination):
+    default_limit = ProductsPagination.default_limit
+    max_limit = ProductsPagination.max_limit
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # each ordering ends with the primary key so that rows sharing the same
+    # sale_start still have a unique position
+    orderings = {
+        'id': ('id',),
+        'sale_start': ('sale_start', 'id'),
+    }
+    signer = Signer(salt='store.products.cursor')
+    invalid_cursor_message = 'Invalid cursor'
+    # set by paginate_queryset() and apaginate_queryset()
+    request = limit = ordering = has_next = page = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page([product async for product in queryset])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.ordering, position = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.get_order_by())
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+        # fetching one extra row tells us if there is a next page
+        return queryset[:self.limit + 1]
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.limit
+        self.page = results[:self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        if limit <= 0:
+            return self.default_limit
+        return min(limit, self.max_limit)
+
+    # The parameter is the one of the OrderingFilter, whose other orderings
+    # can't be followed by a cursor: they are rejected rather than ignored.
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, 'id')
+        if ordering not in self.orderings:
+            raise ValidationError({self.ordering_query_param: [
+                'Cursor pagination can only order by {}.'.format(
+                    ', '.join(self.orderings))]})
+        return ordering
+
+    def get_order_by(self):
+        # nulls go first on every database, the position filter relies on it
+        return [F(field).asc(nulls_first=True)
+                for field in self.orderings[self.ordering]]
+
+    def get_position_filter(self, position):
+        if self.ordering == 'id':
+            return Q(id__gt=position['id'])
+
+        sale_start, last_id = position['sale_start'], position['id']
+        if sale_start is None:
+            return Q(sale_start__isnull=True, id__gt=last_id) | \
+                Q(sale_start__isnull=False)
+        return Q(sale_start__gt=sale_start) | \
+            Q(sale_start=sale_start, id__gt=last_id)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = {}
+        for field in self.orderings[self.ordering]:
+            value = getattr(last, field)
+            position[field] = value.isoformat() \
+                if isinstance(value, datetime) else value
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(position))
+
+    def encode_cursor(self, position):
+        return self.signer.sign_object({'o': self.ordering, 'p': position})
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return self.get_ordering(request), None
+
+        try:
+            cursor = self.signer.unsign_object(encoded)
+            ordering, position = cursor['o'], cursor['p']
+            if ordering not in self.orderings:
+                raise ValueError(ordering)
+            if position.get('sale_start') is not None:
+                position['sale_start'] = parse_datetime(
+                    position['sale_start'])
+        except (BadSignature, KeyError, TypeError, ValueError,
+                AttributeError) as exc:
+            raise NotFound(self.invalid_cursor_message) from exc
+        return ordering, position
+
+
+# Mixin for the views that serialize products: it fetches the cart items of
+# all the products handed to the serializer in one query, so that serializing
+# a page of products costs the same number of queries regardless of its size.
+class CartItemsMixin:
+    def get_serializer(self, *args, **kwargs):
+        instance = args[0] if args else kwargs.get('instance')
+        if instance is not None and self.needs_cart_items():
+            products = instance if kwargs.get('many') else [instance]
+            kwargs['context'] = self.get_serializer_context()
+            kwargs['context']['cart_items'] = \
+                ShoppingCartItem.objects.grouped_by_product(products)
+        return super().get_serializer(*args, **kwargs)
+
+    # whether the instances being serialized already have their cart items
+    def includes_cart_items(self):
+        return False
+
+    def needs_cart_items(self):
+        return not self.includes_cart_items()
+
+
+# Mixin for the views that serialize products, which lets the clients pick
+# the fields of the responses, e.g. ?fields=id,name,price for a dropdown or
+# ?exclude=cart_items. The other fields are removed from the serializer
+# before anything is serialized: the cart items are only read when they are
+# part of the response, and the products are read with only the columns
+# needed by the remaining fields. Writes always respond with all the fields.
+class SparseFieldsMixin:
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+    # the columns read whatever the fields
+    required_columns: tuple[str, ...] = ('id',)
+
+    # The names of the fields to serialize, or None for all of them. Unknown
+    # fields are rejected with a 400.
+    def get_sparse_fields(self):
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = self.parse_sparse_fields()
+        return self._sparse_fields
+
+    def parse_sparse_fields(self):
+        if self.request.method not in SAFE_METHODS:
+            return None
+        included = self.get_field_names(self.fields_query_param)
+        excluded = self.get_field_names(self.exclude_query_param)
+        if included is None and excluded is None:
+            return None
+
+        readable = {name for name, field
+                    in self.get_serializer_class()().fields.items()
+                    if not field.write_only}
+        errors = {}
+        for param, names in ((self.fields_query_param, included),
+                             (self.exclude_query_param, excluded)):
+            unknown = (names or set()) - readable
+            if unknown:
+                errors[param] = 'unknown fields: {}'.format(
+                    ', '.join(sorted(unknown)))
+        if errors:
+            raise ValidationError(errors)
+        return (readable if included is None else included) - \
+            (excluded or set())
+
+    # e.g. ?fields=id,name&fields=price
+    def get_field_names(self, param):
+        names = {name.strip()
+                 for value in self.request.query_params.getlist(param)
+                 for name in value.split(',')}
+        names.discard('')
+        return names or None
+
+    def get_serializer(self, *args, **kwargs):
+        return self.select_fields(super().get_serializer(*args, **kwargs))
+
+    def select_fields(self, serializer):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            child = serializer.child \
+                if isinstance(serializer, serializers.ListSerializer) \
+                else serializer
+            for name in list(child.fields):
+                if name not in fields:
+                    child.fields.pop(name)
+        return serializer
+
+    def needs_cart_items(self):
+        fields = self.get_sparse_fields()
+        return (fields is None or 'cart_items' in fields) and \
+            super().needs_cart_items()
+
+    def filter_queryset(self, queryset):
+        return self.only_selected_columns(super().filter_queryset(queryset))
+
+    # The columns of the fields are the model fields of the same name, and
+    # the ones read by the method fields (see
+    # ProductSerializer.method_field_columns). The annotations of the
+    # queryset are computed by the database either way.
+    def only_selected_columns(self, queryset):
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+        model_fields = {field.name
+                        for field in queryset.model._meta.concrete_fields}
+        method_field_columns = \
+            self.get_serializer_class().method_field_columns
+        columns = set(self.required_columns)
+        for name in fields:
+            if name in model_fields:
+                columns.add(name)
+            columns.update(method_field_columns.get(name, ()))
+        return queryset.only(*columns)
+
+
+# Mixin for the views that support conditional requests. Their validators
+# (ETag and Last-Modified, see store/cache.py) are computed from a few
+# columns, so clients and CDNs polling with If-None-Match or
+# If-Modified-Since get a 304 before anything is serialized, and If-Match
+# makes writes fail with a 412 when the resource changed in the meantime.
+class ConditionalResponseMixin:
+    def conditional_response(self, request, validators, response):
+        response['ETag'] = validators['etag']
+        response['Last-Modified'] = http_date(validators['last_modified'])
+        patch_cache_control(response,
+                            max_age=product_cache.get_max_age(validators))
+        return get_conditional_response(
+            request, etag=validators['etag'],
+            last_modified=validators['last_modified'], response=response)
+
+    # Returns the response to send instead of going on with the request, or
+    # None when the preconditions pass.
+    def check_preconditions(self, request, validators):
+        placeholder = HttpResponse()
+        response = self.conditional_response(request, validators, placeholder)
+        return None if response is placeholder else response
+
+    # The data and the validators are cached together (see store/cache.py),
+    # so hits don't run any query. On a miss the validators are computed
+    # first, so that conditional requests are still answered without
+    # serializing. The X-Cache header tells whether it was a hit.
+    def cached_response(self, request, key, get_validators, build_data):
+        entry = product_cache.get_entry(key)
+        hit = entry is not None
+        if entry is None:
+            validators = get_validators()
+            response = self.check_preconditions(request, validators)
+            if response is not None:
+                return response
+            entry, hit = product_cache.build_entry(
+                key, lambda: product_cache.make_entry(build_data(),
+                                                      validators))
+
+        response = Response(entry['data'], headers=cache_headers(hit))
+        return self.conditional_response(request, entry, response)
+
+
+def cache_headers(hit):
+    return {'X-Cache': 'HIT' if hit else 'MISS'}
+
+
+# OrderingFilter with the names of the fields of the responses, which
+# order by the annotations they are read from, e.g. ?ordering=-current_price
+class ProductOrderingFilter(OrderingFilter):
+    sources = {'current_price': 'price_now'}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering is None:
+            return None
+        return [self.get_source(term) for term in ordering]
+
+    def get_source(self, term):
+        descending = term.startswith('-')
+        source = self.sources.get(term.lstrip('-'), term.lstrip('-'))
+        return '-' + source if descending else source
 
 
 # The generic views in Django REST framework will cover what you need from a
 # REST API in many cases. This is an example of a list API view
-class ProductList(ListAPIView):
-    queryset = Product.objects.all()
+class ProductList(SparseFieldsMixin, CartItemsMixin, ConditionalResponseMixin,
+                  ListAPIView):
+    # on_sale_now and price_now are computed by the database, so that
+    # products can be filtered and ordered by them
+    queryset = Product.objects.with_sale_info()
     serializer_class = ProductSerializer
+    # the keyset pagination reads the position of the last product from them
+    required_columns = ('id', 'sale_start')
     # we add the ability to filter products using URL query parameters
-    filter_backends = (DjangoFilterBackend, SearchFilter)
+    filter_backends = (DjangoFilterBackend, ProductSearchFilter,
+                       ProductOrderingFilter)
     # this is used by the DjangoFilterBackend to filter products by ID
     filter_fields = ('id',)
-    # this is used by the SearchFilter backend to map from the URL query
-    # parameters, to the model fields of the serialized model
-    search_fields = ('name', 'description')
+    # the ProductSearchFilter uses the full-text search backend of the
+    # database to match the ?search= terms against the name and description
+    # of the products, ordering the results by relevance. This is used by the
+    # OrderingFilter to pick another ordering, e.g. ?ordering=-current_price
+    ordering_fields = ('id', 'name', 'price', 'current_price', 'sale_start')
     # using offset pagination
     # now the api result will include things like:
     #   "count": 4,
@@ -40,23 +387,171 @@ class ProductList(ListAPIView):
     #   "previous": "http://127.0.0.1:8000/api/v1/products?limit=1",
     #   "results": [ ... ]
     pagination_class = ProductsPagination
+    # searches are throttled per client, see store/throttling.py
+    throttle_classes = (ProductSearchThrottle,)
+    # keyset pagination is opt-in: clients ask for it with ?pagination=cursor
+    # (and keep it by following the next links), or it can be made the
+    # default with the PRODUCTS_PAGINATION setting. Requests that send an
+    # offset always get limit/offset pagination, so existing clients keep
+    # working either way.
+    keyset_pagination_class = ProductsKeysetPagination
+    _paginator = None
+
+    @property
+    def paginator(self):
+        if self._paginator is None:
+            self._paginator = self.get_pagination_class()()
+        return self._paginator
+
+    def get_pagination_class(self):
+        params = self.request.query_params
+        if 'offset' in params:
+            return self.pagination_class
+        if 'cursor' in params:
+            return self.keyset_pagination_class
+        mode = params.get('pagination', settings.PRODUCTS_PAGINATION)
+        if mode == 'cursor':
+            return self.keyset_pagination_class
+        return self.pagination_class
+
+    # Pages are served from the cache while the catalog doesn't change, see
+    # store/cache.py. Any product of the catalog can enter or leave a page
+    # when its sale starts or ends (e.g. with ?on_sale=true), so the pages
+    # expire at the next sale boundary of the whole catalog.
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, product_cache.product_list_key(request),
+            self.get_validators,
+            lambda: self.build_list(request, *args, **kwargs),
+        )
+
+    def build_list(self, request, *args, **kwargs):
+        if not self.uses_row_serializer():
+            return super().list(request, *args, **kwargs).data
+        row_serializer = self.get_row_serializer()
+        page = self.paginate_queryset(row_serializer.rows(
+            self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(
+            row_serializer.serialize(page)).data
 
-    # we are also to filter products by whether they are on sale or not
+    # With the PRODUCTS_ROW_SERIALIZER setting, the products are serialized
+    # from rows by ProductRowSerializer, with the fields and the context of
+    # the serializer of the view.
+    def uses_row_serializer(self):
+        return settings.PRODUCTS_ROW_SERIALIZER
+
+    def get_row_serializer(self):
+        return ProductRowSerializer(self.get_serializer(),
+                                    self.required_columns)
+
+    # The validators change whenever the catalog does, or a sale starts or
+    # ends (see product_cache.list_etag()), so they are computed without
+    # reading the products matching the filters, nor finding the page.
+    def get_validators(self):
+        generation = product_cache.get_version(product_cache.GENERATION_KEY)
+        catalog_version = product_cache.catalog_version()
+        return self.make_validators(
+            generation, catalog_version, product_cache.catalog_modified(),
+            product_cache.catalog_sale_boundaries(
+                generation, catalog_version,
+                Product.objects.sale_boundaries))
+
+    # from what get_validators() reads, which the async view reads with the
+    # async ORM and cache instead
+    def make_validators(self, generation, catalog_version, catalog_modified,
+                        boundaries):
+        last_boundary, next_boundary = boundaries
+        return product_cache.make_validators(
+            product_cache.list_etag(generation, catalog_version, self.request,
+                                    last_boundary),
+            catalog_modified, last_boundary, next_boundary)
+
+    # we are also to filter products by whether they are on sale or not.
+    # The queryset computes on_sale_now with the same rule as the model, so
+    # a sale without an end date counts as on sale here too.
     def get_queryset(self):
+        if self.uses_read_model():
+            queryset = ProductListing.objects.with_sale_info()
+        else:
+            queryset = super().get_queryset()
         on_sale = self.request.query_params.get('on_sale', None)
-        if on_sale is None:
-            return super().get_queryset()  # don't do anything
+        if on_sale is not None and on_sale.lower() == 'true':
+            return queryset.filter(on_sale_now=True)
+        return queryset
 
-        queryset = Product.objects.all()
-        if on_sale.lower() == 'true':
-            now = timezone.now()
-            return queryset.filter(sale_start__lte=now, sale_end__gte=now)
+    # With the PRODUCTS_READ_MODEL setting, the pages are read from the
+    # product read model (see store/listings.py) in a single query that
+    # includes the cart items and the prices. Searches still go through the
+    # products, which have the full-text index.
+    def uses_read_model(self):
+        return listings.enabled() and not self.search_terms()
 
-        return queryset
+    def search_terms(self):
+        return ProductSearchFilter().get_search_terms(self.request)
+
+    def get_serializer_class(self):
+        if self.uses_read_model():
+            return ProductListingSerializer
+        return super().get_serializer_class()
+
+    def includes_cart_items(self):
+        return self.uses_read_model()
+
+
+# Streams the whole catalog, or the products matching the same filters as
+# ProductList, as NDJSON (export.ndjson) or CSV (export.csv). The products
+# are read with a server-side cursor and serialized in chunks, each with a
+# single query for its cart items, so the memory used doesn't grow with the
+# catalog. The format is part of the path because DRF reserves ?format= to
+# pick a renderer.
+class ProductExport(ProductList):
+    export_formats = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    def list(self, request, *args, **kwargs):
+        export_format = kwargs['export_format']
+        if export_format not in self.export_formats:
+            raise NotFound()
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.ordered:
+            queryset = queryset.order_by('id')
+        if self.uses_row_serializer():
+            row_serializer = self.get_row_serializer()
+            queryset = row_serializer.rows(queryset)
+            serialize = row_serializer.serialize
+        else:
+            serialize = self.serialize_products
+        records = self.serialize(serialize, queryset.iterator(
+            chunk_size=settings.PRODUCTS_EXPORT_CHUNK_SIZE))
+        if export_format == 'csv':
+            lines = csv_lines(self.get_export_fields(), records)
+        else:
+            lines = ndjson_lines(records)
+
+        response = StreamingHttpResponse(
+            lines, content_type=self.export_formats[export_format])
+        response['Content-Disposition'] = \
+            'attachment; filename="products.{}"'.format(export_format)
+        return response
+
+    def serialize(self, serialize, products):
+        for chunk in chunked(products, settings.PRODUCTS_EXPORT_CHUNK_SIZE):
+            yield from serialize(chunk)
+
+    def serialize_products(self, products):
+        return self.get_serializer(products, many=True).data
+
+    def get_export_fields(self):
+        return [name for name, field in self.get_serializer().fields.items()
+                if not field.write_only]
 
 
 class ProductCreate(CreateAPIView):
     serializer_class = ProductSerializer
+    throttle_classes = (ProductCreateThrottle,)
 
     def create(self, request, *args, **kwargs):
         # add the validation of the price for avoiding creating free products
@@ -74,47 +569,312 @@ class ProductCreate(CreateAPIView):
 
 # The generic RetrieveUpdateDestroyAPIView combines the “get”, “put”, “patch”,
 # and “delete” HTTP methods into one API view.
-class ProductRetrieveUpdateDestroy(RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+class ProductRetrieveUpdateDestroy(SparseFieldsMixin, CartItemsMixin,
+                                   ConditionalResponseMixin,
+                                   RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.with_sale_info()
     lookup_field = 'id'
     serializer_class = ProductSerializer
+    # the writes are throttled per client
+    throttle_classes = (ProductUpdateThrottle,)
+    # the columns read by get_validators()
+    validator_fields = ('version', 'updated_at', 'on_sale_now', 'sale_start',
+                        'sale_end')
 
-    # in a real-world scenario we'll prob need to clear all the cache
-    # linked to this product that's being destroyed
-    def delete(self, request, *args, **kwargs):
-        product_id = self.request.data.get('id')
-        response = super().delete(request, *args, **kwargs)
-        # if object was deleted successfully, remove all associated cache
-        if response.status_code == 204:
-            cache.delete(f'product_data_{product_id}')
-        return response
+    # Products are served from the cache until their version changes. The
+    # cache doesn't need to be cleared here when a product is updated or
+    # destroyed: the model signals bump its version on every write, including
+    # the ones made from the admin site or the shell.
+    # The response expires when the sale of the product starts or ends.
+    def retrieve(self, request, *args, **kwargs):
+        build_detail = super().retrieve
+        product_id = kwargs[self.lookup_field]
+        return self.cached_response(
+            request, product_cache.product_detail_key(product_id, request),
+            lambda: self.get_validators(product_id),
+            lambda: build_detail(request, *args, **kwargs).data,
+        )
 
+    # Updates sent with If-Match (or If-Unmodified-Since) are only applied if
+    # the product didn't change since the client read it. The row stays
+    # locked until the update is saved, so two clients sending the same ETag
+    # can't both succeed.
     def update(self, request, *args, **kwargs):
-        response = super().update(request, *args, **kwargs)
-        if response.status_code == 200:
-            product = response.data
-            cache.set(f"product_data_{product['id']}", {
-                'name': product['name'],
-                'description': product['description'],
-                'price': product['price']
-            })
+        with transaction.atomic():
+            if 'HTTP_IF_MATCH' in request.META or \
+                    'HTTP_IF_UNMODIFIED_SINCE' in request.META:
+                validators = self.get_validators(kwargs[self.lookup_field],
+                                                 lock=True)
+                response = self.check_preconditions(request, validators)
+                if response is not None:
+                    return response
+            response = super().update(request, *args, **kwargs)
+            # once the cache version of the product is bumped
+            transaction.on_commit(lambda: self.set_etag(response))
         return response
 
+    def set_etag(self, response):
+        product = self.updated_product
+        response['ETag'] = product_cache.product_etag(
+            product.id, product.version,
+            product_cache.product_version(product.id), product.is_on_sale())
+
+    # set by perform_update(), for set_etag()
+    updated_product = None
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.updated_product = serializer.instance
+
+    def get_validators(self, product_id, lock=False):
+        queryset = self.get_queryset().filter(id=product_id)
+        if lock:
+            queryset = queryset.select_for_update()
+        return self.make_validators(
+            product_id, queryset.values(*self.validator_fields).first(),
+            product_cache.product_version(product_id),
+            product_cache.catalog_modified())
+
+    # The changes to the cart items of the product don't leave an
+    # updated_at, so they are covered by when the catalog last changed.
+    def make_validators(self, product_id, product, cache_version,
+                        catalog_modified):
+        if product is None:
+            raise Http404
+
+        last_boundary, next_boundary = product_cache.sale_boundaries(
+            [(product['sale_start'], product['sale_end'])], timezone.now())
+        return product_cache.make_validators(
+            product_cache.product_etag(product_id, product['version'],
+                                       cache_version, product['on_sale_now']),
+            max(product['updated_at'].timestamp(), catalog_modified),
+            last_boundary, next_boundary)
+
+
+# Redirects to the warranty file of a product, which is served from the
+# media storage like the photos.
+class ProductWarranty(APIView):
+    def get(self, request, format=None, id=None):
+        product = Product.objects.select_related('warranty').filter(
+            id=id).first()
+        if product is None or product.warranty is None:
+            raise NotFound()
+        return HttpResponseRedirect(product.warranty.file.url)
+
 
 # Composite fields are highly useful when you're trying to return
 # data that needs to be structured in a specific way that may not map to any
 # model.
-class ProductStats(GenericAPIView):
+class ProductStats(ConditionalResponseMixin, GenericAPIView):
     lookup_field = 'id'
     serializer_class = ProductStatsSerializer
     queryset = Product.objects.all()
 
+    # The stats are summed from the pre-aggregated daily rows of the product
+    # (see store/stats.py), so the response time doesn't grow with the
+    # history. e.g. ?from=2019-01-01&to=2019-12-31&granularity=month
+    # Without a range, the last 30 days are returned.
     def get(self, request, format=None, id=None):
-        obj = self.get_object()
+        period = self.get_range(request)
+        validators = self.get_validators(id, period)
+        response = self.check_preconditions(request, validators)
+        if response is not None:
+            return response
+
         serializer = ProductStatsSerializer({
-            'stats': {
-                '2019-01-01': [5, 10, 15],
-                '2019-01-02': [20, 1, 1]
-            }
+            'stats': stats.series(id, *period),
         })
+        return self.conditional_response(request, validators,
+                                         Response(serializer.data))
+
+    def get_range(self, request):
+        default_start, default_end = stats.default_range()
+        start = self.get_date(request, 'from', default_start)
+        end = self.get_date(request, 'to', default_end)
+        if start > end:
+            raise ValidationError({'from': 'must be before to'})
+
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in stats.GRANULARITIES:
+            raise ValidationError({'granularity': 'must be one of {}'.format(
+                ', '.join(stats.GRANULARITIES))})
+        return start, end, granularity
+
+    def get_date(self, request, param, default):
+        value = request.query_params.get(param)
+        if value is None:
+            return default
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValidationError({param: 'must be a date (YYYY-MM-DD)'})
+        return date
+
+    # The cart items of the product bump its cache version when they change,
+    # once their stats are recorded (see store/carts.py). The period is
+    # (start, end, granularity), from get_range().
+    def get_validators(self, product_id, period):
+        return self.make_validators(
+            product_id, self.get_queryset().filter(id=product_id).values(
+                'version', 'updated_at').first(),
+            product_cache.product_version(product_id),
+            product_cache.catalog_modified(), period)
+
+    def make_validators(self, product_id, product, cache_version,
+                        catalog_modified, period):
+        if product is None:
+            raise Http404
+        return product_cache.make_validators(
+            '"stats-{}-{}-{}-{}-{}-{}"'.format(
+                product_id, product['version'], cache_version, *period),
+            max(product['updated_at'].timestamp(), catalog_modified))
+
+
+# Creates (POST), updates (PATCH) or deletes (DELETE) many products in one
+# request and one transaction. The whole request is rejected when any item
+# is invalid, with the errors of the invalid items by their index, like
+# DRF's list serializers report them.
+class ProductBulk(GenericAPIView):
+    serializer_class = ProductSerializer
+    throttle_classes = (ProductBulkCreateThrottle, ProductBulkUpdateThrottle)
+
+    def get_queryset(self):
+        return Product.objects.all()
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.PRODUCTS_BULK_MAX_ITEMS)
+        return super().get_serializer(*args, many=True, **kwargs)
+
+    def post(self, request, format=None):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            products = serializer.save()
+        return Response({'created': [product.id for product in products]},
+                        status=201)
+
+    # every item has the id of the product and the fields to change
+    def patch(self, request, format=None):
+        with transaction.atomic():
+            products = self.get_products(
+                item.get('id') for item in self.get_items(request)
+                if isinstance(item, dict))
+            serializer = self.get_serializer(products, data=request.data,
+                                             partial=True)
+            serializer.is_valid(raise_exception=True)
+            products = serializer.save()
+        return Response({'updated': [product.id for product in products]})
+
+    # the data is the list of the ids of the products
+    def delete(self, request, format=None):
+        product_ids = serializers.ListField(
+            child=serializers.IntegerField(),
+            max_length=settings.PRODUCTS_BULK_MAX_ITEMS,
+        ).run_validation(request.data)
+        with transaction.atomic():
+            products = self.get_products(product_ids)
+            errors = {index: {'id': ['Not found.']}
+                      for index, product_id in enumerate(product_ids)
+                      if product_id not in products}
+            if errors:
+                raise ValidationError(errors)
+            # deleting goes through the signals, one product at a time
+            with product_cache.batched_invalidation():
+                self.get_queryset().filter(id__in=products).delete()
+        return Response(status=204)
+
+    def get_items(self, request):
+        return request.data if isinstance(request.data, list) else []
+
+    def get_products(self, product_ids):
+        product_ids = [product_id for product_id in product_ids
+                       if isinstance(product_id, int)]
+        return self.get_queryset().select_for_update().in_bulk(product_ids)
+
+
+# Hit, miss and rebuild counters of the product response cache
+class ProductCacheStats(APIView):
+    def get(self, request, format=None):
+        return Response(product_cache.cache_stats())
+
+
+# Requests throttled per scope, across all the processes
+class ThrottleStats(APIView):
+    def get(self, request, format=None):
+        return Response(throttle_stats())
+
+
+# Mixin for the views of the items of a shopping cart, given by the cart_id
+# of the URL. Like the storefront (see store.views.cart()), a visitor only
+# gets to the cart whose id is stored in their session, staff users to any
+# of them. The other carts are answered with a 404 like the missing ones, so
+# their ids can't be probed.
+class CartMixin:
+    def check_cart(self, cart_id):
+        if not self.owns_cart(cart_id) or \
+                not ShoppingCart.objects.filter(id=cart_id).exists():
+            raise NotFound()
+
+    def owns_cart(self, cart_id):
+        return self.request.user.is_staff or \
+            self.request.session.get('shopping_cart_id') == cart_id
+
+
+# GET lists the items of a shopping cart. POST adds a product to it, or more
+# units of the product when the cart already has it, and responds with the
+# item: {"product": 1, "quantity": 2}. The quantities are changed atomically
+# so that concurrent additions all count, see store/carts.py.
+class CartItemList(CartMixin, GenericAPIView):
+    serializer_class = CartItemSerializer
+    throttle_classes = (CartThrottle,)
+
+    def get_queryset(self):
+        return ShoppingCartItem.objects.filter(
+            shopping_cart_id=self.kwargs['cart_id']).order_by('id')
+
+    def get(self, request, format=None, cart_id=None):
+        self.check_cart(cart_id)
+        serializer = self.get_serializer(self.get_queryset(), many=True)
         return Response(serializer.data)
+
+    def post(self, request, format=None, cart_id=None):
+        self.check_cart(cart_id)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            item, created = carts.add_item(
+                cart_id, serializer.validated_data['product'].id,
+                serializer.validated_data['quantity'])
+        return Response(self.get_serializer(item).data,
+                        status=201 if created else 200)
+
+
+# DELETE removes a product from a shopping cart
+class CartItemDestroy(CartMixin, APIView):
+    throttle_classes = (CartThrottle,)
+
+    def delete(self, request, format=None, cart_id=None, product_id=None):
+        if not self.owns_cart(cart_id) or \
+                not carts.remove_item(cart_id, product_id):
+            raise NotFound()
+        return Response(status=204)
+
+
+# POST adds units of a product to the item of a shopping cart, or removes
+# some with a negative quantity: {"quantity": -1}
+class CartItemIncrement(CartMixin, GenericAPIView):
+    serializer_class = CartItemIncrementSerializer
+    throttle_classes = (CartThrottle,)
+
+    def post(self, request, format=None, cart_id=None, product_id=None):
+        if not self.owns_cart(cart_id):
+            raise NotFound()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            item, _ = carts.add_item(cart_id, product_id,
+                                     serializer.validated_data['quantity'],
+                                     create=False)
+        return Response(CartItemSerializer(item).data)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StoreConfig(AppConfig):
     name = 'store'
+
+    def ready(self):
+        # connects the signal receivers
+        import store.signals  # noqa: F401 pylint: disable=unused-import,import-outside-toplevel
@@ -0,0 +1,204 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework.views import APIView
+
+from store import cache as product_cache
+from store import stats
+from store.api_views import ConditionalResponseMixin, ProductList, \
+    ProductRetrieveUpdateDestroy, ProductStats, cache_headers
+from store.models import Product, ShoppingCartItem
+from store.renderers import FastJSONRenderer
+from store.serializers import ProductStatsSerializer
+
+
+# The product reads of the API as async views, for the ASGI deployment (see
+# demo/asgi.py). While they wait on the database or the cache, the worker
+# goes on with other requests instead of blocking a thread per request.
+# They answer like the API views: the same JSON, validators and cached
+# entries, which they get from an instance of the API view with the async
+# ORM and the async variants of the cache helpers of store/cache.py.
+# Django's async ORM still runs the queries in a single thread per process
+# (there is no async database driver), so queries don't run concurrently,
+# but everything around them does.
+class AsyncAPIView(ConditionalResponseMixin, View):
+    # the API view the requests are delegated to, set by the subclasses
+    view_class: type[APIView]
+    # its instance for the current request, created by adispatch()
+    view: APIView
+    renderer = FastJSONRenderer()
+
+    # View.dispatch() calls the handler, so the async handlers make it return
+    # a coroutine
+    def dispatch(self, request, *args, **kwargs):
+        return self.adispatch(request, *args, **kwargs)
+
+    # like APIView.dispatch(): the handlers get the request of the API view,
+    # with its authenticators and parsers
+    async def adispatch(self, request, *args, **kwargs):
+        view = self.view = self.view_class(args=args, kwargs=kwargs)
+        request = view.request = view.initialize_request(request, *args,
+                                                         **kwargs)
+        try:
+            await self.initial(view, request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(view, exc)
+
+    # The checks of APIView.initial(), with the classes of the API view. The
+    # authentication and the permissions can read the session and the user
+    # from the database, so they run in the thread of the async ORM, and the
+    # throttles take their tokens with the async cache.
+    async def initial(self, view, request):
+        view.format_kwarg = view.get_format_suffix(**view.kwargs)
+        request.accepted_renderer, request.accepted_media_type = \
+            view.perform_content_negotiation(request)
+        request.version, request.versioning_scheme = view.determine_version(
+            request, *view.args, **view.kwargs)
+
+        def check_user():
+            view.perform_authentication(request)
+            view.check_permissions(request)
+
+        await sync_to_async(check_user)()
+        waits = [throttle.wait() for throttle in view.get_throttles()
+                 if not await throttle.aallow_request(request, view)]
+        if waits:
+            view.throttled(request, max(waits))
+
+    # with the same error responses as DRF, e.g. {"detail": "Not found."}
+    def handle_exception(self, view, exc):
+        response = view.handle_exception(exc)
+        headers = {name: value for name, value in response.items()
+                   if name != 'Content-Type'}
+        return self.render(response.data, status=response.status_code,
+                           headers=headers)
+
+    def render(self, data, status=200, headers=None):
+        return HttpResponse(self.renderer.render(data), status=status,
+                            content_type=self.renderer.media_type,
+                            headers=headers)
+
+    # See ConditionalResponseMixin.cached_response(), get_validators and
+    # build_data are coroutine functions here.
+    async def acached_response(self, request, key, get_validators,
+                               build_data):
+        entry = await product_cache.aget_entry(key)
+        hit = entry is not None
+        if entry is None:
+            validators = await get_validators()
+            response = self.check_preconditions(request, validators)
+            if response is not None:
+                return response
+
+            async def build():
+                return product_cache.make_entry(await build_data(),
+                                                validators)
+
+            entry, hit = await product_cache.abuild_entry(key, build)
+
+        response = self.render(entry['data'], headers=cache_headers(hit))
+        return self.conditional_response(request, entry, response)
+
+    # the cart items of the products are read here, unless the view has them
+    # already or they are not in the response, so that serializing them
+    # doesn't run any query
+    async def get_serializer(self, view, products, many=False):
+        context = view.get_serializer_context()
+        if view.needs_cart_items():
+            context['cart_items'] = \
+                await ShoppingCartItem.objects.agrouped_by_product(
+                    products if many else [products])
+        return view.select_fields(view.get_serializer_class()(
+            products, many=many, context=context))
+
+
+# See ProductList, which filters and paginates the products.
+class AsyncProductList(AsyncAPIView):
+    view_class = ProductList
+
+    async def get(self, request):
+        view = self.view
+        return await self.acached_response(
+            request, await product_cache.aproduct_list_key(request),
+            lambda: self.get_validators(view),
+            lambda: self.build_data(view),
+        )
+
+    async def get_validators(self, view):
+        generation = await product_cache.aget_version(
+            product_cache.GENERATION_KEY)
+        catalog_version = await product_cache.acatalog_version()
+        return view.make_validators(
+            generation, catalog_version,
+            await product_cache.acatalog_modified(),
+            await product_cache.acatalog_sale_boundaries(
+                generation, catalog_version,
+                Product.objects.asale_boundaries))
+
+    async def build_data(self, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        if view.uses_row_serializer():
+            row_serializer = view.get_row_serializer()
+            rows = await paginator.apaginate_queryset(
+                row_serializer.rows(queryset), view.request, view=view)
+            # like the async ORM, for the query of the cart items
+            data = await sync_to_async(row_serializer.serialize)(rows)
+        else:
+            products = await paginator.apaginate_queryset(
+                queryset, view.request, view=view)
+            data = (await self.get_serializer(view, products, many=True)).data
+        return paginator.get_paginated_response(data).data
+
+
+# See ProductRetrieveUpdateDestroy, only for reading.
+class AsyncProductDetail(AsyncAPIView):
+    view_class = ProductRetrieveUpdateDestroy
+
+    async def get(self, request, id):
+        view = self.view
+        return await self.acached_response(
+            request, await product_cache.aproduct_detail_key(id, request),
+            lambda: self.get_validators(view, id),
+            lambda: self.build_data(view, id),
+        )
+
+    async def get_validators(self, view, product_id):
+        return view.make_validators(
+            product_id, await view.get_queryset().filter(id=product_id)
+            .values(*view.validator_fields).afirst(),
+            await product_cache.aproduct_version(product_id),
+            await product_cache.acatalog_modified())
+
+    async def build_data(self, view, product_id):
+        try:
+            product = await view.filter_queryset(view.get_queryset()) \
+                .aget(id=product_id)
+        except Product.DoesNotExist as exc:
+            raise Http404 from exc
+        serializer = await self.get_serializer(view, product)
+        return serializer.data
+
+
+# See ProductStats.
+class AsyncProductStats(AsyncAPIView):
+    view_class = ProductStats
+
+    async def get(self, request, id):
+        view = self.view
+        period = view.get_range(request)
+        validators = view.make_validators(
+            id, await view.get_queryset().filter(id=id).values(
+                'version', 'updated_at').afirst(),
+            await product_cache.aproduct_version(id),
+            await product_cache.acatalog_modified(), period)
+        response = self.check_preconditions(request, validators)
+        if response is not None:
+            return response
+
+        serializer = ProductStatsSerializer({
+            'stats': await stats.aseries(id, *period),
+        })
+        return self.conditional_response(request, validators,
+                                         self.render(serializer.data))
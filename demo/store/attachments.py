@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from store.models import Attachment
+
+# the fields of the requests whose files are stored as attachments
+ATTACHMENT_FIELDS = ('warranty',)
+
+
+def size_error(max_size):
+    return 'The file is larger than {} bytes.'.format(max_size)
+
+
+def check_size(file, max_size=None):
+    if max_size is None:
+        max_size = settings.ATTACHMENT_MAX_SIZE
+    if file.size is not None and file.size > max_size:
+        raise ValidationError(size_error(max_size))
+
+
+# Reads an uploaded file one chunk at a time to hash it, without loading it
+# in memory, and rejects it as soon as it goes over max_size.
+def hash_file(file, max_size):
+    check_size(file, max_size)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks():
+        size += len(chunk)
+        if size > max_size:
+            raise ValidationError(size_error(max_size))
+        digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+# The first of the FILE_UPLOAD_HANDLERS. Stops receiving an attachment as
+# soon as it goes over ATTACHMENT_MAX_SIZE, instead of buffering it whole
+# before the serializer rejects it. The request fails with the same 400 as
+# the validation of the field.
+class AttachmentUploadHandler(FileUploadHandler):
+    def receive_data_chunk(self, raw_data, start):
+        max_size = settings.ATTACHMENT_MAX_SIZE
+        if self.field_name in ATTACHMENT_FIELDS and \
+                start + len(raw_data) > max_size:
+            raise ValidationError({self.field_name: [size_error(max_size)]})
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+# Returns the attachment with the content of the file. Identical files are
+# only stored once: an existing attachment with the same hash is reused.
+def store_attachment(file, max_size=None):
+    if max_size is None:
+        max_size = settings.ATTACHMENT_MAX_SIZE
+    content_hash, size = hash_file(file, max_size)
+    attachment = Attachment.objects.filter(content_hash=content_hash).first()
+    if attachment is not None:
+        return attachment
+
+    extension = os.path.splitext(file.name or '')[1].lower()
+    attachment = Attachment(content_hash=content_hash, size=size)
+    file.seek(0)
+    attachment.file.save(content_hash + extension, file, save=False)
+    try:
+        with transaction.atomic():
+            attachment.save()
+    except IntegrityError:
+        # stored by a concurrent request in the meantime
+        attachment.file.delete(save=False)
+        attachment = Attachment.objects.get(content_hash=content_hash)
+    return attachment
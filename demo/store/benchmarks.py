@@ -0,0 +1,242 @@
+import http.client
+import json
+import re
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer, \
+    WSGIRequestHandler
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from store import cache as product_cache
+from store import prices
+from store.models import Product, ShoppingCart, ShoppingCartItem
+from store.search import get_search_backend
+
+
+# The benchmarks seed their own data inside a transaction that is always
+# rolled back, so they can be run against a development database without
+# leaving millions of synthetic rows behind.
+@contextmanager
+def rolled_back():
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+# one in three products gets a sale window, half of them already active
+def seed_products(count, batch_size=10000):
+    now = timezone.now()
+    created = 0
+    while created < count:
+        batch = []
+        for i in range(created, min(created + batch_size, count)):
+            sale_start = None
+            sale_end = None
+            if i % 3 == 0:
+                sale_start = now + timedelta(days=(i % 20) - 10)
+                sale_end = sale_start + timedelta(days=7)
+            batch.append(Product(
+                name='Synthetic product {}'.format(i),
+                description='Synthetic product number {}'.format(i),
+                price=1.0 + i % 1000,
+                sale_start=sale_start,
+                sale_end=sale_end,
+            ))
+        Product.objects.bulk_create(batch, batch_size=batch_size)
+        prices.record(batch)
+        created += len(batch)
+
+
+# Every cart gets items_per_cart items of products spread over the catalog,
+# created over the last year so that the product stats have a history.
+def seed_carts(count, items_per_cart=3, batch_size=10000):
+    product_ids = list(Product.objects.order_by('id').values_list(
+        'id', flat=True))
+    now = timezone.now()
+    created = 0
+    while created < count:
+        carts = ShoppingCart.objects.bulk_create([
+            ShoppingCart(name='Synthetic cart {}'.format(i),
+                         address='Synthetic address {}'.format(i))
+            for i in range(created, min(created + batch_size, count))
+        ])
+        items = []
+        for cart in carts:
+            # a cart has one item per product
+            cart_product_ids = set()
+            for item in range(items_per_cart):
+                position = cart.id * 7919 + item * 104729
+                product_id = product_ids[position % len(product_ids)]
+                if product_id in cart_product_ids:
+                    continue
+                cart_product_ids.add(product_id)
+                items.append(ShoppingCartItem(
+                    shopping_cart=cart,
+                    product_id=product_id,
+                    quantity=1 + position % 5,
+                    created_at=now - timedelta(days=position % 365),
+                ))
+        ShoppingCartItem.objects.bulk_create(items, batch_size=batch_size)
+        created += len(carts)
+
+
+# bulk_create() doesn't send the signals that index the products
+def index_products(batch_size=10000):
+    backend = get_search_backend()
+    product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+    for start in range(0, product_ids.count(), batch_size):
+        backend.index_products(list(product_ids[start:start + batch_size]))
+
+
+# the REST_FRAMEWORK setting with every throttle turned off, for the
+# benchmarks sending more requests than the rates allow
+def unthrottled():
+    rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+    return dict(settings.REST_FRAMEWORK,
+                DEFAULT_THROTTLE_RATES={scope: None for scope in rates})
+
+
+# ALLOWED_HOSTS doesn't include the test client's default host
+def api_client():
+    return APIClient(SERVER_NAME='localhost')
+
+
+# The cached responses are dropped before each request, so that all of them
+# are timed as misses: the same URL would otherwise be served from the cache
+# after the first request, which only times the cache.
+def time_requests(client, url, repeat):
+    timings = []
+    for _ in range(repeat):
+        product_cache.bump_generation()
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    return {
+        'runs': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': round(percentile(0.50) * 1000, 3),
+        'p95_ms': round(percentile(0.95) * 1000, 3),
+        'p99_ms': round(percentile(0.99) * 1000, 3),
+    }
+
+
+# Times the requests sent concurrently, from threads or from coroutines,
+# and tracks how many of them were in flight at the same time.
+class ConcurrencyMeter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.timings = []
+
+    @contextmanager
+    def measure(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.in_flight -= 1
+                self.timings.append(elapsed)
+
+    def report(self, seconds):
+        result = summarize(self.timings)
+        result['requests_per_second'] = round(len(self.timings) / seconds, 1)
+        result['max_in_flight'] = self.max_in_flight
+        return result
+
+
+# Runs the project in a local WSGI server, like runserver does, for the
+# benchmarks that measure the whole HTTP stack. Yields the port.
+@contextmanager
+def wsgi_server():
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadedWSGIServer(('localhost', 0), QuietHandler,
+                                allow_reuse_address=False)
+    server.set_app(WSGIHandler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+SERVER_TIMING_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+# The number of queries of a request, from the Server-Timing header of the
+# instrumentation middleware (see store/instrumentation.py).
+def query_count(server_timing):
+    match = SERVER_TIMING_QUERIES_RE.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+# Sends the requests of the benchmarks through the test client or to a
+# server, with the cookies given, and returns (status, Server-Timing
+# header).
+class ClientTransport:
+    name = 'client'
+
+    def __init__(self):
+        self.client = api_client()
+
+    def request(self, method, url, data=None, cookies=None):
+        self.client.cookies.clear()
+        for name, value in (cookies or {}).items():
+            self.client.cookies[name] = value
+        response = getattr(self.client, method.lower())(url, data,
+                                                        format='json')
+        return response.status_code, response.get('Server-Timing')
+
+
+class WsgiTransport:
+    name = 'wsgi'
+
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, url, data=None, cookies=None):
+        connection = http.client.HTTPConnection('localhost', self.port)
+        headers = {}
+        if cookies:
+            headers['Cookie'] = '; '.join(
+                '{}={}'.format(name, value) for name, value in cookies.items())
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, url, body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status, response.getheader('Server-Timing')
+        finally:
+            connection.close()
@@ -0,0 +1,476 @@
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from store import instrumentation
+from store.routers import reading_from_replica_now
+
+# The cached product responses are never deleted. Instead, their keys embed
+# version counters that are bumped whenever a product changes, so a stale
+# entry simply stops being looked up and expires on its own:
+# - every product has its own version, used by the detail responses
+# - the catalog version is bumped on any product change, used by the lists
+# - the generation is bumped after migrations, which can change products
+#   without going through the signals, and invalidates everything
+GENERATION_KEY = 'store:generation'
+CATALOG_VERSION_KEY = 'store:catalog:version'
+PRODUCT_VERSION_KEY = 'store:product:{}:version'
+
+# the keys of the responses, see product_detail_key(), product_list_key()
+# and catalog_page_key()
+PRODUCT_DETAIL_KEY = 'store:product:{}:{}:{}:{}:{}'
+PRODUCT_LIST_KEY = 'store:products:{}:{}:{}:{}'
+PAGE_KEY = 'store:page:{}:{}:{}:{}:{}'
+# the sale boundaries of the catalog, see catalog_sale_boundaries()
+SALE_BOUNDARIES_KEY = 'store:sale-boundaries:{}:{}'
+
+# when the catalog and generation versions were last bumped. Products have
+# an updated_at column instead, but deleting a product doesn't leave one.
+GENERATION_MODIFIED_KEY = 'store:generation:modified'
+CATALOG_MODIFIED_KEY = 'store:catalog:modified'
+MODIFIED_KEYS = [CATALOG_MODIFIED_KEY, GENERATION_MODIFIED_KEY]
+
+# shared counters, exposed through cache_stats()
+HITS_KEY = 'store:cache:hits'
+MISSES_KEY = 'store:cache:misses'
+REBUILDS_KEY = 'store:cache:rebuilds'
+
+# how long a rebuild can hold the lock, and how often the requests waiting
+# for it check whether the entry is there
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+
+# The async views (see store/async_views.py) use the a* variants of these
+# helpers, which share the computation of the keys and the timeouts with
+# them. Django's async cache methods run the sync backend in a thread unless
+# the backend implements them natively.
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, new_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+# starting from the current time avoids reusing the version of an entry
+# built before the counter was evicted
+def new_version():
+    return int(time.time() * 1000)
+
+
+# The versions of a product and of the catalog, which the ETags include: the
+# writes to the cart items bump them without changing the product rows.
+def product_version(product_id):
+    return get_version(PRODUCT_VERSION_KEY.format(product_id))
+
+
+async def aproduct_version(product_id):
+    return await aget_version(PRODUCT_VERSION_KEY.format(product_id))
+
+
+def catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+async def acatalog_version():
+    return await aget_version(CATALOG_VERSION_KEY)
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the counter doesn't exist, so nothing was cached with it
+        get_version(key)
+
+
+_batch = threading.local()
+
+
+# The versions are bumped once the transaction of the write commits, or
+# right away outside of one. Bumped before, a concurrent miss could rebuild
+# the entry from the rows of before the write and cache it under the new
+# version, where it would be served until it expires.
+def invalidate_products(product_ids):
+    pending = getattr(_batch, 'product_ids', None)
+    if pending is not None:
+        pending.update(product_ids)
+        return
+    product_ids = set(product_ids)
+    transaction.on_commit(lambda: bump_products(product_ids))
+
+
+# the time of the change is set first, see replica_may_be_behind()
+def bump_products(product_ids):
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    for product_id in product_ids:
+        bump_version(PRODUCT_VERSION_KEY.format(product_id))
+    bump_version(CATALOG_VERSION_KEY)
+
+
+# Bulk operations that go through the signals would otherwise bump the
+# catalog version once per product. Inside this block the products are
+# collected and invalidated together when it exits.
+@contextmanager
+def batched_invalidation():
+    if getattr(_batch, 'product_ids', None) is not None:
+        yield
+        return
+    _batch.product_ids = set()
+    try:
+        yield
+    finally:
+        product_ids, _batch.product_ids = _batch.product_ids, None
+        if product_ids:
+            invalidate_products(product_ids)
+
+
+def invalidate_all():
+    transaction.on_commit(bump_generation)
+
+
+def bump_generation():
+    cache.set(GENERATION_MODIFIED_KEY, time.time(), timeout=None)
+    bump_version(GENERATION_KEY)
+
+
+# When the catalog last changed, for the Last-Modified of the lists. When it
+# isn't known yet we can only tell that the catalog is from now on.
+def catalog_modified():
+    modified = cache.get_many(MODIFIED_KEYS).values()
+    if modified:
+        return max(modified)
+    cache.add(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    return cache.get(CATALOG_MODIFIED_KEY, time.time())
+
+
+async def acatalog_modified():
+    modified = (await cache.aget_many(MODIFIED_KEYS)).values()
+    if modified:
+        return max(modified)
+    await cache.aadd(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    return await cache.aget(CATALOG_MODIFIED_KEY, time.time())
+
+
+# The replica can still be catching up with the writes of the last
+# DATABASE_REPLICA_STICKY_SECONDS, the time the writers are kept on the
+# primary. An entry built from it in that time can miss a write while its
+# key already has the version bumped by that write, so it isn't cached.
+def replica_may_be_behind():
+    return reading_from_replica_now() and is_recent(catalog_modified())
+
+
+async def areplica_may_be_behind():
+    return reading_from_replica_now() and is_recent(await acatalog_modified())
+
+
+def is_recent(modified):
+    return time.time() - modified < settings.DATABASE_REPLICA_STICKY_SECONDS
+
+
+# is_on_sale and current_price change when the clock crosses the sale_start
+# or the sale_end of a product, without anything being written. Given the
+# sale windows of the products in a response, this returns the last boundary
+# that was crossed and the next one to be crossed (either can be None).
+def sale_boundaries(sale_windows, now):
+    past, upcoming = [], []
+    for sale_start, sale_end in sale_windows:
+        # a product is on sale from sale_start until sale_end, both included
+        if sale_start is not None:
+            (past if sale_start <= now else upcoming).append(sale_start)
+        if sale_end is not None:
+            (past if sale_end < now else upcoming).append(sale_end)
+    return max(past, default=None), min(upcoming, default=None)
+
+
+# The last and the next sale boundary of the whole catalog, from
+# ProductQuerySet.sale_boundaries(), which reads every product with a sale
+# window. They only change with the catalog, or when the clock crosses the
+# next one, so they are cached with the versions until then. Like the
+# responses, they aren't cached when read from a replica that can be
+# behind. compute(now) is a coroutine function in the async variant.
+def catalog_sale_boundaries(generation, version, compute):
+    key = SALE_BOUNDARIES_KEY.format(generation, version)
+    boundaries = cache.get(key)
+    if boundaries is None or is_crossed(boundaries):
+        boundaries = compute(timezone.now())
+        if not replica_may_be_behind():
+            cache.set(key, boundaries, boundaries_timeout(boundaries))
+    return boundaries
+
+
+async def acatalog_sale_boundaries(generation, version, compute):
+    key = SALE_BOUNDARIES_KEY.format(generation, version)
+    boundaries = await cache.aget(key)
+    if boundaries is None or is_crossed(boundaries):
+        boundaries = await compute(timezone.now())
+        if not await areplica_may_be_behind():
+            await cache.aset(key, boundaries, boundaries_timeout(boundaries))
+    return boundaries
+
+
+# the cache counts the timeouts in seconds, so the next boundary can be
+# crossed up to a second before they expire
+def is_crossed(boundaries):
+    _, next_boundary = boundaries
+    return next_boundary is not None and next_boundary <= timezone.now()
+
+
+def boundaries_timeout(boundaries):
+    _, next_boundary = boundaries
+    return math.ceil(get_expires(next_boundary) - time.time())
+
+
+# The validators of a response for conditional requests, and when it
+# expires. A response never outlives the next sale boundary, and its
+# Last-Modified accounts for the boundaries already crossed. They are
+# computed from a few columns, without serializing the products, and are
+# cached together with the data (see make_entry()).
+def make_validators(etag, modified, last_boundary=None, next_boundary=None):
+    if last_boundary is not None:
+        modified = max(modified, last_boundary.timestamp())
+
+    return {
+        'etag': etag,
+        'last_modified': math.floor(modified),
+        'expires': get_expires(next_boundary),
+    }
+
+
+# when an entry built now expires, at the latest at the next sale boundary
+def get_expires(next_boundary=None):
+    now = time.time()
+    timeout = settings.PRODUCTS_CACHE_TIMEOUT
+    if next_boundary is not None:
+        timeout = min(timeout,
+                      max(1, math.ceil(next_boundary.timestamp() - now)))
+    return now + timeout
+
+
+def make_entry(data, validators):
+    return dict(validators, data=data)
+
+
+# The version of the row changes on every write to the product, and its
+# cache version (see product_version()) on every write to its cart items
+# too. The sale state is there because it changes without any write.
+def product_etag(product_id, version, cache_version, is_on_sale):
+    return '"{}-{}-{}-{}"'.format(product_id, version, cache_version,
+                                  int(is_on_sale))
+
+
+# For a list of products, from what its key is made of (the generation and
+# catalog versions, which change on every write, and the request, see
+# list_key()) and the last sale boundary crossed, which moves whenever a
+# product starts or ends its sale. Nothing is read from the products
+# matching the filters, so building it doesn't depend on the catalog size.
+def list_etag(generation, version, request, last_boundary=None):
+    value = repr((list_key(generation, version, request), last_boundary))
+    return '"{}"'.format(hashlib.md5(value.encode()).hexdigest())
+
+
+def get_max_age(entry):
+    return max(0, round(entry['expires'] - time.time()))
+
+
+def product_detail_key(product_id, request):
+    return detail_key(get_version(GENERATION_KEY), product_id,
+                      product_version(product_id), request)
+
+
+async def aproduct_detail_key(product_id, request):
+    return detail_key(await aget_version(GENERATION_KEY), product_id,
+                      await aproduct_version(product_id), request)
+
+
+def detail_key(generation, product_id, version, request):
+    return PRODUCT_DETAIL_KEY.format(generation, product_id, version,
+                                     request.get_host(), fields_hash(request))
+
+
+# the detail responses only vary with the fields picked by the client (see
+# SparseFieldsMixin in store/api_views.py), not the rest of the query string
+def fields_hash(request):
+    query = urlencode([(param, request.query_params.getlist(param))
+                       for param in ('fields', 'exclude')], doseq=True)
+    return hashlib.md5(query.encode()).hexdigest()
+
+
+# the responses include absolute links, so the host and the path (the async
+# views are served from another path) are part of the key too. They are
+# hashed with the query string to keep the key safe for memcached.
+def list_request_hash(request):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    return hashlib.md5('{}?{}'.format(request.path, query).encode()) \
+        .hexdigest()
+
+
+def product_list_key(request):
+    return list_key(get_version(GENERATION_KEY), catalog_version(), request)
+
+
+async def aproduct_list_key(request):
+    return list_key(await aget_version(GENERATION_KEY),
+                    await acatalog_version(), request)
+
+
+def list_key(generation, version, request):
+    return PRODUCT_LIST_KEY.format(generation, version, request.get_host(),
+                                   list_request_hash(request))
+
+
+# The storefront pages (see store/views.py) are cached like the API
+# responses: the pages showing many products by the catalog version, and
+# the page of a product by its version. The other parts of the key are the
+# host and the parts given, e.g. the page number.
+def catalog_page_key(name, request, *parts):
+    return PAGE_KEY.format(
+        name,
+        get_version(GENERATION_KEY),
+        get_version(CATALOG_VERSION_KEY),
+        request.get_host(),
+        ':'.join(str(part) for part in parts),
+    )
+
+
+def product_page_key(name, request, product_id):
+    return PAGE_KEY.format(
+        name,
+        get_version(GENERATION_KEY),
+        get_version(PRODUCT_VERSION_KEY.format(product_id)),
+        request.get_host(),
+        product_id,
+    )
+
+
+def increment_counter(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+async def aincrement_counter(key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        if not await cache.aadd(key, 1, timeout=None):
+            await cache.aincr(key)
+
+
+def cache_stats():
+    counters = cache.get_many([HITS_KEY, MISSES_KEY, REBUILDS_KEY])
+    return {
+        'hits': counters.get(HITS_KEY, 0),
+        'misses': counters.get(MISSES_KEY, 0),
+        'rebuilds': counters.get(REBUILDS_KEY, 0),
+    }
+
+
+def get_entry(key):
+    entry = cache.get(key)
+    if entry is not None:
+        increment_counter(HITS_KEY)
+    count_lookup(entry)
+    return entry
+
+
+async def aget_entry(key):
+    entry = await cache.aget(key)
+    if entry is not None:
+        await aincrement_counter(HITS_KEY)
+    count_lookup(entry)
+    return entry
+
+
+def count_lookup(entry):
+    instrumentation.count('cache_misses' if entry is None else 'cache_hits')
+
+
+# Builds an entry after a miss: only the request that gets the lock calls
+# build(), the concurrent ones wait for its result instead of hitting the
+# database at the same time. The second value tells whether the entry was
+# built by another request.
+# The waiting stops when the lock is released without an entry, e.g. when
+# build() raised Http404 or the entry wasn't cached, and the request then
+# builds the entry itself.
+def build_entry(key, build):
+    increment_counter(MISSES_KEY)
+    lock = lock_key(key)
+    locked = cache.add(lock, 1, timeout=LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            found = cache.get_many([key, lock])
+            if key in found:
+                return found[key], True
+            if lock not in found:
+                break
+        # the lock was released without an entry, or the rebuild took too
+        # long: don't keep the client waiting for it
+
+    try:
+        entry = build()
+        if not replica_may_be_behind():
+            cache.set(key, entry, entry_timeout(entry))
+            increment_counter(REBUILDS_KEY)
+    finally:
+        if locked:
+            cache.delete(lock)
+    return entry, False
+
+
+# The same, for the async views: build() is a coroutine function, and the
+# requests waiting for the lock sleep without holding a thread.
+async def abuild_entry(key, build):
+    await aincrement_counter(MISSES_KEY)
+    lock = lock_key(key)
+    locked = await cache.aadd(lock, 1, timeout=LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            found = await cache.aget_many([key, lock])
+            if key in found:
+                return found[key], True
+            if lock not in found:
+                break
+
+    try:
+        entry = await build()
+        if not await areplica_may_be_behind():
+            await cache.aset(key, entry, entry_timeout(entry))
+            await aincrement_counter(REBUILDS_KEY)
+    finally:
+        if locked:
+            await cache.adelete(lock)
+    return entry, False
+
+
+def lock_key(key):
+    return '{}:lock'.format(key)
+
+
+# the entries are kept until they expire, see make_validators()
+def entry_timeout(entry):
+    return math.ceil(entry['expires'] - time.time())
@@ -0,0 +1,76 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from rest_framework.exceptions import NotFound, ValidationError
+
+from store import cache as product_cache
+from store import listings, stats
+from store.models import ShoppingCartItem
+
+# the quantities a cart item can have, like CartItemSerializer validates them
+MIN_QUANTITY = 1
+MAX_QUANTITY = 100
+
+
+# Adds quantity units (fewer when negative) of a product to a cart and
+# returns the item and whether it was created. The quantity of an existing
+# item is changed by a single UPDATE with an F() expression, so concurrent
+# additions to the same item all count, without reading the item first or
+# locking anything but its row. A missing item is created, unless create is
+# False; when another request creates it at the same time, the unique
+# constraint on (shopping_cart, product) rejects the second one, which then
+# increments it instead, like stats.record() does.
+# The quantity of the item has to stay between MIN_QUANTITY and
+# MAX_QUANTITY, which the UPDATE checks in its WHERE clause. Incrementing
+# an item that isn't in the cart (create=False) raises NotFound.
+def add_item(cart_id, product_id, quantity, create=True):
+    items = ShoppingCartItem.objects.filter(shopping_cart_id=cart_id,
+                                            product_id=product_id)
+    if increment(items, quantity):
+        return item_changed(items, quantity), False
+    if create and MIN_QUANTITY <= quantity <= MAX_QUANTITY:
+        try:
+            with transaction.atomic():
+                return ShoppingCartItem.objects.create(
+                    shopping_cart_id=cart_id, product_id=product_id,
+                    quantity=quantity), True
+        except IntegrityError:
+            # another request created the item in the meantime
+            if increment(items, quantity):
+                return item_changed(items, quantity), False
+
+    if not create and not items.exists():
+        raise NotFound()
+    raise ValidationError({'quantity': [
+        'The quantity of the item must stay between {} and {}.'.format(
+            MIN_QUANTITY, MAX_QUANTITY)]})
+
+
+def increment(items, quantity):
+    return items.filter(
+        quantity__gte=MIN_QUANTITY - quantity,
+        quantity__lte=MAX_QUANTITY - quantity,
+    ).update(quantity=F('quantity') + quantity)
+
+
+# QuerySet.update() doesn't send the model signals, so this does what they
+# do when an item is saved (see store/signals.py): the stats, the cached
+# responses of the product, and its read model row. Returns the item with
+# its new quantity.
+# The product row isn't updated, and the stats and the read model are only
+# written once the transaction commits, so that the request only holds the
+# lock of the item row. The versions of the cached responses are bumped
+# after them, see product_cache.invalidate_products().
+def item_changed(items, quantity):
+    item = items.select_related('product').get()
+    transaction.on_commit(lambda: stats.record_cart_item(item, 0, quantity))
+    transaction.on_commit(lambda: listings.refresh([item.product_id]))
+    product_cache.invalidate_products([item.product_id])
+    return item
+
+
+# Removes the product from the cart, through the model signals. Returns
+# whether the cart had it.
+def remove_item(cart_id, product_id):
+    deleted, _ = ShoppingCartItem.objects.filter(
+        shopping_cart_id=cart_id, product_id=product_id).delete()
+    return deleted > 0
@@ -0,0 +1,50 @@
+import csv
+import json
+from itertools import islice
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# Splits an iterator, e.g. QuerySet.iterator(), in lists of up to size items
+# without loading more than one list at a time.
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# One JSON document per line, encoded like the JSON responses of the API.
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=JSONEncoder,
+                         separators=(',', ':')) + '\n'
+
+
+class Echo:
+    # csv.writer only needs the write method of a file, returning the line
+    # lets the rows be streamed instead of buffered
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, dict)):
+        # nested values like the cart items are kept as JSON in the cell
+        return json.dumps(value, cls=JSONEncoder, separators=(',', ':'))
+    if isinstance(value, (str, int, float)):
+        return value
+    return JSONEncoder().default(value)
+
+
+def csv_lines(fields, records):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for record in records:
+        yield writer.writerow([csv_value(record[field]) for field in fields])
@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from store import cache as product_cache
+from store import listings
+from store.models import Product
+
+# Pillow formats of the variants and the extension of their files. Browsers
+# that support WebP get the smaller files, the others the JPEGs.
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+QUALITY = 80
+
+# where the variants are stored, next to the uploaded photos
+VARIANTS_DIRECTORY = 'products/variants'
+
+logger = logging.getLogger(__name__)
+
+_executor_lock = threading.Lock()
+
+
+# The name of a variant includes a hash of the content of the photo, so
+# the files never change once written and can be cached forever by the
+# browsers and the web server in front of MEDIA_URL.
+def variant_name(photo_name, content_hash, width, extension):
+    stem = os.path.splitext(os.path.basename(photo_name))[0]
+    return '{}/{}.{}.{}w.{}'.format(VARIANTS_DIRECTORY, stem, content_hash,
+                                    width, extension)
+
+
+# Writes the resized variants of a photo of the storage and returns their
+# names like Product.photo_variants stores them: {format: [[width, name]]},
+# by increasing width. Photos are never scaled up, so a small photo has
+# fewer variants. Variants already written are reused.
+def generate_variants(photo_name, storage=default_storage):
+    with storage.open(photo_name, 'rb') as photo:
+        content = photo.read()
+    content_hash = hashlib.sha256(content).hexdigest()[:16]
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(content)))
+    image = image.convert('RGB')
+    widths = [width for width in sorted(settings.PRODUCT_PHOTO_WIDTHS)
+              if width < image.width] or [image.width]
+
+    variants = {}
+    for variant_format, (pil_format, extension) in FORMATS.items():
+        variants[variant_format] = []
+        for width in widths:
+            name = variant_name(photo_name, content_hash, width, extension)
+            if not storage.exists(name):
+                save_variant(image, width, pil_format, name, storage)
+            variants[variant_format].append([width, name])
+    return variants
+
+
+def save_variant(image, width, pil_format, name, storage):
+    height = round(image.height * width / image.width)
+    resized = image.resize((width, height), Image.LANCZOS)
+    output = BytesIO()
+    resized.save(output, pil_format, quality=QUALITY)
+    storage.save(name, ContentFile(output.getvalue()))
+
+
+# Stores the variants, unless the photo changed while they were generated.
+# This changes the API responses of the product, which get a new version.
+def save_variants(product_id, photo_name, variants):
+    updated = Product.objects.filter(id=product_id, photo=photo_name).update(
+        photo_variants=variants, version=F('version') + 1,
+        updated_at=timezone.now())
+    if updated:
+        listings.refresh([product_id])
+        product_cache.invalidate_products([product_id])
+    return updated
+
+
+def process_photo(product_id, photo_name):
+    save_variants(product_id, photo_name, generate_variants(photo_name))
+
+
+# the threads of the pool run outside of any request, which is what closes
+# the database connections otherwise
+def process_photo_in_worker(product_id, photo_name):
+    try:
+        process_photo(product_id, photo_name)
+    except Exception:
+        # nobody waits for the result of the pool
+        logger.exception('Cannot generate the variants of %s', photo_name)
+    finally:
+        close_old_connections()
+
+
+# Resizing and encoding release the GIL in Pillow, so threads are enough to
+# use several cores, and they can save the variants themselves. The pool is
+# created by the first call.
+def get_executor():
+    with _executor_lock:
+        return create_executor()
+
+
+@functools.cache
+def create_executor():
+    return ThreadPoolExecutor(settings.PRODUCT_PHOTO_WORKERS,
+                              thread_name_prefix='product-photos')
+
+
+# Generates the variants of the photo of a product once the transaction
+# saving it commits, in the pool of workers unless PRODUCT_PHOTO_INLINE is
+# set.
+def schedule_variants(product):
+    product_id, photo_name = product.id, product.photo.name
+
+    def process():
+        if settings.PRODUCT_PHOTO_INLINE:
+            process_photo(product_id, photo_name)
+        else:
+            get_executor().submit(process_photo_in_worker, product_id,
+                                  photo_name)
+
+    transaction.on_commit(process)
@@ -0,0 +1,121 @@
+import csv
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from store import cache as product_cache
+from store import listings, prices
+from store.export import chunked
+from store.models import PRICE_FIELDS, Product
+from store.search import get_search_backend
+from store.serializers import ProductImportSerializer
+
+FORMATS = ('csv', 'ndjson')
+
+# columns written by an import; the sku is the key the rows are matched on
+IMPORT_FIELDS = ('name', 'description', 'price', 'sale_start', 'sale_end')
+
+
+# Yields (number, row) for every row of the file, numbered from 1, without
+# reading the whole file. Empty CSV cells are left out of the row, so that
+# optional fields get their default value.
+def read_rows(file, file_format):
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(file), 1):
+            yield number, {key: value for key, value in row.items()
+                           if value != ''}
+    else:
+        number = 0
+        for line in file:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                yield number, json.loads(line)
+            except ValueError as exc:
+                yield number, exc
+
+
+# Returns the validated attributes of the valid rows of the chunk and
+# (number, row, errors) for the rejected ones. It doesn't use the database,
+# so it can run in another process.
+def validate_chunk(rows):
+    serializer = ProductImportSerializer()
+    valid, rejected = [], []
+    for number, row in rows:
+        if isinstance(row, Exception):
+            rejected.append((number, None, {'non_field_errors': [str(row)]}))
+            continue
+        try:
+            valid.append(serializer.run_validation(row))
+        except ValidationError as exc:
+            rejected.append((number, row, exc.detail))
+    return valid, rejected
+
+
+# Validates the chunks in order, either here or in a pool of processes. At
+# most two chunks per process are read ahead of the one being written.
+def validate_chunks(chunks, workers=0):
+    if not workers:
+        for chunk in chunks:
+            yield validate_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=django.setup) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(validate_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Inserts the products of the chunk, or updates the ones whose sku already
+# exists, in a single query. bulk_create() doesn't send the model signals,
+# so the versions, the search index, the price history, the read model and
+# the cache are updated here. The prices of the existing products are read
+# first, so that the history only gets the ones the import changes.
+def upsert_products(valid):
+    # a sku can only be written once per query, the last row wins
+    products = {attrs['sku']: Product(**attrs) for attrs in valid}
+    with transaction.atomic():
+        saved_prices = {
+            sku: tuple(values) for sku, *values in Product.objects.filter(
+                sku__in=list(products)).values_list('sku', *PRICE_FIELDS)}
+        for sku, product in products.items():
+            product.saved_prices = saved_prices.get(sku)
+        products = Product.objects.bulk_create(
+            list(products.values()),
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=IMPORT_FIELDS,
+        )
+        product_ids = [product.id for product in products]
+        Product.touch(product_ids)
+        prices.record(products)
+        get_search_backend().index_products(product_ids)
+        listings.refresh(product_ids)
+    return len(products)
+
+
+def import_products(file, file_format, chunk_size=5000, workers=0,
+                    rejects=None):
+    counts = {'rows': 0, 'imported': 0, 'rejected': 0}
+    chunks = chunked(read_rows(file, file_format), chunk_size)
+    for valid, rejected in validate_chunks(chunks, workers):
+        counts['rows'] += len(valid) + len(rejected)
+        counts['rejected'] += len(rejected)
+        if valid:
+            counts['imported'] += upsert_products(valid)
+        if rejects is not None:
+            for number, row, errors in rejected:
+                rejects.write(json.dumps(
+                    {'row': number, 'data': row, 'errors': errors}) + '\n')
+    # cheaper than bumping the version of every imported product
+    product_cache.invalidate_all()
+    return counts
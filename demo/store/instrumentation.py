@@ -0,0 +1,238 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets, in seconds and bytes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# IN lists have one placeholder per value, they are the same query whatever
+# their length
+IN_LIST_RE = re.compile(r'\((?:%s|\?)(?:, ?(?:%s|\?))*\)')
+
+_recorder = ContextVar('store_instrumentation_recorder', default=None)
+
+
+def sql_template(sql):
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+# What is measured during a single request.
+class Recorder:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.queries = Counter()
+        self.timings = defaultdict(float)
+        self.counts = Counter()
+        self.timing_depth = Counter()
+
+    # used with connection.execute_wrapper()
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_count += 1
+            self.query_time += time.perf_counter() - start
+            self.queries[sql_template(sql)] += 1
+
+    def repeated_queries(self, threshold):
+        return [(sql, count) for sql, count in self.queries.items()
+                if count > threshold]
+
+
+# Adds the time spent in the block to the given timing of the current
+# request, e.g. 'serializer'. Nested blocks of the same timing are only
+# counted once.
+@contextmanager
+def timed(name):
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    recorder.timing_depth[name] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.timing_depth[name] -= 1
+        if not recorder.timing_depth[name]:
+            recorder.timings[name] += time.perf_counter() - start
+
+
+def count(name, value=1):
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.counts[name] += value
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+# The metrics of this process since it started, by view. Every process of
+# the server has its own, so they are meant to be scraped per process.
+class Registry:
+    histograms = {
+        'store_request_duration_seconds': (
+            'Time spent handling the request', DURATION_BUCKETS),
+        'store_db_query_duration_seconds': (
+            'Time spent in database queries per request', DURATION_BUCKETS),
+        'store_db_queries': (
+            'Number of database queries per request', QUERY_BUCKETS),
+        'store_serializer_duration_seconds': (
+            'Time spent serializing per request', DURATION_BUCKETS),
+        'store_response_size_bytes': (
+            'Size of the response body', SIZE_BUCKETS),
+    }
+    counters = {
+        'store_cache_hits_total': 'Responses served from the cache',
+        'store_cache_misses_total': 'Responses missing from the cache',
+        'store_n_plus_one_total': 'Queries repeated more than the threshold '
+                                  'in a request',
+        'store_throttled_total': 'Requests rejected by a throttle',
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.values = defaultdict(dict)
+
+    def observe(self, name, view, value):
+        with self.lock:
+            views = self.values[name]
+            if view not in views:
+                views[view] = Histogram(self.histograms[name][1])
+            views[view].observe(value)
+
+    def increment(self, name, view, value=1):
+        with self.lock:
+            views = self.values[name]
+            views[view] = views.get(view, 0) + value
+
+    # in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (description, _) in self.histograms.items():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for view, histogram in sorted(self.values[name].items()):
+                    label = 'view="{}"'.format(view)
+                    for bound, value in zip(histogram.buckets,
+                                            histogram.counts):
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                            name, label, bound, value))
+                    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                        name, label, histogram.count))
+                    lines.append('{}_sum{{{}}} {}'.format(
+                        name, label, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(
+                        name, label, histogram.count))
+            for name, description in self.counters.items():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} counter'.format(name))
+                for view, value in sorted(self.values[name].items()):
+                    lines.append('{}{{view="{}"}} {}'.format(name, view,
+                                                             value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = getattr(match.func, 'view_class', match.func)
+    return '{}.{}'.format(func.__module__, func.__qualname__)
+
+
+# Opt-in with the INSTRUMENTATION_ENABLED setting. Measures every request,
+# adds a Server-Timing header to the response and records the measures in
+# the registry exposed by store.views.metrics. Queries that run more than
+# INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times in a request are logged as a
+# likely N+1 pattern.
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = Recorder()
+        token = _recorder.set(recorder)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self.record(request, response, recorder)
+        return response
+
+    def record(self, request, response, recorder):
+        duration = time.perf_counter() - recorder.start
+        view = view_name(request)
+        serializer_time = recorder.timings['serializer']
+
+        registry.observe('store_request_duration_seconds', view, duration)
+        registry.observe('store_db_query_duration_seconds', view,
+                         recorder.query_time)
+        registry.observe('store_db_queries', view, recorder.query_count)
+        registry.observe('store_serializer_duration_seconds', view,
+                         serializer_time)
+        # streamed responses are not measured
+        if not response.streaming:
+            registry.observe('store_response_size_bytes', view,
+                             len(response.content))
+        for name in ('cache_hits', 'cache_misses', 'throttled'):
+            if recorder.counts[name]:
+                registry.increment('store_{}_total'.format(name), view,
+                                   recorder.counts[name])
+
+        threshold = settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        for sql, repeated in recorder.repeated_queries(threshold):
+            registry.increment('store_n_plus_one_total', view)
+            logger.warning('Possible N+1 queries in %s: %d times %s', view,
+                           repeated, sql)
+
+        response['Server-Timing'] = ', '.join([
+            'total;dur={:.2f}'.format(duration * 1000),
+            'db;dur={:.2f};desc="{} queries"'.format(
+                recorder.query_time * 1000, recorder.query_count),
+            'serializer;dur={:.2f}'.format(serializer_time * 1000),
+            'throttle;dur={:.2f}'.format(recorder.timings['throttle'] * 1000),
+            'cache;desc="{} hits, {} misses"'.format(
+                recorder.counts['cache_hits'],
+                recorder.counts['cache_misses']),
+        ])
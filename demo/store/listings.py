@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db import transaction
+
+from store.models import Product, ProductListing, ProductQuerySet, \
+    ShoppingCartItem
+
+# how many products are refreshed per query by rebuild()
+BATCH_SIZE = 1000
+
+# the columns copied from the products
+PRODUCT_FIELDS = ('id', 'sku', 'name', 'description', 'price', 'sale_start',
+                  'sale_end', 'photo', 'photo_variants', 'warranty_id',
+                  'version', 'updated_at')
+UPDATE_FIELDS = [field.name for field in ProductListing._meta.concrete_fields
+                 if not field.primary_key]
+
+
+# The read model is optional (see store.models.ProductListing): when the
+# PRODUCTS_READ_MODEL setting is off, it is neither maintained nor used.
+def enabled():
+    return settings.PRODUCTS_READ_MODEL
+
+
+# Rewrites the listing rows of the products from the products and their
+# cart items, in three queries whatever the number of products. The rows of
+# the products that don't exist anymore are deleted. This is called for
+# every write that changes a product or its cart items, including the bulk
+# ones that don't send the model signals.
+def refresh(product_ids):
+    if not enabled():
+        return
+    product_ids = set(product_ids)
+    rows = Product.objects.filter(id__in=product_ids).values(
+        *PRODUCT_FIELDS,
+        regular_price=ProductQuerySet.regular_price_expression(),
+        sale_price=ProductQuerySet.sale_price_expression(),
+    )
+    listings = {row['id']: ProductListing(**row) for row in rows}
+
+    items = ShoppingCartItem.objects.filter(product_id__in=listings) \
+        .order_by('id').values_list('product_id', 'quantity')
+    for product_id, quantity in items:
+        listing = listings[product_id]
+        listing.cart_items.append({'product': product_id,
+                                   'quantity': quantity})
+        listing.cart_item_count += 1
+        listing.cart_quantity += quantity
+
+    with transaction.atomic():
+        ProductListing.objects.bulk_create(
+            listings.values(),
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=UPDATE_FIELDS,
+        )
+        removed = product_ids - listings.keys()
+        if removed:
+            ProductListing.objects.filter(id__in=removed).delete()
+
+
+def remove(product_ids):
+    if enabled():
+        ProductListing.objects.filter(id__in=product_ids).delete()
+
+
+# Rebuilds the whole read model from the products, batch by batch. Returns
+# the number of rows.
+def rebuild(batch_size=BATCH_SIZE):
+    if not enabled():
+        return 0
+    product_ids = list(Product.objects.order_by('id').values_list(
+        'id', flat=True))
+    with transaction.atomic():
+        ProductListing.objects.exclude(id__in=Product.objects.values('id')) \
+            .delete()
+        for start in range(0, len(product_ids), batch_size):
+            refresh(product_ids[start:start + batch_size])
+    return len(product_ids)
@@ -0,0 +1,182 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from store import cache as product_cache
+from store import stats
+from store.benchmarks import ClientTransport, WsgiTransport, \
+    index_products, query_count, seed_carts, seed_products, summarize, \
+    unthrottled, wsgi_server
+from store.models import Product, ShoppingCart
+
+
+# The requests of every scenario, given the number of the run, as (method,
+# URL, data, cookies). They spread over the catalog and the carts (one
+# session per cart) so that they don't read the same rows every time, and
+# the cached responses are dropped before each of them (see run_scenario()):
+# the scenarios whose URL can't vary, like the first page, are timed as
+# misses too.
+def scenarios(product_ids, size, session_keys):
+    def product_id(run):
+        return product_ids[run * 7919 % len(product_ids)]
+
+    def session(run):
+        return {settings.SESSION_COOKIE_NAME:
+                session_keys[run * 7919 % len(session_keys)]}
+
+    return {
+        'list_first_page': lambda run: (
+            'GET', '/api/v1/products/?limit=20', None, None),
+        'list_deep_page': lambda run: (
+            'GET', '/api/v1/products/?limit=20&offset={}'.format(
+                (size // 2 + run * 20) % max(1, size - 20)), None, None),
+        'list_cursor': lambda run: (
+            'GET', '/api/v1/products/?pagination=cursor&limit=20', None,
+            None),
+        'search': lambda run: (
+            'GET', '/api/v1/products/?search=synthetic+{}&limit=20'.format(
+                run * 7919 % size), None, None),
+        'on_sale': lambda run: (
+            'GET', '/api/v1/products/?on_sale=true&limit=20&offset={}'.format(
+                run * 20), None, None),
+        'detail': lambda run: (
+            'GET', '/api/v1/products/{}/'.format(product_id(run)), None,
+            None),
+        'update': lambda run: (
+            'PATCH', '/api/v1/products/{}/'.format(product_id(run)),
+            {'name': 'Updated product {}'.format(run)}, None),
+        'stats': lambda run: (
+            'GET', '/api/v1/products/{}/stats?granularity=week'.format(
+                product_id(run)), None, None),
+        'cart': lambda run: ('GET', '/cart/', None, session(run)),
+    }
+
+
+# the latency and throughput of a scenario, and its queries when the
+# instrumentation reported them
+def scenario_result(timings, queries):
+    result = summarize(timings)
+    result['requests_per_second'] = round(len(timings) / sum(timings), 1)
+    counted = [count for count in queries if count is not None]
+    if counted:
+        result['queries_mean'] = round(sum(counted) / len(counted), 1)
+        result['queries_max'] = max(counted)
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the store API on synthetic catalogs and reports ' \
+           'the latency, throughput and queries of every scenario as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10000, 100000, 1000000],
+                            help='numbers of products of the catalogs')
+        parser.add_argument('--carts', type=float, default=0.1,
+                            help='number of carts per product')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--transports', nargs='+',
+                            choices=['client', 'wsgi'],
+                            default=['client', 'wsgi'])
+        parser.add_argument('--scenarios', nargs='+',
+                            help='only run these scenarios')
+        parser.add_argument('--output', help='write the JSON report here')
+
+    # The catalogs are built in a throwaway test database, like the one of
+    # the tests: the WSGI server handles the requests in other threads, so
+    # the data has to be committed, which rules out rolling it back.
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # the requests of the scenarios would all be throttled
+            with override_settings(DEBUG=False, INSTRUMENTATION_ENABLED=True,
+                                   REST_FRAMEWORK=unthrottled()):
+                report = {
+                    'database': connection.vendor,
+                    'repeat': options['repeat'],
+                    'catalogs': [self.run_catalog(size, options)
+                                 for size in sorted(options['sizes'])],
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+
+    def run_catalog(self, size, options):
+        start = time.perf_counter()
+        # the catalogs are grown from the previous one
+        seed_products(size - Product.objects.count())
+        carts = int(size * options['carts'])
+        seed_carts(carts - ShoppingCart.objects.count())
+        index_products()
+        stats.rebuild()
+        seed_seconds = time.perf_counter() - start
+
+        product_ids = list(Product.objects.order_by('id').values_list(
+            'id', flat=True))
+        selected = scenarios(product_ids, size,
+                             self.cart_sessions(options['repeat']))
+        if options['scenarios']:
+            selected = {name: selected[name] for name in options['scenarios']}
+
+        results = {}
+        for transport_name in options['transports']:
+            if transport_name == 'wsgi':
+                with wsgi_server() as port:
+                    transport = WsgiTransport(port)
+                    results['wsgi'] = self.run_scenarios(
+                        transport, selected, options['repeat'])
+            else:
+                transport = ClientTransport()
+                results['client'] = self.run_scenarios(
+                    transport, selected, options['repeat'])
+
+        return {
+            'products': size,
+            'carts': carts,
+            'seed_seconds': round(seed_seconds, 1),
+            'scenarios': results,
+        }
+
+    # the session keys of count carts spread over all of them
+    def cart_sessions(self, count):
+        cart_ids = list(ShoppingCart.objects.order_by('id').values_list(
+            'id', flat=True))
+        session_keys = []
+        for index in range(min(count, len(cart_ids))):
+            session = SessionStore()
+            session['shopping_cart_id'] = \
+                cart_ids[index * len(cart_ids) // count]
+            session.create()
+            session_keys.append(session.session_key)
+        return session_keys
+
+    def run_scenarios(self, transport, selected, repeat):
+        return {name: self.run_scenario(transport, name, build_request,
+                                        repeat)
+                for name, build_request in selected.items()}
+
+    def run_scenario(self, transport, name, build_request, repeat):
+        cache.clear()
+        timings, queries = [], []
+        for run in range(repeat):
+            method, url, data, cookies = build_request(run)
+            product_cache.bump_generation()
+            start = time.perf_counter()
+            status, server_timing = transport.request(method, url, data,
+                                                      cookies)
+            timings.append(time.perf_counter() - start)
+            assert status == 200, (name, url, status)
+            queries.append(query_count(server_timing))
+        return scenario_result(timings, queries)
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection, connections
+from django.test import AsyncClient
+from django.test.utils import override_settings
+
+from store import stats
+from store.benchmarks import ConcurrencyMeter, api_client, \
+    index_products, seed_carts, seed_products
+from store.models import Product
+
+
+# The URL of every request of a scenario, given the prefix of the API and
+# the number of the request. They spread over the catalog so that most of
+# them miss the cache.
+def scenarios(product_ids):
+    def product_id(run):
+        return product_ids[run * 7919 % len(product_ids)]
+
+    return {
+        'list': lambda prefix, run: '{}?limit=20&offset={}'.format(
+            prefix, run * 20 % max(1, len(product_ids) - 20)),
+        'detail': lambda prefix, run: '{}{}/'.format(prefix, product_id(run)),
+        'stats': lambda prefix, run: '{}{}/stats?granularity=week'.format(
+            prefix, product_id(run)),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compares the product reads of the sync API, served by a fixed ' \
+           'number of WSGI worker threads, with the async views served by ' \
+           'a single ASGI event loop, and reports the throughput, latency ' \
+           'and requests in flight of both as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=500,
+                            help='number of requests of every scenario')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='number of threads of the WSGI worker')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='number of concurrent requests sent to '
+                                 'the ASGI worker')
+        parser.add_argument('--scenarios', nargs='+',
+                            help='only run these scenarios')
+        parser.add_argument('--output', help='write the JSON report here')
+
+    # Both applications are called in-process, without a server, so that
+    # only the handling of the requests is compared. The data is seeded in
+    # a throwaway test database, committed so that every thread can read it.
+    # The instrumentation stays disabled: its middleware is sync only, so
+    # it would run every async request in a thread. The async test client
+    # always sends the testserver host.
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                    DEBUG=False, INSTRUMENTATION_ENABLED=False,
+                    ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+
+    def run(self, options):
+        seed_products(options['products'])
+        seed_carts(options['products'] // 10)
+        index_products()
+        stats.rebuild()
+
+        product_ids = list(Product.objects.order_by('id').values_list(
+            'id', flat=True))
+        selected = scenarios(product_ids)
+        if options['scenarios']:
+            selected = {name: selected[name] for name in options['scenarios']}
+
+        results = {}
+        for name, build_url in selected.items():
+            cache.clear()
+            wsgi = self.run_wsgi(
+                [build_url('/api/v1/products/', run)
+                 for run in range(options['requests'])],
+                options['workers'])
+            # the detail entries are shared with the sync API
+            cache.clear()
+            asgi = asyncio.run(self.run_asgi(
+                [build_url('/api/v1/async/products/', run)
+                 for run in range(options['requests'])],
+                options['concurrency']))
+            results[name] = {'wsgi': wsgi, 'asgi': asgi}
+
+        return {
+            'database': connection.vendor,
+            'products': options['products'],
+            'requests': options['requests'],
+            'wsgi_workers': options['workers'],
+            'asgi_concurrency': options['concurrency'],
+            'scenarios': results,
+        }
+
+    # Every thread handles one request at a time, like the threads of a
+    # WSGI worker.
+    def run_wsgi(self, urls, workers):
+        meter = ConcurrencyMeter()
+        pending = deque(urls)
+
+        def work():
+            client = api_client()
+            try:
+                while pending:
+                    url = pending.popleft()
+                    with meter.measure():
+                        response = client.get(url)
+                    assert response.status_code == 200, (url, response)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            for future in [executor.submit(work) for _ in range(workers)]:
+                future.result()
+        return meter.report(time.perf_counter() - start)
+
+    # All the requests are handled by the event loop of this thread, like
+    # in an ASGI worker.
+    async def run_asgi(self, urls, concurrency):
+        meter = ConcurrencyMeter()
+        pending = deque(urls)
+
+        async def work():
+            client = AsyncClient()
+            while pending:
+                url = pending.popleft()
+                with meter.measure():
+                    response = await client.get(url)
+                assert response.status_code == 200, (url, response)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(work() for _ in range(concurrency)))
+        return meter.report(time.perf_counter() - start)
@@ -0,0 +1,88 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from store.benchmarks import api_client, rolled_back, unthrottled
+from store.models import Product
+
+
+def product_data(i):
+    return {
+        'name': 'Synced product {}'.format(i),
+        'description': 'Synced product number {}'.format(i),
+        'price': '{}.99'.format(1 + i % 1000),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput of the bulk products endpoint with the ' \
+           'per-item endpoints when syncing a catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        # the per-item endpoints are slow enough to only time a sample
+        parser.add_argument('--per-item', type=int, default=1000)
+        parser.add_argument('--chunk', type=int, default=1000,
+                            help='number of products per bulk request')
+
+    def handle(self, *args, **options):
+        count = options['products']
+        sample = min(options['per_item'], count)
+        chunk = options['chunk']
+        client = api_client()
+        results = {'products': count, 'per_item_sample': sample,
+                   'chunk': chunk}
+
+        def run(name, requests, products):
+            start = time.perf_counter()
+            for method, url, data, status in requests:
+                response = getattr(client, method)(url, data, format='json')
+                assert response.status_code == status, response.content
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                'seconds': round(elapsed, 3),
+                'products_per_second': round(products / elapsed, 1),
+            }
+
+        def chunks(items):
+            for start in range(0, len(items), chunk):
+                yield items[start:start + chunk]
+
+        # the requests would be throttled after the first ones
+        with override_settings(REST_FRAMEWORK=unthrottled()), rolled_back():
+            run('per_item_create', (
+                ('post', '/api/v1/products/new', product_data(i), 201)
+                for i in range(sample)
+            ), sample)
+            run('bulk_create', (
+                ('post', '/api/v1/products/bulk', items, 201)
+                for items in chunks([product_data(i) for i in range(count)])
+            ), count)
+
+            product_ids = list(Product.objects.order_by('-id').values_list(
+                'id', flat=True)[:count])
+            run('per_item_update', (
+                ('patch', '/api/v1/products/{}/'.format(product_id),
+                 {'name': 'Renamed'}, 200)
+                for product_id in product_ids[:sample]
+            ), sample)
+            run('bulk_update', (
+                ('patch', '/api/v1/products/bulk',
+                 [{'id': product_id, 'name': 'Renamed'}
+                  for product_id in ids], 200)
+                for ids in chunks(product_ids)
+            ), count)
+
+            run('per_item_delete', (
+                ('delete', '/api/v1/products/{}/'.format(product_id),
+                 None, 204)
+                for product_id in product_ids[:sample]
+            ), sample)
+            run('bulk_delete', (
+                ('delete', '/api/v1/products/bulk', ids, 204)
+                for ids in chunks(product_ids[sample:])
+            ), count - sample)
+
+        self.stdout.write(json.dumps(results, indent=2))
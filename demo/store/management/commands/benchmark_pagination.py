@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from store.api_views import ProductsKeysetPagination
+from store.benchmarks import api_client, rolled_back, seed_products, \
+    summarize, time_requests
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Compares the latency of a deep page of the products list ' \
+           'between limit/offset and keyset pagination.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000)
+        parser.add_argument('--page', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        limit, repeat = options['limit'], options['repeat']
+        offset = (options['page'] - 1) * limit
+
+        with rolled_back():
+            seed_products(options['products'])
+            client = api_client()
+
+            # walking 999 pages to reach the cursor of page 1000 would only
+            # benchmark the walk, so we sign the position of the last row of
+            # the previous page directly
+            last = Product.objects.order_by('id')[offset - 1]
+            paginator = ProductsKeysetPagination()
+            paginator.ordering = 'id'
+            cursor = paginator.encode_cursor({'id': last.id})
+
+            results = {
+                'products': options['products'],
+                'page': options['page'],
+                'limit': limit,
+                'offset': summarize(time_requests(
+                    client, '/api/v1/products/?limit={}&offset={}'.format(
+                        limit, offset), repeat)),
+                'cursor': summarize(time_requests(
+                    client, '/api/v1/products/?limit={}&cursor={}'.format(
+                        limit, cursor), repeat)),
+            }
+
+        self.stdout.write(json.dumps(results, indent=2))
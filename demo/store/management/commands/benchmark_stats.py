@@ -0,0 +1,64 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.benchmarks import api_client, rolled_back, seed_products, \
+    summarize, time_requests
+from store.models import Product, ProductDailyStats
+
+
+class Command(BaseCommand):
+    help = 'Measures the latency of the product stats endpoint as the ' \
+           'history of daily stats grows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, nargs='+',
+                            default=[1, 3, 5, 10])
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        results = []
+
+        with rolled_back():
+            seed_products(options['products'])
+            product_ids = list(Product.objects.values_list('id', flat=True))
+            client = api_client()
+            url = '/api/v1/products/{}/stats'.format(product_ids[0])
+            seeded_days = 0
+
+            # the history is extended backwards before each measurement
+            for years in sorted(options['years']):
+                days = years * 365
+                ProductDailyStats.objects.bulk_create([
+                    ProductDailyStats(
+                        product_id=product_id,
+                        date=today - timedelta(days=day),
+                        cart_items=day % 7 + 1,
+                        quantity=day % 13 + 1,
+                        sale_quantity=day % 3,
+                    )
+                    for product_id in product_ids
+                    for day in range(seeded_days, days)
+                ], batch_size=10000)
+                seeded_days = days
+
+                results.append({
+                    'years': years,
+                    'daily_rows': ProductDailyStats.objects.count(),
+                    'last_30_days': summarize(time_requests(
+                        client, url, options['repeat'])),
+                    'last_year_weekly': summarize(time_requests(
+                        client, '{}?from={}&granularity=week'.format(
+                            url, today - timedelta(days=365)),
+                        options['repeat'])),
+                    'all_history_monthly': summarize(time_requests(
+                        client, '{}?from={}&granularity=month'.format(
+                            url, today - timedelta(days=days)),
+                        options['repeat'])),
+                })
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store import images
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized variants of the product photos that ' \
+           'don\'t have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='regenerate the variants of every photo')
+        parser.add_argument('--workers', type=int,
+                            default=settings.PRODUCT_PHOTO_WORKERS)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(photo='').exclude(photo=None)
+        if not options['all']:
+            products = products.filter(photo_variants={})
+        photos = list(products.values_list('id', 'photo'))
+
+        # the variants are generated in parallel, and saved from here
+        with ThreadPoolExecutor(max(1, options['workers'])) as executor:
+            futures = [
+                (product_id, photo_name,
+                 executor.submit(images.generate_variants, photo_name))
+                for product_id, photo_name in photos
+            ]
+            generated = 0
+            for product_id, photo_name, future in futures:
+                try:
+                    variants = future.result()
+                except (OSError, ValueError) as exc:
+                    self.stderr.write('{}: {}'.format(photo_name, exc))
+                    continue
+                generated += images.save_variants(product_id, photo_name,
+                                                  variants)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Generated the variants of {} photos'.format(generated)))
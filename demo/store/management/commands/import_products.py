@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.imports import FORMATS, import_products
+
+
+class Command(BaseCommand):
+    help = 'Creates or updates products from a CSV or NDJSON file, ' \
+           'matching them by sku.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='defaults to the extension of the file')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=0,
+                            help='number of processes validating the rows, '
+                                 '0 validates them in this process')
+        parser.add_argument('--rejects',
+                            help='file where the rejected rows and their '
+                                 'errors are written, one JSON per line')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or \
+            os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(
+                'Cannot tell the format of {}, use --format'.format(path))
+
+        rejects = None
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                if options['rejects']:
+                    rejects = open(options['rejects'], 'w', encoding='utf-8')
+                start = time.perf_counter()
+                counts = import_products(
+                    file, file_format, chunk_size=options['chunk_size'],
+                    workers=options['workers'], rejects=rejects)
+                elapsed = time.perf_counter() - start
+        except OSError as exc:
+            raise CommandError(exc) from exc
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {imported} products from {rows} rows ({rejected} '
+            'rejected) in {seconds:.1f}s, {speed:.0f} rows/s'.format(
+                seconds=elapsed, speed=counts['rows'] / max(elapsed, 1e-9),
+                **counts)))
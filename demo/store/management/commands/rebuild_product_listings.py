@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import listings
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product read model from the products and their ' \
+           'shopping cart items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=listings.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not listings.enabled():
+            raise CommandError('The read model is disabled, set '
+                               'PRODUCTS_READ_MODEL to use it')
+        count = listings.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt the listings of {} products'.format(count)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from store import stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily product stats from the shopping cart items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start',
+                            help='first day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end',
+                            help='last day to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        count = stats.rebuild(self.parse_date(options['start']),
+                              self.parse_date(options['end']))
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} daily product stats'.format(count)))
+
+    def parse_date(self, value):
+        if value is None:
+            return None
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise CommandError('{} is not a valid date'.format(value))
+        return date
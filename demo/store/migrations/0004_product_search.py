@@ -0,0 +1,64 @@
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+POSTGRES_CREATE = [
+    'CREATE TABLE store_product_search ('
+    'product_id integer PRIMARY KEY REFERENCES store_product (id) '
+    'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX store_product_search_gin '
+    'ON store_product_search USING gin (document)',
+    'INSERT INTO store_product_search (product_id, document) '
+    'SELECT id, '
+    'setweight(to_tsvector(\'english\', name), \'A\') || '
+    'setweight(to_tsvector(\'english\', description), \'B\') '
+    'FROM store_product',
+]
+POSTGRES_DROP = ['DROP TABLE store_product_search']
+
+SQLITE_CREATE = [
+    'CREATE VIRTUAL TABLE store_product_fts USING fts5('
+    'name, description, tokenize=\'porter unicode61\')',
+    'INSERT INTO store_product_fts (rowid, name, description) '
+    'SELECT id, name, description FROM store_product',
+]
+SQLITE_DROP = ['DROP TABLE store_product_fts']
+
+
+def run_for_vendor(postgres_statements, sqlite_statements):
+    def run(apps, schema_editor):
+        statements = {
+            'postgresql': postgres_statements,
+            'sqlite': sqlite_statements,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0003_product_sale_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(
+                    db_constraint=False, primary_key=True, serialize=False,
+                    related_name='search_document',
+                    on_delete=django.db.models.deletion.DO_NOTHING,
+                    to='store.Product')),
+                ('document',
+                 django.contrib.postgres.search.SearchVectorField()),
+            ],
+            options={
+                'db_table': 'store_product_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(run_for_vendor(POSTGRES_CREATE, SQLITE_CREATE),
+                             run_for_vendor(POSTGRES_DROP, SQLITE_DROP)),
+    ]
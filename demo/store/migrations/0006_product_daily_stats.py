@@ -0,0 +1,55 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# The existing cart items get the current time as created_at, so all of them
+# are rolled up into today's stats.
+def rollup_existing_cart_items(apps, schema_editor):
+    ShoppingCartItem = apps.get_model('store', 'ShoppingCartItem')
+    ProductDailyStats = apps.get_model('store', 'ProductDailyStats')
+    today = django.utils.timezone.localdate()
+    rows = ShoppingCartItem.objects.values('product_id').annotate(
+        cart_items=models.Count('id'),
+        quantity=models.Sum('quantity'),
+    )
+    ProductDailyStats.objects.bulk_create([
+        ProductDailyStats(date=today, **row) for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0005_product_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcartitem',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='ProductDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('cart_items', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('sale_quantity', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(related_name='daily_stats',
+                                              on_delete=django.db.models.deletion.CASCADE,
+                                              to='store.Product')),
+            ],
+            options={
+                'constraints': [
+                    models.UniqueConstraint(
+                        fields=('product', 'date'),
+                        name='store_product_daily_stats_unique'),
+                ],
+            },
+        ),
+        migrations.RunPython(rollup_existing_cart_items,
+                             migrations.RunPython.noop),
+    ]
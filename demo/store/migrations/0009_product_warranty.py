@@ -0,0 +1,31 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0008_product_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64,
+                                                  unique=True)),
+                ('file', models.FileField(upload_to='attachments')),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='warranty',
+            field=models.ForeignKey(
+                blank=True, default=None, null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name='+', to='store.attachment'),
+        ),
+    ]
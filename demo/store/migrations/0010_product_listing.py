@@ -0,0 +1,46 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0009_product_warranty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('id', models.IntegerField(primary_key=True,
+                                           serialize=False)),
+                ('sku', models.CharField(blank=True, max_length=64,
+                                         null=True)),
+                ('name', models.CharField(max_length=200)),
+                ('description', models.TextField()),
+                ('price', models.FloatField()),
+                ('sale_start', models.DateTimeField(blank=True, null=True)),
+                ('sale_end', models.DateTimeField(blank=True, null=True)),
+                ('regular_price', models.FloatField()),
+                ('sale_price', models.FloatField()),
+                ('photo', models.ImageField(blank=True, null=True,
+                                            upload_to='products')),
+                ('photo_variants', models.JSONField(blank=True,
+                                                    default=dict)),
+                ('warranty', models.ForeignKey(
+                    blank=True, db_constraint=False, null=True,
+                    on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='+', to='store.attachment')),
+                ('cart_items', models.JSONField(default=list)),
+                ('cart_item_count', models.IntegerField(default=0)),
+                ('cart_quantity', models.IntegerField(default=0)),
+                ('version', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['sale_start', 'sale_end'],
+                                 name='store_listing_sale_idx'),
+                ],
+            },
+        ),
+    ]
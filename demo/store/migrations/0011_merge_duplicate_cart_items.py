@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+# Merges the items of the same product in a cart into the first one, with
+# the sum of their quantities, so that the constraint can be added. The
+# daily stats still count the merged items until they are rebuilt with the
+# rollup_product_stats command.
+def merge_duplicate_items(apps, schema_editor):
+    ShoppingCartItem = apps.get_model('store', 'ShoppingCartItem')
+    duplicates = ShoppingCartItem.objects.values(
+        'shopping_cart_id', 'product_id',
+    ).annotate(
+        count=models.Count('id'),
+        first_id=models.Min('id'),
+        total_quantity=models.Sum('quantity'),
+    ).filter(count__gt=1).order_by()
+    for row in duplicates:
+        items = ShoppingCartItem.objects.filter(
+            shopping_cart_id=row['shopping_cart_id'],
+            product_id=row['product_id'])
+        items.filter(id=row['first_id']).update(
+            quantity=row['total_quantity'])
+        items.exclude(id=row['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0010_product_listing'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+# Added after merging the duplicate items, in another migration: on
+# PostgreSQL the table can't be altered in the transaction that updated it.
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0011_merge_duplicate_cart_items'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(
+                fields=('shopping_cart', 'product'),
+                name='store_cart_item_unique'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# the prices before the history are unknown: the current price and sale
+# window of every product are assumed to have always been in effect
+HISTORY_START = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def record_current_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    ProductPriceHistory = apps.get_model('store', 'ProductPriceHistory')
+    rows = Product.objects.values_list('id', 'price', 'sale_start',
+                                       'sale_end').order_by('id')
+    ProductPriceHistory.objects.bulk_create([
+        ProductPriceHistory(product_id=product_id, valid_from=HISTORY_START,
+                            price=price, sale_start=sale_start,
+                            sale_end=sale_end)
+        for product_id, price, sale_start, sale_end in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('store', '0012_cart_item_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPriceHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('valid_from', models.DateTimeField()),
+                ('price', models.FloatField()),
+                ('sale_start', models.DateTimeField(blank=True, null=True)),
+                ('sale_end', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='price_history', to='store.product')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['product', 'valid_from'],
+                                 name='store_price_history_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(record_current_prices,
+                             migrations.RunPython.noop),
+    ]
@@ -1,11 +1,106 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import BooleanField, Case, DecimalField, F, \
+    FloatField, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Now, Round
 from django.utils import timezone
 
 
+class ProductQuerySet(models.QuerySet):
+    # These build the same rules as Product.is_on_sale() and
+    # Product.current_price() as SQL expressions, so that filtering and
+    # ordering by them can happen in the database. The prefix lets other
+    # models use them through a relation, e.g. 'product__'.
+    @staticmethod
+    def on_sale_condition(prefix=''):
+        now = Now()
+        return Q(**{prefix + 'sale_start__lte': now}) & (
+            Q(**{prefix + 'sale_end__isnull': True}) |
+            Q(**{prefix + 'sale_end__gte': now})
+        )
+
+    @classmethod
+    def current_price_expression(cls, prefix=''):
+        return Case(
+            When(cls.on_sale_condition(prefix),
+                 then=cls.sale_price_expression(prefix)),
+            default=cls.regular_price_expression(prefix),
+            output_field=FloatField(),
+        )
+
+    @staticmethod
+    def regular_price_expression(prefix=''):
+        return Round(F(prefix + 'price'), 2)
+
+    @staticmethod
+    def sale_price_expression(prefix=''):
+        return Round(F(prefix + 'price') * (1 - Product.DISCOUNT_RATE), 2)
+
+    # What Product.is_on_sale() and Product.current_price() return, as
+    # computed by the database. The serializers and templates read them from
+    # the rows instead of calling the methods for every product.
+    def with_sale_info(self):
+        return self.annotate(
+            on_sale_now=Case(
+                When(self.on_sale_condition(), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+            price_now=self.current_price_expression(),
+        )
+
+    def on_sale(self):
+        return self.with_sale_info().filter(on_sale_now=True)
+
+    # The last sale_start/sale_end that was crossed before now and the next
+    # one to be crossed, across all the products of the queryset. These are
+    # the moments when is_on_sale and current_price change by themselves.
+    def sale_boundaries(self, now):
+        boundaries = self.aggregate(
+            last_start=Max('sale_start', filter=Q(sale_start__lte=now)),
+            last_end=Max('sale_end', filter=Q(sale_end__lt=now)),
+            next_start=Min('sale_start', filter=Q(sale_start__gt=now)),
+            next_end=Min('sale_end', filter=Q(sale_end__gte=now)),
+        )
+        past = [boundaries['last_start'], boundaries['last_end']]
+        upcoming = [boundaries['next_start'], boundaries['next_end']]
+        return (max(filter(None, past), default=None),
+                min(filter(None, upcoming), default=None))
+
+    # like Django's own async queryset methods, this runs the query in the
+    # thread of the async ORM
+    async def asale_boundaries(self, now):
+        return await sync_to_async(self.sale_boundaries)(now)
+
+
+# the fields of a product recorded in its price history
+PRICE_FIELDS = ('price', 'sale_start', 'sale_end')
+
+
+# A file stored once per content, e.g. the warranty of products: uploading
+# the same file again reuses the attachment. See store/attachments.py
+class Attachment(models.Model):
+    # sha256 of the content, also used as the file name
+    content_hash = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='attachments')
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __repr__(self):
+        return '<Attachment object ({}) "{}">'.format(self.id, self.file.name)
+
+
 class Product(models.Model):
     DISCOUNT_RATE = 0.10
 
     id = models.AutoField(primary_key=True)
+    # the identifier of the product in the systems the catalog is imported
+    # from, used to match the imported rows with the existing products
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                           default=None)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.FloatField()
@@ -13,15 +108,111 @@ class Product(models.Model):
     sale_end = models.DateTimeField(blank=True, null=True, default=None)
     photo = models.ImageField(blank=True, null=True, default=None,
                               upload_to='products')
+    # the resized copies of the photo, {format: [[width, name], ...]}, see
+    # store/images.py
+    photo_variants = models.JSONField(blank=True, default=dict,
+                                      editable=False)
+    # only the id is read with the product, the file is looked up when
+    # the warranty is downloaded
+    warranty = models.ForeignKey(Attachment, blank=True, null=True,
+                                 default=None, related_name='+',
+                                 on_delete=models.SET_NULL)
+    # both change on every write to the product or to its cart items, and
+    # are used to build the validators of conditional requests (ETag and
+    # Last-Modified) without serializing the product
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # lets the on-sale filter find the products whose sale window
+            # contains the current time without scanning the whole table
+            models.Index(fields=['sale_start', 'sale_end'],
+                         name='store_product_sale_idx'),
+        ]
+
+    # The version is incremented by the UPDATE itself, so that concurrent
+    # saves of the same product never write the same version (and ETag) for
+    # different content, then read back.
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        self.version = F('version') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {'version', 'updated_at',
+                                       *update_fields}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+    # keeps the photo read from the database, so that the variants are only
+    # generated when a new one is saved, and the price and sale window, so
+    # that the price history only gets a row when they change (None when
+    # they were not all read)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_photo = instance.__dict__.get('photo')
+        instance.saved_prices = None
+        if all(name in instance.__dict__ for name in PRICE_FIELDS):
+            instance.saved_prices = tuple(instance.__dict__[name]
+                                          for name in PRICE_FIELDS)
+        return instance
+
+    # for the changes that are part of the product representation but are
+    # not made to the product itself, like its cart items
+    @classmethod
+    def touch(cls, product_ids):
+        cls.objects.filter(id__in=product_ids).update(
+            version=F('version') + 1, updated_at=timezone.now())
 
     def is_on_sale(self):
-        now = timezone.now()
-        if self.sale_start:
-            if self.sale_end:
-                return self.sale_start <= now <= self.sale_end
-            return self.sale_start <= now
+        return self.was_on_sale(timezone.now())
+
+    # The srcset attribute of every format of the photo variants:
+    # {'webp': 'url 320w, url 640w', ...}. build_url can make the URLs of
+    # the storage absolute.
+    def photo_srcset(self, build_url=None):
+        return Product.srcset(self.photo_variants, build_url)
+
+    # photo_srcset() from the photo_variants column
+    @staticmethod
+    def srcset(photo_variants, build_url=None):
+        storage = Product._meta.get_field('photo').storage
+        srcset = {}
+        for variant_format, variants in photo_variants.items():
+            urls = []
+            for width, name in variants:
+                url = storage.url(name)
+                if build_url is not None:
+                    url = build_url(url)
+                urls.append('{} {}w'.format(url, width))
+            srcset[variant_format] = ', '.join(urls)
+        return srcset
+
+    def was_on_sale(self, when):
+        return Product.in_sale_window(self.sale_start, self.sale_end, when)
+
+    # was_on_sale() from the columns
+    @staticmethod
+    def in_sale_window(sale_start, sale_end, when):
+        if sale_start:
+            if sale_end:
+                return sale_start <= when <= sale_end
+            return sale_start <= when
         return False
 
+    # What current_price() returns at the given time for a product with this
+    # price and sale window, e.g. for the rows of its price history.
+    @staticmethod
+    def price_at(price, sale_start, sale_end, when):
+        if Product.in_sale_window(sale_start, sale_end, when):
+            return round(price * (1 - Product.DISCOUNT_RATE), 2)
+        return round(price, 2)
+
     def get_rounded_price(self):
         return round(self.price, 2)
 
@@ -35,24 +226,150 @@ class Product(models.Model):
         return '<Product object ({}) "{}">'.format(self.id, self.name)
 
 
+# The full-text search document of a product on PostgreSQL. It lives in its
+# own table so that the list queries don't have to read the tsvector, and the
+# table (with its GIN index and its ON DELETE CASCADE foreign key) is only
+# created on PostgreSQL by the migrations. See store/search.py.
+class ProductSearchDocument(models.Model):
+    product = models.OneToOneField(Product, primary_key=True,
+                                   related_name='search_document',
+                                   on_delete=models.DO_NOTHING,
+                                   db_constraint=False)
+    document = SearchVectorField()
+
+    class Meta:
+        managed = False
+        db_table = 'store_product_search'
+
+
+class ProductListingQuerySet(ProductQuerySet):
+    # the prices are already rounded in the rows
+    @classmethod
+    def current_price_expression(cls, prefix=''):
+        return Case(
+            When(cls.on_sale_condition(prefix),
+                 then=F(prefix + 'sale_price')),
+            default=F(prefix + 'regular_price'),
+            output_field=FloatField(),
+        )
+
+
+# A denormalized read model of the products: one row per product with
+# everything the product list responses need, including what would
+# otherwise be read from the cart items or computed on every request. When
+# the PRODUCTS_READ_MODEL setting is on, ProductList serves its pages from
+# this table in a single query. The rows are kept up to date by the signals
+# and rebuilt by the rebuild_product_listings command, see
+# store/listings.py
+class ProductListing(models.Model):
+    # the id of the product
+    id = models.IntegerField(primary_key=True)
+    sku = models.CharField(max_length=64, blank=True, null=True)
+    name = models.CharField(max_length=200)
+    description = models.TextField()
+    price = models.FloatField()
+    sale_start = models.DateTimeField(blank=True, null=True)
+    sale_end = models.DateTimeField(blank=True, null=True)
+    # the price and the discounted price, rounded by the database like
+    # ProductQuerySet.current_price_expression() does. Whether the product
+    # is on sale depends on the current time, so it is still computed by the
+    # queries, from the indexed sale window.
+    regular_price = models.FloatField()
+    sale_price = models.FloatField()
+    photo = models.ImageField(blank=True, null=True, upload_to='products')
+    photo_variants = models.JSONField(blank=True, default=dict)
+    warranty = models.ForeignKey(Attachment, blank=True, null=True,
+                                 related_name='+', db_constraint=False,
+                                 on_delete=models.DO_NOTHING)
+    # the cart items as in the responses, [{'product': 1, 'quantity': 2}]
+    cart_items = models.JSONField(default=list)
+    cart_item_count = models.IntegerField(default=0)
+    cart_quantity = models.IntegerField(default=0)
+    # copied from the product, for the validators of the responses
+    version = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+
+    objects = ProductListingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sale_start', 'sale_end'],
+                         name='store_listing_sale_idx'),
+        ]
+
+    photo_srcset = Product.photo_srcset
+
+    def __repr__(self):
+        return '<ProductListing object ({}) "{}">'.format(self.id, self.name)
+
+
+CENTS = Decimal('0.01')
+
+
+def to_cents(amount):
+    return amount.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+# The amount of a cart item at the current price of its product, computed
+# by the database as a decimal.
+def line_total_expression(prefix=''):
+    return Cast(
+        F(prefix + 'quantity') *
+        ProductQuerySet.current_price_expression(prefix + 'product__'),
+        DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class ShoppingCartQuerySet(models.QuerySet):
+    def with_subtotal(self):
+        return self.annotate(subtotal=Coalesce(
+            Sum(line_total_expression('item__')), Decimal('0.00'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+
+    # The totals of many carts in a single query: {cart_id: totals} where
+    # totals is like the result of ShoppingCart.totals()
+    def totals(self):
+        return {
+            cart['id']: ShoppingCart.totals_from_subtotal(cart['subtotal'])
+            for cart in self.with_subtotal().values('id', 'subtotal')
+        }
+
+
 class ShoppingCart(models.Model):
-    TAX_RATE = 0.13
+    TAX_RATE = Decimal('0.13')
 
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=200)
     address = models.CharField(max_length=200)
 
+    objects = ShoppingCartQuerySet.as_manager()
+
+    # subtotal, taxes and total of the cart as decimals, computed from a
+    # single aggregate query over its items
+    def totals(self):
+        subtotal = self.items.aggregate(
+            subtotal=Sum(line_total_expression()))['subtotal']
+        return self.totals_from_subtotal(subtotal)
+
+    @classmethod
+    def totals_from_subtotal(cls, subtotal):
+        subtotal = to_cents(subtotal or Decimal('0.00'))
+        taxes = to_cents(subtotal * cls.TAX_RATE)
+        return {
+            'subtotal': subtotal,
+            'taxes': taxes,
+            'total': subtotal + taxes,
+        }
+
     def subtotal(self):
-        amount = 0.0
-        for item in self.shopping_cart_items:
-            amount += item.quantity * item.product.get_price()
-        return round(amount, 2)
+        return self.totals()['subtotal']
 
     def taxes(self):
-        return round(self.TAX_RATE * self.subtotal(), 2)
+        return self.totals()['taxes']
 
     def total(self):
-        return round(self.subtotal() * self.taxes(), 2)
+        return self.totals()['total']
 
     def __repr__(self):
         name = self.name or '[Guest]'
@@ -61,6 +378,34 @@ class ShoppingCart(models.Model):
                                                              address)
 
 
+class ShoppingCartItemQuerySet(models.QuerySet):
+    # Serializing a page of products used to issue one cart item query per
+    # product. Loading the items of the whole page at once and grouping them
+    # by product id lets the serializer do a dict lookup instead.
+    def grouped_by_product(self, products):
+        product_ids = [product.id for product in products]
+        grouped = {product_id: [] for product_id in product_ids}
+        for item in self.filter(product_id__in=product_ids):
+            grouped[item.product_id].append(item)
+        return grouped
+
+    async def agrouped_by_product(self, products):
+        product_ids = [product.id for product in products]
+        grouped = {product_id: [] for product_id in product_ids}
+        async for item in self.filter(product_id__in=product_ids):
+            grouped[item.product_id].append(item)
+        return grouped
+
+    # annotates each item with the current price of its product and its
+    # amount at that price
+    def with_prices(self):
+        return self.annotate(
+            current_price=ProductQuerySet.current_price_expression(
+                'product__'),
+            line_total=line_total_expression(),
+        )
+
+
 class ShoppingCartItem(models.Model):
     shopping_cart = models.ForeignKey(ShoppingCart, related_name='items',
                                       related_query_name='item',
@@ -68,11 +413,88 @@ class ShoppingCartItem(models.Model):
     product = models.ForeignKey(Product, related_name='+',
                                 on_delete=models.CASCADE)
     quantity = models.IntegerField()
+    # the day of the cart item in the product stats
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = ShoppingCartItemQuerySet.as_manager()
+
+    class Meta:
+        # a cart has one item per product, whose quantity is incremented
+        # when the product is added again, see store/carts.py
+        constraints = [
+            models.UniqueConstraint(fields=['shopping_cart', 'product'],
+                                    name='store_cart_item_unique'),
+        ]
+
+    # keeps the quantity read from the database, so that the product stats
+    # can be updated with the difference when the item is saved
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_quantity = instance.__dict__.get('quantity')
+        return instance
 
     def total(self):
-        return round(self.quantity * self.product.current_price())
+        return to_cents(self.quantity *
+                        Decimal(str(self.product.current_price())))
 
     def __repr__(self):
         return '<ShoppingCartItem object ({}) {}x "{}">'.format(self.id,
                                                                 self.quantity,
                                                                 self.product.name)
+
+
+# Cart items rolled up per product and day (the day the item was created),
+# so that the stats endpoint only has to sum a few pre-aggregated rows
+# instead of scanning the cart items. Kept up to date by the cart item
+# signals and rebuilt by the rollup_product_stats command, see
+# store/stats.py.
+class ProductDailyStats(models.Model):
+    product = models.ForeignKey(Product, related_name='daily_stats',
+                                on_delete=models.CASCADE)
+    date = models.DateField()
+    # number of cart items
+    cart_items = models.IntegerField(default=0)
+    # units in those cart items
+    quantity = models.IntegerField(default=0)
+    # units added to carts while the product was on sale
+    sale_quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'],
+                                    name='store_product_daily_stats_unique'),
+        ]
+
+    def __repr__(self):
+        return '<ProductDailyStats object ({}) {} {}>'.format(self.id,
+                                                              self.product_id,
+                                                              self.date)
+
+
+# The price and sale window of a product from valid_from until the next row
+# of the product, appended whenever they change and never updated, see
+# store/prices.py. A sale window keeps its rules in the history: a sale
+# scheduled in the future starts and ends by itself, without another row.
+class ProductPriceHistory(models.Model):
+    product = models.ForeignKey(Product, related_name='price_history',
+                                on_delete=models.CASCADE)
+    valid_from = models.DateTimeField()
+    price = models.FloatField()
+    sale_start = models.DateTimeField(blank=True, null=True)
+    sale_end = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # the rows of a product in order, for the point-in-time lookups
+            models.Index(fields=['product', 'valid_from'],
+                         name='store_price_history_idx'),
+        ]
+
+    def price_at(self, when):
+        return Product.price_at(self.price, self.sale_start, self.sale_end,
+                                when)
+
+    def __repr__(self):
+        return '<ProductPriceHistory object ({}) {} {}>'.format(
+            self.id, self.product_id, self.valid_from.isoformat())
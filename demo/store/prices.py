@@ -0,0 +1,101 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from store.models import PRICE_FIELDS, Product, ProductPriceHistory
+
+# the history rows inserted per query
+BATCH_SIZE = 1000
+
+
+# Appends a row to the price history of every product whose price or sale
+# window changed since it was read (see Product.from_db()), or that was not
+# read from the database, in a single query. Called by the product signals
+# and by the writes that don't send them: the bulk endpoint, the imports
+# and the benchmark catalogs. The rows take effect at valid_from, now by
+# default.
+def record(products, valid_from=None):
+    if valid_from is None:
+        valid_from = timezone.now()
+    rows = []
+    for product in products:
+        prices = price_values(product)
+        saved = getattr(product, 'saved_prices', None)
+        if saved is None or normalize(saved) != normalize(prices):
+            rows.append(ProductPriceHistory(
+                product_id=product.id, valid_from=valid_from,
+                **dict(zip(PRICE_FIELDS, prices))))
+        product.saved_prices = prices
+    ProductPriceHistory.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+def price_values(product):
+    return tuple(getattr(product, name) for name in PRICE_FIELDS)
+
+
+# the price can be a Decimal from a serializer, and a float once read
+def normalize(prices):
+    price, *window = prices
+    return (None if price is None else float(price), *window)
+
+
+# The price paid for each product at each time, like Product.current_price()
+# returned then, given (product id, time) pairs, e.g. for the items of many
+# carts. The rows between the earliest and the latest time, and the last row
+# of each product before the earliest time, are read in a single query, and
+# the one in effect at each time is found by bisecting the rows of its
+# product. None when the product had no price recorded yet.
+def prices_at(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return []
+    earliest = min(when for product_id, when in pairs)
+    # the row in effect at the earliest time, the same one bisecting finds
+    in_effect = ProductPriceHistory.objects.filter(
+        product_id=OuterRef('product_id'), valid_from__lte=earliest,
+    ).order_by('-valid_from', '-id').values('id')[:1]
+    rows = ProductPriceHistory.objects.filter(
+        Q(valid_from__gt=earliest) | Q(id=Subquery(in_effect)),
+        product_id__in={product_id for product_id, when in pairs},
+        valid_from__lte=max(when for product_id, when in pairs),
+    ).order_by('product_id', 'valid_from', 'id').values_list(
+        'product_id', 'valid_from', *PRICE_FIELDS)
+
+    history = defaultdict(lambda: ([], []))
+    for product_id, valid_from, *prices in rows:
+        times, entries = history[product_id]
+        times.append(valid_from)
+        entries.append(prices)
+
+    results = []
+    for product_id, when in pairs:
+        times, entries = history.get(product_id, ((), ()))
+        position = bisect_right(times, when)
+        results.append(Product.price_at(*entries[position - 1], when)
+                       if position else None)
+    return results
+
+
+# The id of the history row of a product in effect at the given time, as an
+# expression: both can be OuterRef()s. Before its first row, that row is
+# assumed to have always been in effect, like the data migration of the
+# history assumes for the products that existed before it, e.g. for the
+# cart items created with earlier dates by the imports and the benchmarks.
+# The time is only compared in the WHERE clauses, as SQLite doesn't resolve
+# the outer columns in the ORDER BY of a subquery.
+def history_id_at(product_id, when):
+    history = ProductPriceHistory.objects.filter(product_id=product_id)
+    in_effect = history.filter(valid_from__lte=when) \
+        .order_by('-valid_from', '-id')
+    first = history.order_by('valid_from', '-id')
+    return Coalesce(Subquery(in_effect.values('id')[:1]),
+                    Subquery(first.values('id')[:1]))
+
+
+# the price of every cart item when it was added to its cart
+def cart_item_prices(items):
+    return prices_at((item.product_id, item.created_at) for item in items)
@@ -0,0 +1,35 @@
+from rest_framework.renderers import JSONRenderer
+
+# orjson is optional, the responses are rendered by the stdlib encoder
+# without it
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+# DRF's JSONRenderer, with orjson when it is installed. The bytes are the
+# same as the stdlib encoder's: compact, UTF-8, with DRF's JSONEncoder for
+# the datetimes, decimals and the other values orjson doesn't encode the
+# same way, and the line and paragraph separators escaped. Indented
+# responses and the data orjson can't encode go through the stdlib encoder.
+# Floats below 1e-4 or from 1e16 are written in another notation by orjson
+# (e.g. 1e16 instead of 1e+16), the ones of the API are prices.
+class FastJSONRenderer(JSONRenderer):
+    options = 0 if orjson is None else \
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or \
+                self.ensure_ascii or self.get_indent(
+                    accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=self.encoder_class().default,
+                                    option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return rendered.replace('\u2028'.encode(), b'\\u2028') \
+            .replace('\u2029'.encode(), b'\\u2029')
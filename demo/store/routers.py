@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# set on the responses to the requests that wrote something, see
+# ReplicaRoutingMiddleware
+STICKY_COOKIE = 'store_primary'
+
+_routing = ContextVar('store_db_routing', default=None)
+
+
+# How the reads of the current request are routed.
+class Routing:
+    def __init__(self, sticky=False):
+        # the client wrote something recently
+        self.sticky = sticky
+        # the request wrote something
+        self.wrote = False
+        # inside a view marked with replica_reads()
+        self.replica_reads = False
+
+
+# Sends the reads of the views marked with replica_reads() to the replica
+# given by the DATABASE_READ_REPLICA setting, and everything else to the
+# primary. Once a request writes, and for DATABASE_REPLICA_STICKY_SECONDS
+# after that for the same client, reads go to the primary too, so that
+# clients read their own writes while the replica catches up.
+# The responses built from the replica in the DATABASE_REPLICA_STICKY_SECONDS
+# after a write are not cached (see store/cache.py), otherwise the clients
+# reading from the primary could be served the data of before their write.
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not reading_from_replica_now():
+            return None
+        return settings.DATABASE_READ_REPLICA
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return 'default'
+
+    # the replica has the same data as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+# Marks a view, sync or async, whose reads can be served by the replica.
+def replica_reads(view):
+    if iscoroutinefunction(view):
+        async def async_wrapper(*args, **kwargs):
+            with reading_from_replica():
+                return await view(*args, **kwargs)
+
+        return wraps(view)(async_wrapper)
+
+    def wrapper(*args, **kwargs):
+        with reading_from_replica():
+            return view(*args, **kwargs)
+
+    return wraps(view)(wrapper)
+
+
+# whether the reads of the current request go to the replica
+def reading_from_replica_now():
+    routing = _routing.get()
+    return settings.DATABASE_READ_REPLICA is not None and \
+        routing is not None and routing.replica_reads and \
+        not routing.sticky and not routing.wrote
+
+
+@contextmanager
+def reading_from_replica():
+    routing = _routing.get()
+    if routing is None:
+        yield
+        return
+    previous, routing.replica_reads = routing.replica_reads, True
+    try:
+        yield
+    finally:
+        routing.replica_reads = previous
+
+
+# Only used with a DATABASE_READ_REPLICA. Tracks the writes of every request
+# for PrimaryReplicaRouter, and sets a cookie on the responses to the ones
+# that wrote, which keeps the next requests of the client on the primary
+# until it expires. Sync and async, so that the async views don't run in a
+# thread because of it.
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DATABASE_READ_REPLICA is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = Routing(sticky=STICKY_COOKIE in request.COOKIES)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.set_sticky_cookie(routing, response)
+
+    async def __acall__(self, request):
+        routing = Routing(sticky=STICKY_COOKIE in request.COOKIES)
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.set_sticky_cookie(routing, response)
+
+    def set_sticky_cookie(self, routing, response):
+        if routing.wrote:
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
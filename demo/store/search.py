@@ -0,0 +1,150 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend
+
+
+# All the backends share the same contract: every whitespace separated term
+# of the ?search= parameter has to match the name or the description of the
+# product (after stemming), and the matching products are annotated with a
+# search_rank where higher means more relevant.
+class SearchBackend:
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    # called after products are saved so that their search document is kept
+    # up to date with the name and description
+    def index_products(self, product_ids, using='default'):
+        pass
+
+    def remove_products(self, product_ids, using='default'):
+        pass
+
+
+# Only used for databases without a full-text engine, it behaves like DRF's
+# SearchFilter and can't use an index.
+class SimpleSearchBackend(SearchBackend):
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(Q(name__icontains=term) |
+                                       Q(description__icontains=term))
+        return queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField()))
+
+
+# On PostgreSQL every product has a weighted tsvector stored in the
+# store_product_search table (see the 0004 migration), which has a GIN index.
+class PostgresSearchBackend(SearchBackend):
+    config = 'english'
+
+    def search(self, queryset, terms):
+        query = SearchQuery(' '.join(terms), config=self.config,
+                            search_type='plain')
+        return queryset.filter(search_document__document=query).annotate(
+            search_rank=SearchRank(F('search_document__document'), query))
+
+    def index_products(self, product_ids, using='default'):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO store_product_search (product_id, document) '
+                'SELECT id, '
+                'setweight(to_tsvector(%s, name), \'A\') || '
+                'setweight(to_tsvector(%s, description), \'B\') '
+                'FROM store_product WHERE id = ANY(%s) '
+                'ON CONFLICT (product_id) '
+                'DO UPDATE SET document = EXCLUDED.document',
+                [self.config, self.config, list(product_ids)])
+
+    # rows are removed by the ON DELETE CASCADE of the foreign key
+
+
+# On SQLite the products are indexed in the store_product_fts FTS5 virtual
+# table, using the product id as rowid. The porter tokenizer stems the terms
+# like the english configuration does on PostgreSQL.
+class SqliteSearchBackend(SearchBackend):
+    # relative weights of the name and description columns for bm25()
+    name_weight = 10.0
+    description_weight = 1.0
+
+    def search(self, queryset, terms):
+        # quoting every term keeps FTS5 operators typed by users from being
+        # interpreted, and separating them with spaces means AND
+        match = ' '.join('"{}"'.format(term.replace('"', '""'))
+                         for term in terms)
+        table = queryset.model._meta.db_table
+        # bm25() is lower for better matches, so it gets negated to follow
+        # the "higher is more relevant" contract
+        return queryset.filter(id__in=RawSQL(
+            'SELECT rowid FROM store_product_fts '
+            'WHERE store_product_fts MATCH %s', [match],
+        )).annotate(search_rank=RawSQL(
+            'SELECT -bm25(store_product_fts, %s, %s) FROM store_product_fts '
+            'WHERE store_product_fts MATCH %s '
+            'AND rowid = "{}"."id"'.format(table),
+            [self.name_weight, self.description_weight, match],
+            output_field=FloatField(),
+        ))
+
+    def index_products(self, product_ids, using='default'):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM store_product_fts '
+                'WHERE rowid IN ({})'.format(placeholders), product_ids)
+            cursor.execute(
+                'INSERT INTO store_product_fts (rowid, name, description) '
+                'SELECT id, name, description FROM store_product '
+                'WHERE id IN ({})'.format(placeholders), product_ids)
+
+    def remove_products(self, product_ids, using='default'):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM store_product_fts WHERE rowid IN ({})'.format(
+                    ', '.join(['%s'] * len(product_ids))), product_ids)
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+# The backend can be forced with the PRODUCTS_SEARCH_BACKEND setting (a
+# dotted path), otherwise it is picked from the database vendor.
+def get_search_backend(using='default'):
+    backend_path = getattr(settings, 'PRODUCTS_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    vendor = connections[using].vendor
+    return SEARCH_BACKENDS.get(vendor, SimpleSearchBackend)()
+
+
+# Filter backend used by ProductList instead of DRF's SearchFilter, which
+# builds ILIKE '%term%' queries that can never use an index. Results are
+# ordered by relevance unless the client asks for a different ordering.
+class ProductSearchFilter(BaseFilterBackend):
+    search_param = 'search'
+    ordering_param = 'ordering'
+
+    def get_search_terms(self, request):
+        params = request.query_params.get(self.search_param, '')
+        return params.replace('\x00', '').split()
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        queryset = get_search_backend(queryset.db).search(queryset, terms)
+        if self.ordering_param in request.query_params:
+            return queryset
+        return queryset.order_by('-search_rank', 'id')
@@ -1,6 +1,19 @@
-from rest_framework import serializers
+from operator import attrgetter
 
-from store.models import Product, ShoppingCartItem
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from store import cache as product_cache
+from store import instrumentation, listings, prices
+from store.attachments import check_size, store_attachment
+from store.models import Product, ProductListing, ShoppingCartItem
+from store.search import get_search_backend
+
+# how many products are written or indexed per query by the bulk endpoint
+BULK_BATCH_SIZE = 1000
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -11,12 +24,103 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ('product', 'quantity')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+# The units to add to a cart item, or to remove when negative
+class CartItemIncrementSerializer(serializers.Serializer):
+    quantity = serializers.IntegerField(min_value=-100, max_value=100)
+
+    def validate_quantity(self, value):
+        if value == 0:
+            raise serializers.ValidationError('must not be 0')
+        return value
+
+
+# Counts the time spent serializing in the instrumentation of the request,
+# see store/instrumentation.py
+class TimedSerializerMixin:
+    @property
+    def data(self):
+        with instrumentation.timed('serializer'):
+            return super().data
+
+
+# ProductSerializer(many=True) creates this list serializer, which writes all
+# the products with bulk_create() and bulk_update() instead of saving them
+# one by one. Those don't send the model signals, so the search index, the
+# price history and the cached responses are updated here, once for the
+# whole list.
+class ProductListSerializer(TimedSerializerMixin,
+                            serializers.ListSerializer):
+    # For updates the instance is a dict of the products by id, and every
+    # item of the data has the id of the product it updates. The warranty
+    # files are attachments saved one by one, so they are rejected here
+    # rather than dropped: they can be uploaded with the product endpoint.
+    def run_child_validation(self, data):
+        if isinstance(data, dict) and 'warranty' in data:
+            raise serializers.ValidationError({'warranty': [
+                'Not supported for many products, upload it to the product.']})
+        if self.instance is None:
+            return super().run_child_validation(data)
+
+        product_id = data.get('id') if isinstance(data, dict) else None
+        product = self.instance.get(product_id)
+        if product is None:
+            raise serializers.ValidationError({'id': ['Not found.']})
+        self.child.instance = product
+        self.child.initial_data = data
+        attrs = super().run_child_validation(data)
+        attrs['id'] = product.id
+        return attrs
+
+    def create(self, validated_data):
+        products = []
+        for attrs in validated_data:
+            products.append(Product(**attrs))
+        Product.objects.bulk_create(products, batch_size=BULK_BATCH_SIZE)
+        prices.record(products)
+        self.products_changed([product.id for product in products])
+        return products
+
+    def update(self, instance, validated_data):
+        now = timezone.now()
+        fields = {'version', 'updated_at'}
+        # a product sent twice ends up with the values of the last item
+        products = {}
+        for attrs in validated_data:
+            product = instance[attrs.pop('id')]
+            for field, value in attrs.items():
+                setattr(product, field, value)
+            fields.update(attrs)
+            # what Product.save() does, which bulk_update() doesn't call
+            product.version = F('version') + 1
+            product.updated_at = now
+            products[product.id] = product
+        products = list(products.values())
+        Product.objects.bulk_update(products, fields,
+                                    batch_size=BULK_BATCH_SIZE)
+        prices.record(products, now)
+        self.products_changed([product.id for product in products])
+        return products
+
+    def products_changed(self, product_ids):
+        backend = get_search_backend()
+        for start in range(0, len(product_ids), BULK_BATCH_SIZE):
+            batch = product_ids[start:start + BULK_BATCH_SIZE]
+            backend.index_products(batch)
+            listings.refresh(batch)
+        product_cache.invalidate_products(product_ids)
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # to simplify how we added custom field data, we can make the attributes
     # that we initially set in the two representation method, to use serializer
     # fields.
-    is_on_sale = serializers.BooleanField(read_only=True)
-    current_price = serializers.FloatField(read_only=True)
+    # The views annotate both of them in the queryset (see
+    # ProductQuerySet.with_sale_info()), so they are read from the row
+    # instead of calling Product.is_on_sale() and Product.current_price()
+    # for every product.
+    is_on_sale = serializers.BooleanField(source='on_sale_now',
+                                          read_only=True)
+    current_price = serializers.FloatField(source='price_now', read_only=True)
     # override the description field by adding some props to it for adding
     # validation
     description = serializers.CharField(min_length=2, max_length=100)
@@ -41,54 +145,269 @@ class ProductSerializer(serializers.ModelSerializer):
         help_text='Accepted format is "12:01 PM 16 April 2019',
         style={'input_type': 'text', 'placeholder': '12:01 AM 28 July 2019'})
     photo = serializers.ImageField(default=None)
+    # the srcset attributes of the resized variants of the photo by format,
+    # e.g. {'webp': 'http://.../vitamin-a.<hash>.320w.webp 320w, ...'}
+    photo_srcset = serializers.SerializerMethodField()
     # We're going to allow the uploading of a warranty file for a product.
-    # We use the file field for this, but since the product model does not
-    # have a warranty file field in the model itself, we're going to be adding
-    # the write-only configuration option. This means that when we write to
-    # the field the data does not get saved to the model.
-    # We're going to override the update method, so that we can make use of
-    # the warranty field. If a warranty file is supplied,
-    # we're going to add it to the description of the product.
-    # we can use write-only fields when a field is being written to and
-    # the data can be used in other model fields.
-    warranty = serializers.FileField(write_only=True, default=None)
+    # The product model only references the file as an attachment (see
+    # validate_warranty), so we use the write-only configuration option:
+    # the file is accepted when writing, and the responses include the
+    # warranty_url to download it instead of the file itself.
+    # Leaving the field out keeps the current warranty, and null removes it.
+    warranty = serializers.FileField(write_only=True, required=False,
+                                     allow_null=True)
+    # The URL is built from the product id only, so the attachment is not
+    # read until the warranty is actually downloaded.
+    warranty_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ('id', 'name', 'description', 'price',
-                  'sale_start', 'sale_end', 'is_on_sale', 'current_price',
-                  'cart_items', 'photo', 'warranty')
+        fields: tuple[str, ...] = (
+            'id', 'sku', 'name', 'description', 'price', 'sale_start',
+            'sale_end', 'is_on_sale', 'current_price', 'cart_items', 'photo',
+            'photo_srcset', 'warranty', 'warranty_url')
+        list_serializer_class = ProductListSerializer
+
+    # the columns read by the method fields, for the views that only read
+    # the columns of the fields in the response (see SparseFieldsMixin)
+    method_field_columns = {
+        'photo_srcset': ('photo', 'photo_variants'),
+        'warranty_url': ('warranty',),
+    }
 
     def get_cart_items(self, instance):
-        items = ShoppingCartItem.objects.filter(product=instance)
+        # the views load the cart items for every product being serialized
+        # in a single query and pass them in through the context, grouped by
+        # product id. We only hit the database here when serializing a
+        # product outside of those views.
+        cart_items = self.context.get('cart_items')
+        if cart_items is not None and instance.id in cart_items:
+            items = cart_items[instance.id]
+        else:
+            items = ShoppingCartItem.objects.filter(product=instance)
         # the "many" parameter is used to control whether one cart item is
         # serialized or whether a list serializer is automatically created
         # to serialize a collection of cart items.
         return CartItemSerializer(items, many=True).data
 
+    def get_photo_srcset(self, instance):
+        request = self.context.get('request')
+        return instance.photo_srcset(
+            request.build_absolute_uri if request is not None else None)
+
+    def get_warranty_url(self, instance):
+        if instance.warranty_id is None:
+            return None
+        url = reverse('product-warranty', args=[instance.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    # The uploads larger than the ATTACHMENT_MAX_SIZE setting are rejected
+    # while they are received (see store.attachments.AttachmentUploadHandler),
+    # and by the size here otherwise. The file is only stored once the whole
+    # product is valid, see save_attachments().
+    def validate_warranty(self, value):
+        if value is not None:
+            check_size(value)
+        return value
+
+    # A sale can be scheduled ahead of time, it starts and ends by itself
+    # (see ProductPriceHistory), but it has to end after it starts. The
+    # partial updates are checked against the current sale window, when they
+    # change it: a product whose window is already invalid can still be
+    # renamed.
+    def validate(self, attrs):
+        if 'sale_start' not in attrs and 'sale_end' not in attrs:
+            return attrs
+        sale_start = attrs.get('sale_start',
+                               getattr(self.instance, 'sale_start', None))
+        sale_end = attrs.get('sale_end',
+                             getattr(self.instance, 'sale_end', None))
+        if sale_start and sale_end and sale_end < sale_start:
+            raise serializers.ValidationError(
+                {'sale_end': ['The sale must end after it starts.']})
+        return attrs
+
+    def create(self, validated_data):
+        instance = super().create(self.save_attachments(validated_data))
+        self.set_sale_info(instance)
+        return instance
+
+    # The saved product wasn't read with the annotations of with_sale_info(),
+    # or they are from before the update: they are set from the model
+    # methods, with the new values.
+    @staticmethod
+    def set_sale_info(instance):
+        instance.on_sale_now = instance.is_on_sale()
+        instance.price_now = instance.current_price()
+
+    # The warranty file is stored as an attachment shared by all the
+    # products with the same file, which the product then references.
+    def save_attachments(self, validated_data):
+        warranty = validated_data.get('warranty')
+        if warranty is not None:
+            validated_data['warranty'] = store_attachment(warranty)
+        return validated_data
+
     # Validated data in the update method is the data that will be used to
     # update the model. It is safe to access because it is already passed
     # through the validation process.
     def update(self, instance, validated_data):
-        if validated_data.get('warranty', None):
-            instance.description += '\n\nWarranty Information:\n'
-            instance.description += b'; '.join(
-                validated_data['warranty'].readlines()
-            ).decode()
-        return super().update(instance, validated_data)
-
-    # implement this method so we don't get the following error when testing
-    # the creation of a product:
-    # TypeError: Product() got an unexpected keyword argument 'warranty'
-    def create(self, validated_data):
-        validated_data.pop('warranty')
-        return super().create(validated_data)
+        instance = super().update(instance, self.save_attachments(
+            validated_data))
+        self.set_sale_info(instance)
+        return instance
+
+
+# Serializes the rows of the product read model like ProductSerializer does
+# the products, for ProductList. The rows have their cart items.
+class ProductListingSerializer(ProductSerializer):
+    class Meta(ProductSerializer.Meta):
+        model = ProductListing
+
+    def get_cart_items(self, instance):
+        return instance.cart_items
+
+
+# A read-only ProductSerializer(many=True) for the product list and export,
+# built from a ProductSerializer (or ProductListingSerializer) instance with
+# the fields to output and the context of the request. The products are
+# read as rows with values_list() instead of model instances, and every
+# field gets an accessor compiled once from its serializer field, so a row
+# is serialized with a few function calls instead of going through DRF's
+# get_attribute() and to_representation() for every field. The values are
+# the same as ProductSerializer's, so the rendered JSON is too.
+class ProductRowSerializer:
+    # the fields whose representation is the value of the column
+    plain_fields = (serializers.CharField, serializers.IntegerField)
+
+    def __init__(self, serializer, required_columns=('id',)):
+        self.model = serializer.Meta.model
+        self.model_fields = {field.name
+                             for field in self.model._meta.concrete_fields}
+        request = serializer.context.get('request')
+        self.build_url = request.build_absolute_uri \
+            if request is not None else None
+        self.columns = set(required_columns)
+        self.loads_cart_items = False
+        # the items of the products being serialized, see serialize()
+        self.cart_items = {}
+        self.accessors = [(name, self.compile(name, field))
+                          for name, field in serializer.fields.items()
+                          if not field.write_only]
+
+    # the rows of the products of the queryset, which have the columns as
+    # attributes like the products
+    def rows(self, queryset):
+        return queryset.values_list(*self.columns, named=True)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        if self.loads_cart_items:
+            self.cart_items = self.get_cart_items(rows)
+        with instrumentation.timed('serializer'):
+            return [{name: get(row) for name, get in self.accessors}
+                    for row in rows]
+
+    # in a single query, like CartItemsMixin
+    def get_cart_items(self, rows):
+        cart_items = {row.id: [] for row in rows}
+        items = ShoppingCartItem.objects.filter(
+            product_id__in=cart_items).values_list('product_id', 'quantity')
+        for product_id, quantity in items:
+            cart_items[product_id].append({'product': product_id,
+                                           'quantity': quantity})
+        return cart_items
+
+    def compile(self, name, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            return getattr(self, 'compile_' + name)()
+
+        self.columns.add(field.source)
+        get = attrgetter(field.source)
+        if isinstance(field, serializers.FileField):
+            return self.compile_file(field, get)
+        if type(field) in self.plain_fields or (
+                isinstance(field, serializers.DateTimeField) and
+                field.format is None):
+            return get
+        if isinstance(field, serializers.BooleanField):
+            convert = bool
+        elif isinstance(field, serializers.FloatField):
+            convert = float
+        else:
+            convert = field.to_representation
+
+        def accessor(row):
+            value = get(row)
+            return None if value is None else convert(value)
+        return accessor
+
+    # the column has the name of the file in the storage
+    def compile_file(self, field, get):
+        storage = self.model._meta.get_field(field.source).storage
+        build_url = self.build_url
+        use_url = getattr(field, 'use_url',
+                          api_settings.UPLOADED_FILES_USE_URL)
+
+        def accessor(row):
+            name = get(row)
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return build_url(url) if build_url is not None else url
+        return accessor
+
+    # the read model has a cart_items column
+    def compile_cart_items(self):
+        if 'cart_items' in self.model_fields:
+            self.columns.add('cart_items')
+            return attrgetter('cart_items')
+        self.loads_cart_items = True
+        return lambda row: self.cart_items[row.id]
+
+    def compile_photo_srcset(self):
+        self.columns.update(('photo', 'photo_variants'))
+        build_url = self.build_url
+        return lambda row: Product.srcset(row.photo_variants, build_url)
+
+    def compile_warranty_url(self):
+        self.columns.add('warranty')
+        build_url = self.build_url
+
+        def accessor(row):
+            if row.warranty is None:
+                return None
+            url = reverse('product-warranty', args=[row.id])
+            return build_url(url) if build_url is not None else url
+        return accessor
+
+
+# Validates the rows of the import_products command with the rules of
+# ProductSerializer. The sku is required since the rows are matched with
+# the products by sku, and its unique validator is left out: it would run a
+# query per row, and existing skus are updated rather than rejected. Dates
+# can also be given in ISO 8601, like the export endpoint writes them.
+class ProductImportSerializer(ProductSerializer):
+    sku = serializers.CharField(max_length=64)
+    sale_start = serializers.DateTimeField(
+        required=False, allow_null=True,
+        input_formats=[ISO_8601, '%I:%M %p %d %B %Y'])
+    sale_end = serializers.DateTimeField(
+        required=False, allow_null=True,
+        input_formats=[ISO_8601, '%I:%M %p %d %B %Y'])
+
+    class Meta(ProductSerializer.Meta):
+        fields = ('sku', 'name', 'description', 'price', 'sale_start',
+                  'sale_end')
 
 
 # In order to gather daily, weekly, or monthly product and shopping cart data
 # for our sales report, we need to create a new serializer that uses composite
 # fields. This won't be a model serializer but just a plain serializer.
-class ProductStatsSerializer(serializers.Serializer):
+class ProductStatsSerializer(TimedSerializerMixin, serializers.Serializer):
     # this is a composite of a composite field
     stats = serializers.DictField(
         child=serializers.ListField(
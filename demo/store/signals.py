@@ -0,0 +1,97 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from store import cache as product_cache
+from store import images, listings, prices, stats
+from store.models import Product, ShoppingCartItem
+from store.search import get_search_backend
+
+
+# Keeps the full-text search document of a product in sync.
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    get_search_backend(using).index_products([instance.id], using=using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, using, **kwargs):
+    get_search_backend(using).remove_products([instance.id], using=using)
+
+
+# The resized variants of a new photo, from the API or the admin, are
+# generated in the background, see store/images.py. Products loaded from
+# fixtures (raw saves) come with their variants.
+@receiver(post_save, sender=Product)
+def generate_photo_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    photo_name = instance.photo.name if instance.photo else None
+    if photo_name and photo_name != getattr(instance, 'saved_photo', None):
+        images.schedule_variants(instance)
+    instance.saved_photo = photo_name
+
+
+# Appends the new price or sale window of a product to its history, from
+# the time of the write. Products loaded from fixtures (raw saves) come with
+# their history.
+@receiver(post_save, sender=Product)
+def record_price_history(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    prices.record([instance], instance.updated_at)
+
+
+# The product responses include their cart items, so a change to either of
+# them invalidates the cached responses of the product.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    product_cache.invalidate_products([instance.id])
+
+
+@receiver(post_save, sender=ShoppingCartItem)
+@receiver(post_delete, sender=ShoppingCartItem)
+def invalidate_cart_item_product_cache(sender, instance, **kwargs):
+    # the new cache version changes the ETag of the product
+    product_cache.invalidate_products([instance.product_id])
+
+
+# data migrations save products through historical models, which don't send
+# the signals above
+@receiver(post_migrate)
+def invalidate_cache_after_migrations(sender, **kwargs):
+    product_cache.invalidate_all()
+
+
+# Keeps the daily product stats up to date with the cart items.
+@receiver(post_save, sender=ShoppingCartItem)
+def record_cart_item_stats(sender, instance, created, **kwargs):
+    saved_quantity = getattr(instance, 'saved_quantity', None)
+    if created:
+        stats.record_cart_item(instance, 1, instance.quantity)
+    elif saved_quantity is not None and saved_quantity != instance.quantity:
+        stats.record_cart_item(instance, 0,
+                               instance.quantity - saved_quantity)
+    instance.saved_quantity = instance.quantity
+
+
+# The stats row already exists for an item being removed. Not creating it
+# matters when the item is removed because its product is being deleted.
+@receiver(post_delete, sender=ShoppingCartItem)
+def remove_cart_item_stats(sender, instance, **kwargs):
+    quantity = getattr(instance, 'saved_quantity', instance.quantity)
+    stats.record_cart_item(instance, -1, -quantity, create=False)
+
+
+# Keeps the product read model up to date, when it is enabled.
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ShoppingCartItem)
+@receiver(post_delete, sender=ShoppingCartItem)
+def refresh_product_listing(sender, instance, **kwargs):
+    product_id = instance.id if sender is Product else instance.product_id
+    listings.refresh([product_id])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_listing(sender, instance, **kwargs):
+    listings.remove([instance.id])
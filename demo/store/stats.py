@@ -0,0 +1,138 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, \
+    Subquery, Sum, When
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from store import prices
+from store.models import Product, ProductDailyStats, ProductPriceHistory, \
+    ShoppingCartItem
+
+# the order of the values of each period in the stats series
+STATS_FIELDS = ('cart_items', 'quantity', 'sale_quantity')
+
+GRANULARITIES = ('day', 'week', 'month')
+
+
+# Adds the given differences of the STATS_FIELDS (0 for the others) to the
+# stats of a product for a day. The row is updated in place with F()
+# expressions, so concurrent cart item writes don't lose each other's
+# changes. When the row doesn't exist it is created, unless create is False
+# (e.g. when removing an item whose product is being deleted).
+def record(product_id, date, create=True, **differences):
+    differences = {field: differences.get(field, 0) for field in STATS_FIELDS}
+    rows = ProductDailyStats.objects.filter(product_id=product_id, date=date)
+    changes = {field: F(field) + difference
+               for field, difference in differences.items()}
+    if rows.update(**changes) or not create:
+        return
+
+    try:
+        with transaction.atomic():
+            ProductDailyStats.objects.create(
+                product_id=product_id, date=date, **differences)
+    except IntegrityError:
+        # another request created the row in the meantime
+        rows.update(**changes)
+
+
+# Records the change of a cart item: added (cart_items=1), removed
+# (cart_items=-1) or with a different quantity (cart_items=0).
+def record_cart_item(item, cart_items, quantity, create=True):
+    on_sale = was_on_sale(item)
+    record(item.product_id, timezone.localdate(item.created_at),
+           cart_items=cart_items, quantity=quantity,
+           sale_quantity=quantity if on_sale else 0, create=create)
+
+
+# Whether the product of a cart item was on sale when the item was added,
+# with the sale window of its price history then (see store/prices.py):
+# the quantity of an item stays in the sale or the regular quantity when the
+# window changes later, and rebuild() decides it the same way.
+def was_on_sale(item):
+    window = ProductPriceHistory.objects.filter(
+        id=prices.history_id_at(item.product_id, item.created_at),
+    ).values_list('sale_start', 'sale_end').first()
+    return window is not None and \
+        Product.in_sale_window(*window, item.created_at)
+
+
+# Recomputes the stats from the cart items, for all the days or only for the
+# ones between start and end (both included). Whether the product was on sale
+# is decided like was_on_sale() does, in the query.
+def rebuild(start=None, end=None, batch_size=1000):
+    stats = ProductDailyStats.objects.all()
+    items = ShoppingCartItem.objects.annotate(date=TruncDate('created_at'))
+    if start is not None:
+        stats = stats.filter(date__gte=start)
+        items = items.filter(date__gte=start)
+    if end is not None:
+        stats = stats.filter(date__lte=end)
+        items = items.filter(date__lte=end)
+
+    history = ProductPriceHistory.objects.filter(id=OuterRef('history_id'))
+    items = items.annotate(
+        history_id=prices.history_id_at(OuterRef('product_id'),
+                                        OuterRef('created_at')),
+    ).annotate(
+        window_start=Subquery(history.values('sale_start')[:1]),
+        window_end=Subquery(history.values('sale_end')[:1]),
+    )
+    on_sale = Q(window_start__lte=F('created_at')) & (
+        Q(window_end__isnull=True) | Q(window_end__gte=F('created_at'))
+    )
+    rows = items.values('product_id', 'date').annotate(
+        total_cart_items=Count('id'),
+        total_quantity=Sum('quantity'),
+        total_sale_quantity=Sum(Case(When(on_sale, then='quantity'),
+                                     default=0, output_field=IntegerField())),
+    ).order_by()
+
+    with transaction.atomic():
+        stats.delete()
+        created = ProductDailyStats.objects.bulk_create(
+            (ProductDailyStats(product_id=row['product_id'], date=row['date'],
+                               cart_items=row['total_cart_items'],
+                               quantity=row['total_quantity'],
+                               sale_quantity=row['total_sale_quantity'])
+             for row in rows.iterator()),
+            batch_size=batch_size)
+    return len(created)
+
+
+def series_rows(product_id, start, end, granularity):
+    rows = ProductDailyStats.objects.filter(product_id=product_id,
+                                            date__range=(start, end))
+    if granularity == 'day':
+        rows = rows.values(period=F('date'))
+    else:
+        rows = rows.values(period=Trunc('date', granularity))
+    rows = rows.annotate(**{field: Sum(field) for field in STATS_FIELDS})
+    return rows.order_by('period')
+
+
+# The stats of a product between two dates (both included), summed per day,
+# week or month:
+#   {'2019-01-01': [cart_items, quantity, sale_quantity], ...}
+# Periods without cart items are left out. Weeks start on Monday, and a
+# period is labelled with its first day even when it begins before start.
+def series(product_id, start, end, granularity='day'):
+    return {
+        row['period'].isoformat(): [row[field] for field in STATS_FIELDS]
+        for row in series_rows(product_id, start, end, granularity)
+    }
+
+
+# the same, for the async views
+async def aseries(product_id, start, end, granularity='day'):
+    return {
+        row['period'].isoformat(): [row[field] for field in STATS_FIELDS]
+        async for row in series_rows(product_id, start, end, granularity)
+    }
+
+
+def default_range(days=30):
+    end = timezone.localdate()
+    return end - timedelta(days=days - 1), end
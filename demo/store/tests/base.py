@@ -0,0 +1,35 @@
+import os
+import unittest
+from unittest import mock
+
+from django.core.cache import cache
+from rest_framework.test import APIClient, APITestCase
+
+# The tests that report how fast something runs print the rates and compare
+# timings, which depend on the machine and its load, so they only run when
+# asked for, e.g. STORE_TIMING_TESTS=1 python3 manage.py test store
+timing_test = unittest.skipUnless(os.environ.get('STORE_TIMING_TESTS'),
+                                  'set STORE_TIMING_TESTS=1 to run it')
+
+
+# The cached responses are missed, while the versions that the ETags
+# include are kept, unlike with cache.clear() or a new generation.
+def cache_misses():
+    return mock.patch('store.cache.get_entry', return_value=None)
+
+
+# The tests run in a transaction that is never committed, so the on_commit
+# callbacks of the writes made by a request (e.g. the cache invalidations)
+# run when it returns, as if it had committed.
+class CommittingAPIClient(APIClient):
+    def request(self, *args, **kwargs):
+        with APITestCase.captureOnCommitCallbacks(execute=True):
+            return super().request(*args, **kwargs)
+
+
+class StoreTestCase(APITestCase):
+    client_class = CommittingAPIClient
+
+    # the cache isn't rolled back with the database at the end of each test
+    def setUp(self):
+        cache.clear()
@@ -0,0 +1,103 @@
+import json
+from unittest import mock
+from urllib.parse import urlparse
+
+from django.contrib.auth.models import User
+from rest_framework.permissions import IsAdminUser
+
+from store.api_views import ProductRetrieveUpdateDestroy
+from store.models import Product, ShoppingCart, ShoppingCartItem
+from store.tests.base import StoreTestCase
+
+
+class AsyncProductViewsTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.first()
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        ShoppingCartItem.objects.create(shopping_cart=cart,
+                                        product=self.product, quantity=2)
+
+    async def test_list_matches_sync_api(self):
+        url = '?limit=2&ordering=-price'
+        expected = json.loads((await self.async_client.get(
+            '/api/v1/products/' + url)).content)
+        response = await self.async_client.get(
+            '/api/v1/async/products/' + url)
+        self.assertEqual(response.status_code, 200)
+        # cached apart from the sync list, whose links have another path
+        self.assertEqual(response['X-Cache'], 'MISS')
+        data = json.loads(response.content)
+        self.assertEqual(data['results'], expected['results'])
+        self.assertEqual(data['count'], expected['count'])
+        self.assertEqual(urlparse(data['next']).path,
+                         '/api/v1/async/products/')
+
+    async def test_keyset_pagination(self):
+        response = await self.async_client.get(
+            '/api/v1/async/products/', {'pagination': 'cursor', 'limit': 1})
+        data = json.loads(response.content)
+        self.assertEqual(len(data['results']), 1)
+        response = await self.async_client.get(data['next'])
+        self.assertNotEqual(json.loads(response.content)['results'][0]['id'],
+                            data['results'][0]['id'])
+
+    # the detail responses don't depend on the path, so they share the
+    # cache entries of the sync API
+    async def test_detail_shares_the_cache(self):
+        url = '{}/'.format(self.product.id)
+        expected = await self.async_client.get('/api/v1/products/' + url)
+        response = await self.async_client.get(
+            '/api/v1/async/products/' + url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(json.loads(response.content)['cart_items'],
+                         [{'product': self.product.id, 'quantity': 2}])
+
+    async def test_conditional_detail(self):
+        url = '/api/v1/async/products/{}/'.format(self.product.id)
+        response = await self.async_client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response = await self.async_client.get(
+            url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_missing_product(self):
+        response = await self.async_client.get('/api/v1/async/products/0/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content),
+                         {'detail': 'Not found.'})
+
+    # the checks of the API view run before the handler
+    @mock.patch.object(ProductRetrieveUpdateDestroy, 'permission_classes',
+                       [IsAdminUser])
+    async def test_permissions_of_the_api_view(self):
+        url = '/api/v1/async/products/{}/'.format(self.product.id)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('detail', json.loads(response.content))
+
+        staff = await User.objects.acreate(username='staff', is_staff=True)
+        await self.async_client.aforce_login(staff)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_content_negotiation(self):
+        response = await self.async_client.get(
+            '/api/v1/async/products/', headers={'Accept': 'application/xml'})
+        self.assertEqual(response.status_code, 406)
+
+    async def test_stats_match_sync_api(self):
+        url = '{}/stats?granularity=week'.format(self.product.id)
+        expected = await self.async_client.get('/api/v1/products/' + url)
+        response = await self.async_client.get(
+            '/api/v1/async/products/' + url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+        response = await self.async_client.get(
+            '/api/v1/async/products/{}/stats?granularity=year'.format(
+                self.product.id))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('granularity', json.loads(response.content))
@@ -0,0 +1,214 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from store.models import Product, ShoppingCart, ShoppingCartItem
+from store.tests.base import StoreTestCase
+
+
+class ProductBulkTestCase(StoreTestCase):
+    url = '/api/v1/products/bulk'
+
+    def test_bulk_create_products(self):
+        data = [{'name': 'Bulk {}'.format(i), 'description': 'Bulk product',
+                 'price': '{}.50'.format(i + 1)} for i in range(3)]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 201)
+        products = Product.objects.filter(id__in=response.data['created'])
+        self.assertEqual(sorted(product.price for product in products),
+                         [1.5, 2.5, 3.5])
+        self.assertTrue(all(product.updated_at for product in products))
+        search = self.client.get('/api/v1/products/?search=bulk')
+        self.assertEqual(search.data['count'], 3)
+
+    def test_bulk_create_returns_errors_per_item(self):
+        initial_product_count = Product.objects.count()
+        data = [{'name': 'Valid', 'description': 'Bulk product',
+                 'price': '1.00'},
+                {'name': 'Free', 'description': 'Bulk product',
+                 'price': '0.00'}]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), [1])
+        self.assertIn('price', response.data[1])
+        self.assertEqual(Product.objects.count(), initial_product_count)
+
+    def test_bulk_update_products(self):
+        products = list(Product.objects.all()[:2])
+        url = '/api/v1/products/{}/'.format(products[0].id)
+        self.client.get(url)
+        data = [{'id': product.id, 'name': 'Renamed {}'.format(product.id)}
+                for product in products]
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        for product in products:
+            updated = Product.objects.get(id=product.id)
+            self.assertEqual(updated.name, 'Renamed {}'.format(product.id))
+            self.assertEqual(updated.version, product.version + 1)
+            self.assertEqual(updated.description, product.description)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'],
+                         'Renamed {}'.format(products[0].id))
+
+    def test_bulk_update_unknown_product(self):
+        product = Product.objects.first()
+        data = [{'id': product.id, 'name': 'Renamed'},
+                {'id': 0, 'name': 'Unknown'}]
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {1: {'id': ['Not found.']}})
+        self.assertNotEqual(Product.objects.get(id=product.id).name,
+                            'Renamed')
+
+    def test_bulk_warranty_rejected(self):
+        product = Product.objects.first()
+        data = [{'id': product.id, 'name': 'Renamed'},
+                {'id': product.id, 'warranty': None}]
+        response = self.client.patch(self.url, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), [1])
+        self.assertIn('warranty', response.data[1])
+
+    def test_bulk_delete_products(self):
+        initial_product_count = Product.objects.count()
+        product_ids = list(Product.objects.values_list('id', flat=True)[:2])
+        response = self.client.delete(self.url, product_ids, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Product.objects.count(), initial_product_count - 2)
+
+    def test_bulk_delete_unknown_product(self):
+        product_id = Product.objects.first().id
+        response = self.client.delete(self.url, [product_id, 0],
+                                      format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {1: {'id': ['Not found.']}})
+        self.assertTrue(Product.objects.filter(id=product_id).exists())
+
+
+class ProductExportTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        for i in range(5):
+            product = Product.objects.create(
+                name='Exported {}'.format(i), description='Product',
+                price=1.0, sale_start=timezone.now() if i % 2 else None,
+            )
+            ShoppingCartItem.objects.create(shopping_cart=cart,
+                                            product=product, quantity=i + 1)
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        lines = self.export('/api/v1/products/export.ndjson').splitlines()
+        self.assertEqual(len(lines), Product.objects.count())
+        products = [json.loads(line) for line in lines]
+        self.assertEqual([product['id'] for product in products],
+                         sorted(product['id'] for product in products))
+        listed = self.client.get('/api/v1/products/?limit=100&ordering=id')
+        self.assertEqual(products,
+                         json.loads(json.dumps(listed.data['results'],
+                                               cls=JSONEncoder)))
+
+    def test_export_csv(self):
+        rows = list(csv.DictReader(
+            StringIO(self.export('/api/v1/products/export.csv'))))
+        self.assertEqual(len(rows), Product.objects.count())
+        self.assertNotIn('warranty', rows[0])
+        row = rows[-1]
+        self.assertEqual(row['name'], 'Exported 4')
+        self.assertEqual(json.loads(row['cart_items']),
+                         [{'product': int(row['id']), 'quantity': 5}])
+
+    def test_export_uses_list_filters(self):
+        lines = self.export(
+            '/api/v1/products/export.ndjson?on_sale=true&search=exported')
+        self.assertEqual(
+            sorted(json.loads(line)['name'] for line in lines.splitlines()),
+            ['Exported 1', 'Exported 3'])
+
+    # the products and their cart items are read one chunk at a time
+    @override_settings(PRODUCTS_EXPORT_CHUNK_SIZE=2)
+    def test_export_query_count_grows_with_chunks(self):
+        count = Product.objects.count()
+        chunks = -(-count // 2)
+        with self.assertNumQueries(chunks + 1):
+            self.export('/api/v1/products/export.ndjson')
+
+    def test_unknown_export_format(self):
+        response = self.client.get('/api/v1/products/export.xml')
+        self.assertEqual(response.status_code, 404)
+
+
+class ImportProductsTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        Product.objects.create(sku='SKU-1', name='Old name',
+                               description='Old description', price=1.0)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def import_products(self, path, *args):
+        out = StringIO()
+        call_command('import_products', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_csv(self):
+        path = self.write('products.csv', (
+            'sku,name,description,price,sale_start\n'
+            'SKU-1,New name,New description,2.50,\n'
+            'SKU-2,Second,Second product,3.00,2019-04-16T12:01:00Z\n'
+        ))
+        output = self.import_products(path)
+        self.assertIn('Imported 2 products from 2 rows (0 rejected)', output)
+        updated = Product.objects.get(sku='SKU-1')
+        self.assertEqual((updated.name, updated.price), ('New name', 2.5))
+        self.assertEqual(updated.version, 2)
+        self.assertIsNotNone(Product.objects.get(sku='SKU-2').sale_start)
+        search = self.client.get('/api/v1/products/?search=second')
+        self.assertEqual(search.data['count'], 1)
+
+    def test_import_ndjson_writes_rejects(self):
+        path = self.write('products.ndjson', '\n'.join([
+            json.dumps({'sku': 'SKU-3', 'name': 'Valid',
+                        'description': 'Valid product', 'price': '4.00'}),
+            json.dumps({'sku': 'SKU-4', 'name': 'Free',
+                        'description': 'Free product', 'price': '0.00'}),
+            '{not json',
+        ]))
+        rejects = os.path.join(self.directory.name, 'rejects.ndjson')
+        output = self.import_products(path, '--rejects', rejects)
+        self.assertIn('Imported 1 products from 3 rows (2 rejected)', output)
+        self.assertTrue(Product.objects.filter(sku='SKU-3').exists())
+        with open(rejects) as file:
+            rejected = [json.loads(line) for line in file]
+        self.assertEqual([row['row'] for row in rejected], [2, 3])
+        self.assertIn('price', rejected[0]['errors'])
+
+    def test_import_with_workers(self):
+        rows = ''.join('SKU-W{0},Product {0},Imported product,1.00\n'.format(i)
+                       for i in range(10))
+        path = self.write('products.csv',
+                          'sku,name,description,price\n' + rows)
+        output = self.import_products(path, '--workers', '2',
+                                      '--chunk-size', '3')
+        self.assertIn('Imported 10 products from 10 rows', output)
+        self.assertEqual(Product.objects.filter(sku__startswith='SKU-W')
+                         .count(), 10)
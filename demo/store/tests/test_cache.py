@@ -0,0 +1,228 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.http import parse_http_date
+
+from store import cache as product_cache
+from store.models import Product, ShoppingCart, ShoppingCartItem
+from store.tests.base import StoreTestCase, cache_misses
+
+
+class ProductCacheTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.first()
+        self.url = '/api/v1/products/{}/'.format(self.product.id)
+
+    def test_detail_is_served_from_cache(self):
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['id'], self.product.id)
+        self.assertEqual(product_cache.cache_stats(),
+                         {'hits': 1, 'misses': 1, 'rebuilds': 1})
+
+    def test_writes_invalidate_detail_and_list(self):
+        self.client.get(self.url)
+        self.client.get('/api/v1/products/')
+        # saving through the model, like the admin site does
+        self.product.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(self.url).data['name'], 'Renamed')
+        response = self.client.get('/api/v1/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Renamed', [p['name'] for p in response.data['results']])
+
+    # a miss before the commit would cache the old row under the new version
+    def test_invalidated_once_committed(self):
+        version_key = product_cache.PRODUCT_VERSION_KEY.format(
+            self.product.id)
+        self.client.get(self.url)
+        version = product_cache.get_version(version_key)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.save()
+            self.assertEqual(product_cache.get_version(version_key), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(product_cache.get_version(version_key), version)
+
+    # the request building the entry failed, e.g. with a 404, and released
+    # the lock without caching anything
+    def test_waiters_stop_once_the_lock_is_released(self):
+        key = 'store:test'
+        cache.add('{}:lock'.format(key), 1)
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            cache.delete('{}:lock'.format(key))
+
+        with mock.patch('store.cache.time.sleep', sleep):
+            entry, hit = product_cache.build_entry(
+                key, lambda: product_cache.make_entry(
+                    'data', product_cache.make_validators('"etag"', 0)))
+        self.assertEqual(len(sleeps), 1)
+        self.assertEqual((entry['data'], hit), ('data', False))
+
+    def test_cart_items_invalidate_detail(self):
+        self.client.get(self.url)
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCartItem.objects.create(shopping_cart=cart,
+                                            product=self.product, quantity=3)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['cart_items'],
+                         [{'product': self.product.id, 'quantity': 3}])
+
+    def test_other_products_stay_cached(self):
+        self.client.get(self.url)
+        Product.objects.exclude(id=self.product.id).first().save()
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+
+class ProductHttpCacheTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            name='Product', description='Product', price=10.0,
+            sale_start=timezone.now() + timedelta(seconds=90))
+        self.url = '/api/v1/products/{}/'.format(self.product.id)
+
+    def test_max_age_stops_at_next_sale_boundary(self):
+        response = self.client.get(self.url)
+        max_age = int(response['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(0 < max_age <= 90)
+        response = self.client.get('/api/v1/products/')
+        max_age = int(response['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(0 < max_age <= 90)
+
+    def test_max_age_without_sale_boundaries(self):
+        self.product.sale_start = None
+        self.product.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'max-age={}'.format(
+            settings.PRODUCTS_CACHE_TIMEOUT))
+
+    def test_last_modified_includes_crossed_sale_boundaries(self):
+        sale_start = timezone.now() - timedelta(minutes=5)
+        Product.objects.filter(id=self.product.id).update(
+            sale_start=sale_start)
+        self.product.refresh_from_db()
+        self.product.save()
+        response = self.client.get(self.url)
+        self.assertGreaterEqual(
+            parse_http_date(response['Last-Modified']),
+            int(sale_start.timestamp()))
+
+    def test_conditional_get_with_etag(self):
+        response = self.client.get(self.url)
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.product.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_with_last_modified(self):
+        response = self.client.get('/api/v1/products/')
+        response = self.client.get(
+            '/api/v1/products/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ProductConditionalRequestTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.first()
+        self.url = '/api/v1/products/{}/'.format(self.product.id)
+
+    # both read the same version before saving
+    def test_concurrent_saves_get_their_own_version(self):
+        first = Product.objects.get(id=self.product.id)
+        second = Product.objects.get(id=self.product.id)
+        first.name = 'First'
+        first.save()
+        second.name = 'Second'
+        second.save()
+        self.assertEqual(first.version, self.product.version + 1)
+        self.assertEqual(second.version, self.product.version + 2)
+        self.assertEqual(Product.objects.get(id=self.product.id).version,
+                         second.version)
+
+    # a new generation drops the cached responses, not the versions of the
+    # products that the ETags include. The lists include it, so they miss
+    # the cache instead.
+    def test_not_modified_without_serializing(self):
+        etag = self.client.get(self.url)['ETag']
+        product_cache.bump_generation()
+        # only the query for the version of the product
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        etag = self.client.get('/api/v1/products/')['ETag']
+        # the sale boundaries of the catalog are cached with its version
+        with cache_misses(), self.assertNumQueries(0):
+            response = self.client.get('/api/v1/products/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cart_items_change_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        list_etag = self.client.get('/api/v1/products/')['ETag']
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCartItem.objects.create(shopping_cart=cart,
+                                            product=self.product, quantity=1)
+        self.assertNotEqual(self.client.get(self.url)['ETag'], etag)
+        self.assertNotEqual(self.client.get('/api/v1/products/')['ETag'],
+                            list_etag)
+
+    # one product starts its sale as another one ends it, without any write
+    def test_list_etag_follows_sale_boundaries(self):
+        later = timezone.now() + timedelta(minutes=1)
+        Product.objects.create(name='Starting', description='Product',
+                               price=10.0, sale_start=later)
+        Product.objects.create(
+            name='Ending', description='Product', price=10.0,
+            sale_start=timezone.now() - timedelta(minutes=1), sale_end=later)
+        etag = self.client.get('/api/v1/products/')['ETag']
+        with cache_misses():
+            self.assertEqual(self.client.get('/api/v1/products/')['ETag'],
+                             etag)
+            with mock.patch('django.utils.timezone.now',
+                            return_value=later + timedelta(seconds=1)):
+                self.assertNotEqual(
+                    self.client.get('/api/v1/products/')['ETag'], etag)
+
+    def test_update_with_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'name': 'First'},
+                                     format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['ETag'], self.client.get(self.url)['ETag'])
+
+        # a second client still holding the old ETag
+        response = self.client.patch(self.url, {'name': 'Second'},
+                                     format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Product.objects.get(id=self.product.id).name,
+                         'First')
+
+    def test_stats_not_modified(self):
+        url = '/api/v1/products/{}/stats'.format(self.product.id)
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
@@ -0,0 +1,233 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.test import APIClient, APITransactionTestCase
+
+from store import carts
+from store.models import Product, ProductDailyStats, ShoppingCart, \
+    ShoppingCartItem
+from store.tests.base import StoreTestCase
+
+
+class ShoppingCartTotalsTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        self.empty_cart = ShoppingCart.objects.create(name='Empty',
+                                                      address='Address')
+        for price, quantity, sale_start in ((10.0, 3, None),
+                                            (2.5, 2, now - timedelta(days=1)),
+                                            (0.1, 3, None)):
+            product = Product.objects.create(
+                name='Product', description='Product', price=price,
+                sale_start=sale_start,
+            )
+            ShoppingCartItem.objects.create(shopping_cart=self.cart,
+                                            product=product,
+                                            quantity=quantity)
+
+    # 3 x 10.00 + 2 x 2.25 (on sale) + 3 x 0.10, taxes rounded half up
+    def test_cart_totals(self):
+        with self.assertNumQueries(1):
+            totals = self.cart.totals()
+        self.assertEqual(totals, {
+            'subtotal': Decimal('34.80'),
+            'taxes': Decimal('4.52'),
+            'total': Decimal('39.32'),
+        })
+        self.assertEqual(self.cart.total(), Decimal('39.32'))
+
+    def test_bulk_cart_totals(self):
+        with self.assertNumQueries(1):
+            totals = ShoppingCart.objects.filter(
+                id__in=[self.cart.id, self.empty_cart.id]).totals()
+        self.assertEqual(totals[self.cart.id]['total'], Decimal('39.32'))
+        self.assertEqual(totals[self.empty_cart.id], {
+            'subtotal': Decimal('0.00'),
+            'taxes': Decimal('0.00'),
+            'total': Decimal('0.00'),
+        })
+
+    def test_cart_page(self):
+        session = self.client.session
+        session['shopping_cart_id'] = self.cart.id
+        session.save()
+        response = self.client.get('/cart/')
+        self.assertEqual(len(response.context['items']), 3)
+        self.assertEqual(response.context['subtotal'], Decimal('34.80'))
+        self.assertEqual(response.context['tax_total'], Decimal('4.52'))
+        self.assertContains(response, '$39.32')
+
+
+class CartItemApiTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        self.product = Product.objects.create(
+            name='Product', description='Product', price=10.0)
+        self.url = '/api/v1/carts/{}/items/'.format(self.cart.id)
+        self.item_url = '{}{}'.format(self.url, self.product.id)
+        session = self.client.session
+        session['shopping_cart_id'] = self.cart.id
+        session.save()
+
+    def test_add_list_and_remove_items(self):
+        response = self.client.post(self.url, {'product': self.product.id,
+                                               'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        # adding the product again increments its item
+        response = self.client.post(self.url, {'product': self.product.id,
+                                               'quantity': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'product': self.product.id,
+                                         'quantity': 5})
+        response = self.client.post(self.item_url + '/increment',
+                                    {'quantity': -1})
+        self.assertEqual(response.data['quantity'], 4)
+        self.assertEqual(self.client.get(self.url).data,
+                         [{'product': self.product.id, 'quantity': 4}])
+
+        self.assertEqual(self.client.delete(self.item_url).status_code, 204)
+        self.assertEqual(self.client.get(self.url).data, [])
+        self.assertEqual(self.client.delete(self.item_url).status_code, 404)
+        response = self.client.post(self.item_url + '/increment',
+                                    {'quantity': 1})
+        self.assertEqual(response.status_code, 404)
+
+    def test_quantity_stays_in_range(self):
+        self.client.post(self.url, {'product': self.product.id,
+                                    'quantity': 99})
+        for quantity in (2, -99):
+            response = self.client.post(self.item_url + '/increment',
+                                        {'quantity': quantity})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post(self.url, {
+            'product': self.product.id, 'quantity': 0}).status_code, 400)
+        self.assertEqual(ShoppingCartItem.objects.get().quantity, 99)
+
+    # the updates don't send the model signals, the product changes anyway,
+    # without its row being written
+    def test_increments_update_stats_and_product(self):
+        self.client.post(self.url, {'product': self.product.id,
+                                    'quantity': 2})
+        etag = self.client.get(
+            '/api/v1/products/{}/'.format(self.product.id))['ETag']
+        stats_etag = self.client.get(
+            '/api/v1/products/{}/stats'.format(self.product.id))['ETag']
+        list_etag = self.client.get('/api/v1/products/')['ETag']
+        self.client.post(self.item_url + '/increment', {'quantity': 3})
+        response = self.client.get(
+            '/api/v1/products/{}/'.format(self.product.id))
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['cart_items'],
+                         [{'product': self.product.id, 'quantity': 5}])
+        response = self.client.get(
+            '/api/v1/products/{}/stats'.format(self.product.id))
+        self.assertNotEqual(response['ETag'], stats_etag)
+        self.assertEqual(list(response.data['stats'].values()), [[1, 5, 0]])
+        self.assertNotEqual(self.client.get('/api/v1/products/')['ETag'],
+                            list_etag)
+        self.assertEqual(Product.objects.get(id=self.product.id).version,
+                         self.product.version)
+
+    # the stats are recorded once the item is committed
+    def test_increment_defers_stats(self):
+        ShoppingCartItem.objects.create(shopping_cart=self.cart,
+                                        product=self.product, quantity=2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            carts.add_item(self.cart.id, self.product.id, 3)
+            self.assertEqual(ProductDailyStats.objects.get().quantity, 2)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ProductDailyStats.objects.get().quantity, 5)
+
+    # the carts of other sessions are like missing ones
+    def test_other_carts_not_found(self):
+        other = ShoppingCart.objects.create(name='Other', address='Address')
+        ShoppingCartItem.objects.create(shopping_cart=other,
+                                        product=self.product, quantity=1)
+        url = '/api/v1/carts/{}/items/'.format(other.id)
+        item_url = '{}{}'.format(url, self.product.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(url, {
+            'product': self.product.id, 'quantity': 1}).status_code, 404)
+        self.assertEqual(self.client.post(item_url + '/increment', {
+            'quantity': 1}).status_code, 404)
+        self.assertEqual(self.client.delete(item_url).status_code, 404)
+        self.assertEqual(other.items.get().quantity, 1)
+
+    # another request creates the item between the update that finds no
+    # item and the insert, which then fails on the unique constraint
+    def test_concurrent_creation_increments_the_item(self):
+        ShoppingCartItem.objects.create(shopping_cart=self.cart,
+                                        product=self.product, quantity=2)
+        calls = []
+
+        def increment(items, quantity):
+            calls.append(quantity)
+            return 0 if len(calls) == 1 else real_increment(items, quantity)
+
+        real_increment = carts.increment
+        with mock.patch('store.carts.increment', increment):
+            response = self.client.post(self.url, {
+                'product': self.product.id, 'quantity': 3})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ShoppingCartItem.objects.get().quantity, 5)
+
+    def test_unknown_cart(self):
+        response = self.client.post('/api/v1/carts/0/items/', {
+            'product': self.product.id, 'quantity': 1})
+        self.assertEqual(response.status_code, 404)
+
+
+# Runs outside of a test transaction, so that the threads see each other's
+# writes. The data of the migrations is restored after it.
+class CartItemConcurrencyTestCase(APITransactionTestCase):
+    serialized_rollback = True
+
+    def test_concurrent_additions_all_count(self):
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        products = list(Product.objects.order_by('id')[:2])
+        url = '/api/v1/carts/{}/items/'.format(cart.id)
+        threads, additions = 8, 10
+        errors = []
+        session = self.client.session
+        session['shopping_cart_id'] = cart.id
+        session.save()
+
+        def add_products():
+            client = APIClient()
+            client.cookies = self.client.cookies
+            try:
+                for addition in range(additions):
+                    for product in products:
+                        response = client.post(url, {'product': product.id,
+                                                     'quantity': 1})
+                        if response.status_code not in (200, 201):
+                            errors.append(response.data)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=add_products)
+                   for thread in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            dict(cart.items.values_list('product_id', 'quantity')),
+            {product.id: threads * additions for product in products})
+        # the stats count the same units
+        self.assertEqual(
+            ProductDailyStats.objects.filter(
+                product__in=products).aggregate(Sum('quantity')),
+            {'quantity__sum': 2 * threads * additions})
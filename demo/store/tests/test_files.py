@@ -0,0 +1,146 @@
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from store.attachments import AttachmentUploadHandler
+from store.models import Attachment, Product
+from store.tests.base import StoreTestCase
+
+
+@override_settings(PRODUCT_PHOTO_INLINE=True, PRODUCT_PHOTO_WIDTHS=(50, 100))
+class ProductPhotoVariantsTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_root = override_settings(MEDIA_ROOT=directory.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.product = Product.objects.first()
+
+    def photo(self, width):
+        content = BytesIO()
+        Image.new('RGB', (width, width // 2), 'red').save(content, 'JPEG')
+        return SimpleUploadedFile('photo.jpg', content.getvalue(),
+                                  content_type='image/jpeg')
+
+    def test_upload_generates_variants(self):
+        response = self.client.patch(
+            '/api/v1/products/{}/'.format(self.product.id),
+            {'photo': self.photo(80)}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+        product = Product.objects.get(id=self.product.id)
+        # the photo is smaller than the second width
+        widths = [width for width, _ in product.photo_variants['webp']]
+        self.assertEqual(widths, [50])
+        for variants in product.photo_variants.values():
+            for width, name in variants:
+                with Image.open(default_storage.path(name)) as image:
+                    self.assertEqual(image.width, width)
+
+        response = self.client.get(
+            '/api/v1/products/{}/'.format(self.product.id))
+        srcset = response.data['photo_srcset']
+        self.assertRegex(srcset['webp'],
+                         r'^http://testserver/uploads/products/variants/'
+                         r'photo\w*\.[0-9a-f]{16}\.50w\.webp 50w$')
+        self.assertTrue(srcset['jpeg'].endswith('.50w.jpg 50w'))
+
+    def test_backfill_command(self):
+        Product.objects.filter(id=self.product.id).update(
+            photo=default_storage.save('products/photo.jpg', self.photo(200)))
+        out = StringIO()
+        call_command('generate_photo_variants', stdout=out, stderr=StringIO())
+        self.assertIn('Generated the variants of 1 photos', out.getvalue())
+        product = Product.objects.get(id=self.product.id)
+        widths = [width for width, _ in product.photo_variants['jpeg']]
+        self.assertEqual(widths, [50, 100])
+        self.assertEqual(product.version, self.product.version + 1)
+
+
+class ProductWarrantyTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_root = override_settings(MEDIA_ROOT=directory.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def upload(self, product, content):
+        return self.client.patch(
+            '/api/v1/products/{}/'.format(product.id),
+            {'warranty': SimpleUploadedFile('warranty.txt', content)},
+            format='multipart')
+
+    def test_upload_warranty(self):
+        first, second = Product.objects.all()[:2]
+        response = self.upload(first, b'Two years, parts and labour.')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['description'], first.description)
+        self.assertEqual(
+            response.data['warranty_url'],
+            'http://testserver/api/v1/products/{}/warranty'.format(first.id))
+        self.assertEqual(self.upload(second, b'Two years, parts and labour.')
+                         .status_code, 200)
+
+        # the same file is stored once
+        self.assertEqual(Attachment.objects.count(), 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.warranty_id, second.warranty_id)
+        self.assertEqual(first.warranty.file.read(),
+                         b'Two years, parts and labour.')
+
+        response = self.client.get(
+            '/api/v1/products/{}/warranty'.format(first.id))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], first.warranty.file.url)
+
+    @override_settings(ATTACHMENT_MAX_SIZE=10)
+    def test_warranty_size_limit(self):
+        product = Product.objects.first()
+        response = self.upload(product, b'Longer than ten bytes')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('warranty', response.data)
+        self.assertFalse(Attachment.objects.exists())
+
+    # the upload is stopped at the first chunk over the limit
+    @override_settings(ATTACHMENT_MAX_SIZE=10)
+    def test_upload_handler_stops_large_files(self):
+        handler = AttachmentUploadHandler()
+        handler.new_file('warranty', 'warranty.txt', 'text/plain', None)
+        self.assertEqual(handler.receive_data_chunk(b'12345678', 0),
+                         b'12345678')
+        with self.assertRaises(ValidationError):
+            handler.receive_data_chunk(b'12345678', 8)
+        # the other files are left to the other handlers
+        handler.new_file('photo', 'photo.jpg', 'image/jpeg', None)
+        self.assertEqual(handler.receive_data_chunk(b'12345678', 8),
+                         b'12345678')
+
+    # the file is only stored with a valid product
+    def test_invalid_product_stores_no_attachment(self):
+        product = Product.objects.first()
+        response = self.client.patch(
+            '/api/v1/products/{}/'.format(product.id),
+            {'warranty': SimpleUploadedFile('warranty.txt', b'Two years.'),
+             'price': '0.00'},
+            format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_product_without_warranty(self):
+        product = Product.objects.first()
+        response = self.client.get('/api/v1/products/{}/'.format(product.id))
+        self.assertIsNone(response.data['warranty_url'])
+        response = self.client.get(
+            '/api/v1/products/{}/warranty'.format(product.id))
+        self.assertEqual(response.status_code, 404)
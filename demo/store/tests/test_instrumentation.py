@@ -0,0 +1,50 @@
+from django.test import override_settings
+
+from store import instrumentation
+from store.models import Product
+from store.tests.base import StoreTestCase
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True,
+                   INSTRUMENTATION_N_PLUS_ONE_THRESHOLD=3)
+class InstrumentationTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.registry.reset()
+
+    def test_server_timing_header(self):
+        self.client.get('/api/v1/products/')
+        response = self.client.get('/api/v1/products/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;'
+                                 r'desc="\d+ queries", serializer;dur=[\d.]+')
+        self.assertIn('cache;desc="1 hits, 0 misses"', timing)
+
+    def test_metrics(self):
+        self.client.get('/api/v1/products/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('store_request_duration_seconds_count'
+                      '{view="store.api_views.ProductList"} 1', metrics)
+        self.assertIn('store_cache_misses_total'
+                      '{view="store.api_views.ProductList"} 1', metrics)
+        self.assertRegex(metrics, r'store_db_queries_sum'
+                                  r'\{view="store.api_views.ProductList"\} '
+                                  r'[1-9]')
+
+    def test_metrics_only_served_locally(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    # deleting products one at a time runs the same queries for each
+    def test_flags_repeated_queries(self):
+        product_ids = list(Product.objects.values_list('id', flat=True)[:4])
+        with self.assertLogs('store.instrumentation', 'WARNING') as logs:
+            self.client.delete('/api/v1/products/bulk', product_ids,
+                               format='json')
+        self.assertIn('Possible N+1 queries in store.api_views.ProductBulk',
+                      logs.output[0])
+        self.assertIn('store_n_plus_one_total'
+                      '{view="store.api_views.ProductBulk"}',
+                      self.client.get('/metrics').content.decode())
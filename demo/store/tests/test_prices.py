@@ -0,0 +1,154 @@
+import sys
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.utils import timezone
+
+from store import imports, prices
+from store.benchmarks import seed_products
+from store.models import Product, ProductPriceHistory, ShoppingCart, \
+    ShoppingCartItem
+from store.tests.base import StoreTestCase, timing_test
+
+
+class ProductPriceHistoryTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            sku='SKU-1', name='Water', description='Sparkling water',
+            price=10.0)
+        self.url = '/api/v1/products/{}/'.format(self.product.id)
+
+    def history(self, product):
+        return list(product.price_history.order_by('valid_from', 'id')
+                    .values_list('price', 'sale_start', 'sale_end'))
+
+    # the products of the data migration have their current price since
+    # before the history
+    def test_existing_products_have_history(self):
+        product = Product.objects.exclude(id=self.product.id).first()
+        start = timezone.now() - timedelta(days=365 * 50)
+        self.assertEqual(prices.prices_at([(product.id, start)]),
+                         [product.current_price()])
+
+    def test_rows_appended_on_changes_only(self):
+        self.client.patch(self.url, {'name': 'Still water'}, format='json')
+        self.assertEqual(self.history(self.product), [(10.0, None, None)])
+
+        self.client.patch(self.url, {'price': '12.10'}, format='json')
+        self.client.patch(self.url, {'price': '12.10'}, format='json')
+        self.assertEqual(self.history(self.product),
+                         [(10.0, None, None), (12.1, None, None)])
+
+    def test_scheduled_sale(self):
+        created = timezone.now()
+        start = created + timedelta(days=2)
+        end = start + timedelta(days=1)
+        response = self.client.patch(self.url, {
+            'sale_start': start.strftime('%I:%M %p %d %B %Y'),
+            'sale_end': end.strftime('%I:%M %p %d %B %Y'),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_on_sale'])
+        self.assertEqual(ProductPriceHistory.objects.filter(
+            product=self.product).count(), 2)
+        # the sale starts and ends without another write
+        self.assertEqual(prices.prices_at([
+            (self.product.id, created + timedelta(days=1)),
+            (self.product.id, start + timedelta(hours=12)),
+            (self.product.id, end + timedelta(hours=1)),
+        ]), [10.0, 9.0, 10.0])
+
+    def test_sale_must_end_after_it_starts(self):
+        response = self.client.patch(self.url, {
+            'sale_start': '12:01 AM 28 July 2019',
+            'sale_end': '12:01 AM 27 July 2019',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sale_end', response.data)
+        self.client.patch(self.url, {'sale_end': '12:01 AM 27 July 2019'},
+                          format='json')
+        response = self.client.patch(
+            self.url, {'sale_start': '12:01 AM 28 July 2019'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # a window saved before the check doesn't block the other fields
+        Product.objects.filter(id=self.product.id).update(
+            sale_start=timezone.now())
+        response = self.client.patch(self.url, {'name': 'Renamed'},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_writes_recorded(self):
+        response = self.client.post('/api/v1/products/bulk', [
+            {'name': 'Bulk', 'description': 'Bulk product', 'price': '1.50'},
+        ], format='json')
+        product = Product.objects.get(id=response.data['created'][0])
+        self.assertEqual(self.history(product), [(1.5, None, None)])
+
+        self.client.patch('/api/v1/products/bulk', [
+            {'id': product.id, 'price': '2.00'},
+            {'id': self.product.id, 'name': 'Renamed'},
+        ], format='json')
+        self.assertEqual(self.history(product),
+                         [(1.5, None, None), (2.0, None, None)])
+        self.assertEqual(len(self.history(self.product)), 1)
+
+    def test_imports_recorded(self):
+        imports.import_products(StringIO(
+            'sku,name,description,price\n'
+            'SKU-1,Water,Sparkling water,10.00\n'
+            'SKU-2,Soda,Orange soda,3.00\n'
+        ), 'csv')
+        self.assertEqual(len(self.history(self.product)), 1)
+        self.assertEqual(self.history(Product.objects.get(sku='SKU-2')),
+                         [(3.0, None, None)])
+        imports.import_products(StringIO(
+            'sku,name,description,price\nSKU-1,Water,Sparkling water,11\n'),
+            'csv')
+        self.assertEqual(self.history(self.product),
+                         [(10.0, None, None), (11.0, None, None)])
+
+    # the prices of cart items added at different times, in one query
+    def test_batched_lookup(self):
+        now = timezone.now()
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        products = [self.product,
+                    Product.objects.create(name='Soda', description='Soda',
+                                           price=3.0)]
+        ProductPriceHistory.objects.all().delete()
+        items = []
+        for day in range(4):
+            for product in products:
+                ProductPriceHistory.objects.create(
+                    product=product, valid_from=now - timedelta(days=4 - day),
+                    price=product.price + day)
+        for product in products:
+            items.append(ShoppingCartItem.objects.create(
+                shopping_cart=cart, product=product, quantity=1,
+                created_at=now - timedelta(days=2, hours=12)))
+        before = (self.product.id, now - timedelta(days=5))
+        on_boundary = (self.product.id, now - timedelta(days=1))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(prices.cart_item_prices(items), [11.0, 4.0])
+        with self.assertNumQueries(1):
+            self.assertEqual(prices.prices_at([before, on_boundary]),
+                             [None, 13.0])
+        with self.assertNumQueries(0):
+            self.assertEqual(prices.prices_at([]), [])
+
+    # reports the lookups per second for many pairs
+    @timing_test
+    def test_lookups_per_second(self):
+        seed_products(200)
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        now = timezone.now()
+        pairs = [(product_ids[i % len(product_ids)],
+                  now - timedelta(minutes=i)) for i in range(5000)]
+        start = time.perf_counter()
+        results = prices.prices_at(pairs)
+        rate = len(pairs) / (time.perf_counter() - start)
+        sys.stderr.write('\nprice lookups per second: {:.0f}\n'.format(rate))
+        self.assertEqual(len(results), len(pairs))
@@ -0,0 +1,351 @@
+import json
+import os
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from store.models import Product, ShoppingCart, ShoppingCartItem
+from store.tests.base import StoreTestCase
+
+
+class ProductDestroyTestCase(StoreTestCase):
+    def test_delete_product(self):
+        initial_product_count = Product.objects.count()
+        product_id = Product.objects.first().id
+        self.client.delete('/api/v1/products/{}/'.format(product_id))
+        self.assertEqual(
+            Product.objects.count(),
+            initial_product_count - 1,
+        )
+        self.assertRaises(
+            Product.DoesNotExist,
+            Product.objects.get, id=product_id,
+        )
+
+    def test_delete_product_drops_cached_response(self):
+        product_id = Product.objects.first().id
+        url = '/api/v1/products/{}/'.format(product_id)
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        self.client.delete(url)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ProductListTestCase(StoreTestCase):
+    def test_list_products(self):
+        products_count = Product.objects.count()
+        response = self.client.get('/api/v1/products/')
+        self.assertIsNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
+        self.assertEqual(response.data['count'], products_count)
+        self.assertEqual(len(response.data['results']), products_count)
+
+
+class ProductListQueryCountTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        for i in range(30):
+            product = Product.objects.create(
+                name='Product {}'.format(i), description='Product', price=1.0,
+            )
+            ShoppingCartItem.objects.create(shopping_cart=cart,
+                                            product=product, quantity=2)
+
+    # the count, the page of products and the cart items of the whole page.
+    # The sale boundaries of the catalog, which decide when the pages expire,
+    # are read by the first one after the catalog changed.
+    def test_list_products_query_count_is_constant(self):
+        with self.assertNumQueries(4):
+            self.client.get('/api/v1/products/?limit=5')
+        for limit in (1, 10, 30):
+            with self.assertNumQueries(3):
+                response = self.client.get(
+                    '/api/v1/products/?limit={}'.format(limit))
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_products_includes_cart_items(self):
+        response = self.client.get('/api/v1/products/?limit=30&offset=4')
+        for product in response.data['results']:
+            self.assertEqual(product['cart_items'],
+                             [{'product': product['id'], 'quantity': 2}])
+
+
+class ProductListKeysetPaginationTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for i in range(12):
+            Product.objects.create(
+                name='Product {}'.format(i), description='Product', price=1.0,
+                sale_start=now - timedelta(days=i % 3) if i % 2 else None,
+            )
+
+    def walk_pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(product['id'] for product in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_list_products_by_id(self):
+        ids = self.walk_pages('/api/v1/products/?pagination=cursor&limit=5')
+        self.assertEqual(
+            ids, list(Product.objects.order_by('id').values_list('id',
+                                                                 flat=True)))
+
+    def test_list_products_by_sale_start(self):
+        ids = self.walk_pages(
+            '/api/v1/products/?pagination=cursor&limit=3&ordering=sale_start')
+        self.assertEqual(len(ids), Product.objects.count())
+        sale_starts = [Product.objects.get(id=i).sale_start for i in ids]
+        nulls = sale_starts.count(None)
+        self.assertEqual(sale_starts[:nulls], [None] * nulls)
+        self.assertEqual(sale_starts[nulls:], sorted(sale_starts[nulls:]))
+
+    def test_unsupported_ordering_is_rejected(self):
+        for ordering in ('-current_price', 'name', ''):
+            response = self.client.get('/api/v1/products/', {
+                'pagination': 'cursor', 'ordering': ordering})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('ordering', response.data)
+
+    def test_tampered_cursor_is_rejected(self):
+        response = self.client.get('/api/v1/products/?pagination=cursor')
+        query = parse_qs(urlparse(response.data['next']).query)
+        response = self.client.get('/api/v1/products/',
+                                   {'cursor': query['cursor'][0] + 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(PRODUCTS_PAGINATION='cursor')
+    def test_offset_clients_keep_working(self):
+        response = self.client.get('/api/v1/products/?limit=5&offset=5')
+        self.assertEqual(response.data['count'], Product.objects.count())
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class ProductSaleTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        Product.objects.all().delete()
+        self.open_ended = Product.objects.create(
+            name='Open ended', description='Sale', price=10.0,
+            sale_start=now - timedelta(days=1))
+        self.finished = Product.objects.create(
+            name='Finished', description='Sale', price=20.0,
+            sale_start=now - timedelta(days=2),
+            sale_end=now - timedelta(days=1))
+        self.current = Product.objects.create(
+            name='Current', description='Sale', price=30.0,
+            sale_start=now - timedelta(days=1),
+            sale_end=now + timedelta(days=1))
+        self.regular = Product.objects.create(
+            name='Regular', description='Sale', price=5.0)
+
+    def test_annotations_match_model_methods(self):
+        for product in Product.objects.with_sale_info():
+            unannotated = Product.objects.get(id=product.id)
+            self.assertEqual(product.on_sale_now, unannotated.is_on_sale())
+            self.assertEqual(product.price_now, unannotated.current_price())
+
+    def test_filter_on_sale_products(self):
+        response = self.client.get('/api/v1/products/?on_sale=true')
+        self.assertEqual(
+            {product['id'] for product in response.data['results']},
+            {self.open_ended.id, self.current.id},
+        )
+
+    def test_order_by_current_price(self):
+        response = self.client.get('/api/v1/products/?ordering=current_price')
+        self.assertEqual(
+            [product['current_price'] for product in response.data['results']],
+            [5.0, 9.0, 20.0, 27.0],
+        )
+
+    def test_update_returns_fresh_sale_info(self):
+        response = self.client.patch(
+            '/api/v1/products/{}/'.format(self.regular.id),
+            {'sale_start': '12:01 AM 28 July 2019'}, format='json')
+        self.assertEqual(response.data['is_on_sale'], True)
+        self.assertEqual(response.data['current_price'], 4.5)
+
+
+class ProductSearchTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.all().delete()
+        self.lemon_bar = Product.objects.create(
+            name='Protein Bar Lemon', description='Tangy lemon bar', price=2.0)
+        self.lemon_water = Product.objects.create(
+            name='Mineral Water', description='Water with lemons', price=1.0)
+        self.orange = Product.objects.create(
+            name='Mineral Water Orange', description='Orange', price=1.0)
+
+    def search(self, terms, **params):
+        params['search'] = terms
+        response = self.client.get('/api/v1/products/', params)
+        return [product['id'] for product in response.data['results']]
+
+    def test_search_orders_by_relevance(self):
+        # the name weighs more than the description, and lemons is stemmed
+        self.assertEqual(self.search('lemon'),
+                         [self.lemon_bar.id, self.lemon_water.id])
+
+    def test_search_matches_all_terms(self):
+        self.assertEqual(self.search('mineral water orange'),
+                         [self.orange.id])
+
+    def test_search_ignores_query_syntax(self):
+        self.assertEqual(self.search('"lemon OR orange*'), [])
+
+    def test_search_with_explicit_ordering(self):
+        self.assertEqual(self.search('water', ordering='-id'),
+                         [self.orange.id, self.lemon_water.id])
+
+    def test_search_index_follows_updates(self):
+        self.client.patch('/api/v1/products/{}/'.format(self.orange.id),
+                          {'name': 'Mineral Water Grapefruit'},
+                          format='json')
+        self.assertEqual(self.search('grapefruit'), [self.orange.id])
+        self.assertEqual(self.search('orange'), [self.orange.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orange.delete()
+        self.assertEqual(self.search('orange'), [])
+
+
+class ProductUpdateTestCase(StoreTestCase):
+    def test_update_product(self):
+        product = Product.objects.first()
+        response = self.client.patch(
+            '/api/v1/products/{}/'.format(product.id),
+            {
+                'name': 'New Product',
+                'description': 'Awesome product',
+                'price': 123.45,
+            },
+            format='json',
+        )
+        updated = Product.objects.get(id=product.id)
+        self.assertEqual(updated.name, 'New Product')
+
+    # the variants are tested with ProductPhotoVariantsTestCase, in a
+    # temporary directory
+    @mock.patch('store.images.schedule_variants')
+    def test_upload_product_photo(self, schedule_variants):
+        product = Product.objects.first()
+        original_photo = product.photo
+        photo_path = os.path.join(settings.MEDIA_ROOT, 'products',
+                                  'vitamin-iron.jpg')
+
+        # REST APIs usually use JSON objects, however images and files are
+        # binary data and so the multipart format is used to parse that data.
+        with open(photo_path, 'rb') as photo_data:
+            response = self.client.patch(
+                '/api/v1/products/{}/'.format(product.id), {
+                    'photo': photo_data,
+                }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['photo'], original_photo)
+        try:
+            updated = Product.objects.get(id=product.id)
+            expected_photo = os.path.join(settings.MEDIA_ROOT, 'products',
+                                          'vitamin-iron')
+            self.assertTrue(updated.photo.path.startswith(expected_photo))
+        finally:
+            os.remove(updated.photo.path)
+
+
+class ProductCreateTestCase(StoreTestCase):
+    def test_create_product(self):
+        initial_product_count = Product.objects.count()
+        product_attrs = {
+            'name': 'New Product',
+            'description': 'Awesome product',
+            'price': '123.45',
+        }
+        response = self.client.post('/api/v1/products/new', product_attrs)
+        print(response.data)
+
+        if response.status_code != 201:
+            print(response.data)
+
+        # check the product count
+        self.assertEqual(
+            Product.objects.count(),
+            initial_product_count + 1,
+        )
+
+        # check the values  for the prod were set correctly
+        for attr, expected_value in product_attrs.items():
+            self.assertEqual(response.data[attr], expected_value)
+
+        # check the custom fields were set correctly
+        self.assertEqual(response.data['is_on_sale'], False)
+        self.assertEqual(
+            response.data['current_price'],
+            float(product_attrs['price']),
+        )
+
+
+class SparseFieldsTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        self.product = Product.objects.create(
+            name='Product', description='Product', price=1.0)
+        ShoppingCartItem.objects.create(shopping_cart=cart,
+                                        product=self.product, quantity=2)
+
+    # no query for the cart items, and the page only reads the columns of
+    # the fields
+    def test_list_only_reads_the_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/products/',
+                                       {'fields': 'id,name,price'})
+        self.assertEqual(len(queries), 3)
+        self.assertNotIn('description', queries[-1]['sql'])
+        for product in response.data['results']:
+            self.assertEqual(set(product), {'id', 'name', 'price'})
+
+    def test_exclude_fields(self):
+        response = self.client.get(
+            '/api/v1/products/{}/'.format(self.product.id),
+            {'exclude': 'cart_items,photo_srcset'})
+        self.assertNotIn('cart_items', response.data)
+        self.assertNotIn('photo_srcset', response.data)
+        self.assertEqual(response.data['current_price'], 1.0)
+        self.assertEqual(response.data['description'], 'Product')
+
+        # cached apart from the full response
+        response = self.client.get(
+            '/api/v1/products/{}/'.format(self.product.id))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['cart_items'],
+                         [{'product': self.product.id, 'quantity': 2}])
+
+    async def test_async_views_pick_fields(self):
+        response = await self.async_client.get(
+            '/api/v1/async/products/{}/'.format(self.product.id),
+            {'fields': 'id,cart_items,warranty_url'})
+        self.assertEqual(json.loads(response.content), {
+            'id': self.product.id,
+            'cart_items': [{'product': self.product.id, 'quantity': 2}],
+            'warranty_url': None,
+        })
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/v1/products/',
+                                   {'fields': 'id,warranty,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data,
+                         {'fields': 'unknown fields: secret, warranty'})
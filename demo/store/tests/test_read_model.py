@@ -0,0 +1,172 @@
+import sys
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store import cache as product_cache
+from store import listings
+from store.api_views import ProductList
+from store.benchmarks import seed_products
+from store.models import Attachment, Product, ProductListing, ShoppingCart, \
+    ShoppingCartItem
+from store.tests.base import StoreTestCase, cache_misses, timing_test
+
+
+@override_settings(PRODUCTS_READ_MODEL=True)
+class ProductReadModelTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.cart = ShoppingCart.objects.create(name='Cart',
+                                                address='Address')
+        for i in range(6):
+            product = Product.objects.create(
+                name='Product {}'.format(i), description='Product',
+                price=10.005 + i, sale_start=now - timedelta(days=i - 2),
+                sale_end=now + timedelta(days=1) if i % 2 else None)
+            for quantity in range(i % 3):
+                ShoppingCartItem.objects.create(
+                    shopping_cart=ShoppingCart.objects.create(
+                        name='Cart', address='Address'),
+                    product=product, quantity=quantity + 1)
+        listings.rebuild()
+
+    def rows(self):
+        return list(ProductListing.objects.order_by('id').values())
+
+    def test_list_matches_products(self):
+        for url in ('/api/v1/products/?limit=100',
+                    '/api/v1/products/?on_sale=true&ordering=-current_price',
+                    '/api/v1/products/?pagination=cursor&ordering=sale_start'):
+            response = self.client.get(url)
+            with self.settings(PRODUCTS_READ_MODEL=False), cache_misses():
+                expected = self.client.get(url)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['ETag'], expected['ETag'])
+
+    # the count, the sale boundaries of the catalog and the page, with its
+    # cart items
+    def test_list_query_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/products/?limit=100')
+        self.assertEqual(len(response.data['results']),
+                         Product.objects.count())
+
+    def test_search_goes_through_the_products(self):
+        response = self.client.get('/api/v1/products/?search=product')
+        self.assertEqual(response.data['count'], 6)
+
+    def test_signals_keep_rows_up_to_date(self):
+        product = Product.objects.order_by('id').last()
+        self.client.patch('/api/v1/products/{}/'.format(product.id),
+                          {'name': 'Renamed'}, format='json')
+        ShoppingCartItem.objects.create(shopping_cart=self.cart,
+                                        product=product, quantity=4)
+        ShoppingCartItem.objects.filter(quantity=2).first().delete()
+        Product.objects.order_by('id').first().delete()
+        rows = self.rows()
+        self.assertIn('Renamed', [row['name'] for row in rows])
+
+        listings.rebuild()
+        self.assertEqual(rows, self.rows())
+
+    def test_bulk_writes_refresh_rows(self):
+        response = self.client.post('/api/v1/products/bulk', [
+            {'name': 'Bulk', 'description': 'Bulk product', 'price': 5},
+        ], format='json')
+        listing = ProductListing.objects.get(id=response.data['created'][0])
+        self.assertEqual(listing.name, 'Bulk')
+        self.assertEqual(listing.cart_items, [])
+
+    def test_rebuild_command(self):
+        ProductListing.objects.all().delete()
+        call_command('rebuild_product_listings', stdout=StringIO())
+        self.assertEqual(ProductListing.objects.count(),
+                         Product.objects.count())
+        listing = ProductListing.objects.filter(cart_item_count=2).first()
+        self.assertEqual(listing.cart_quantity, 3)
+
+
+class ProductRowSerializerTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        warranty = Attachment.objects.create(
+            content_hash='0' * 64, file='attachments/warranty.txt', size=1)
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        seed_products(200)
+        Product.objects.filter(id__lte=4).update(
+            sale_start=now - timedelta(days=1, microseconds=1234))
+        Product.objects.filter(id=1).update(
+            sku='SKU-1', name='Agua con gas\u2028\u2029 ñ',
+            photo='products/water.jpg',
+            photo_variants={'webp': [[320, 'products/water.320w.webp']]},
+            warranty=warranty)
+        for product in Product.objects.all()[:30]:
+            ShoppingCartItem.objects.create(shopping_cart=cart,
+                                            product=product, quantity=2)
+
+    # the list from ProductSerializer, then from ProductRowSerializer
+    def get_list(self, query):
+        return self.get_list_with(False, query), \
+            self.get_list_with(True, query)
+
+    def get_list_with(self, row_serializer, query):
+        with self.settings(PRODUCTS_ROW_SERIALIZER=row_serializer):
+            cache.clear()
+            return self.client.get('/api/v1/products/' + query)
+
+    # the same bytes as ProductSerializer and the stdlib JSON encoder
+    def test_same_json_as_product_serializer(self):
+        for query in ('?limit=100', '?limit=100&offset=100',
+                      '?fields=id,photo_srcset,cart_items,current_price',
+                      '?pagination=cursor&ordering=sale_start&limit=3'):
+            expected, response = self.get_list(query)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response.content,
+                             JSONRenderer().render(expected.data))
+
+        with self.settings(PRODUCTS_READ_MODEL=True):
+            listings.rebuild()
+            expected, response = self.get_list('?limit=100')
+        self.assertEqual(response.content, expected.content)
+
+    def test_list_query_count(self):
+        with self.assertNumQueries(4):
+            self.client.get('/api/v1/products/?limit=100')
+
+    # reports the serializations per second of both serializers
+    @timing_test
+    def test_serializations_per_second(self):
+        request = APIRequestFactory().get('/api/v1/products/')
+        view = ProductList(request=Request(request), format_kwarg=None)
+        queryset = view.get_queryset().order_by('id')
+        products = list(queryset)
+
+        def product_serializer():
+            return view.get_serializer(products, many=True).data
+
+        def row_serializer():
+            serializer = view.get_row_serializer()
+            serializer.serialize(serializer.rows(queryset))
+
+        rates = {}
+        for name, serialize in (('ProductSerializer', product_serializer),
+                                ('ProductRowSerializer', row_serializer)):
+            start = time.perf_counter()
+            for run in range(5):
+                serialize()
+            rates[name] = 5 * len(products) / (time.perf_counter() - start)
+        sys.stderr.write('\nproducts serialized per second: {}\n'.format(
+            ', '.join('{} {:.0f}'.format(name, rate)
+                      for name, rate in rates.items())))
+        self.assertGreater(rates['ProductRowSerializer'],
+                           rates['ProductSerializer'])
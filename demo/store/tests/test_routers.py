@@ -0,0 +1,93 @@
+import json
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import override_settings
+
+from store.models import Product
+from store.routers import ReplicaRoutingMiddleware
+from store.tests.base import CommittingAPIClient, StoreTestCase
+
+
+# The replica test database is migrated separately, so the products
+# created in the tests only exist on the primary.
+@override_settings(DATABASE_READ_REPLICA='replica', STOREFRONT_PAGE_SIZE=100)
+class ReplicaRoutingTestCase(StoreTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            name='Only on the primary', description='Product', price=1.0)
+
+    def names(self, response):
+        return [product['name'] for product in response.data['results']]
+
+    def test_marked_views_read_from_the_replica(self):
+        response = self.client.get('/api/v1/products/', {'limit': 100})
+        self.assertNotIn('Only on the primary', self.names(response))
+        self.assertEqual(response.data['count'],
+                         Product.objects.using('replica').count())
+        response = self.client.get(
+            '/api/v1/products/{}/stats'.format(self.product.id))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotContains(self.client.get('/'), 'Only on the primary')
+
+    def test_other_views_read_from_the_primary(self):
+        response = self.client.get(
+            '/api/v1/products/{}/'.format(self.product.id))
+        self.assertEqual(response.data['name'], 'Only on the primary')
+        self.assertEqual(Product.objects.all().db, 'default')
+
+    def test_clients_read_their_writes(self):
+        response = self.client.post('/api/v1/products/new', {
+            'name': 'New product', 'description': 'New product',
+            'price': 5})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.using('replica').filter(
+            name='New product').count(), 0)
+        cookie = response.cookies['store_primary']
+        self.assertEqual(cookie['max-age'],
+                         settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+        response = self.client.get('/api/v1/products/', {'limit': 100})
+        self.assertIn('New product', self.names(response))
+        self.assertNotIn('store_primary', response.cookies)
+
+    # the replica may not have the write yet, the primary does
+    def test_recent_replica_reads_not_cached(self):
+        self.client.post('/api/v1/products/new', {
+            'name': 'New product', 'description': 'New product',
+            'price': 5})
+        other = CommittingAPIClient()
+        for attempt in range(2):
+            response = other.get('/api/v1/products/', {'limit': 100})
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertNotIn('New product', self.names(response))
+
+        response = self.client.get('/api/v1/products/', {'limit': 100})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('New product', self.names(response))
+        response = other.get('/api/v1/products/', {'limit': 100})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertIn('New product', self.names(response))
+
+    @override_settings(DATABASE_REPLICA_STICKY_SECONDS=0)
+    def test_replica_reads_cached_once_caught_up(self):
+        self.client.get('/api/v1/products/')
+        self.assertEqual(self.client.get('/api/v1/products/')['X-Cache'],
+                         'HIT')
+
+    async def test_async_views(self):
+        response = await self.async_client.get('/api/v1/async/products/',
+                                               {'limit': 100})
+        self.assertNotIn('Only on the primary',
+                         [product['name'] for product in
+                          json.loads(response.content)['results']])
+
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(
+            ReplicaRoutingMiddleware(get_response)))
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from store.models import Product, ShoppingCart, ShoppingCartItem
+from store.tests.base import StoreTestCase
+
+
+class ProductStatsTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.product = Product.objects.create(
+            name='Product', description='Product', price=10.0,
+            sale_start=now - timedelta(days=40),
+            sale_end=now - timedelta(days=35))
+        # a cart has one item per product
+        for days_ago, quantity in ((0, 1), (0, 2), (1, 5), (38, 4), (70, 3)):
+            cart = ShoppingCart.objects.create(name='Cart', address='Address')
+            ShoppingCartItem.objects.create(
+                shopping_cart=cart, product=self.product,
+                quantity=quantity, created_at=now - timedelta(days=days_ago))
+        self.url = '/api/v1/products/{}/stats'.format(self.product.id)
+        self.today = timezone.localdate()
+
+    def day(self, days_ago):
+        return (self.today - timedelta(days=days_ago)).isoformat()
+
+    def test_daily_stats_of_last_30_days(self):
+        # the validators and the sum of the daily rows
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['stats'], {
+            self.day(1): [1, 5, 0],
+            self.day(0): [2, 3, 0],
+        })
+
+    def test_monthly_stats(self):
+        response = self.client.get(self.url, {
+            'from': self.day(100), 'to': self.day(0),
+            'granularity': 'month'})
+        stats = response.data['stats']
+        self.assertEqual(sum(values[0] for values in stats.values()), 5)
+        self.assertEqual(sum(values[1] for values in stats.values()), 15)
+        # only the item added during the sale
+        self.assertEqual(sum(values[2] for values in stats.values()), 4)
+
+    def test_stats_follow_cart_item_changes(self):
+        item = ShoppingCartItem.objects.filter(product=self.product).first()
+        item.quantity += 10
+        item.save()
+        ShoppingCartItem.objects.filter(product=self.product).last().delete()
+        response = self.client.get(self.url, {'from': self.day(100)})
+        self.assertEqual(
+            sum(values[1] for values in response.data['stats'].values()),
+            15 + 10 - 3)
+
+    def test_rebuild_matches_incremental_stats(self):
+        params = {'from': self.day(100), 'granularity': 'week'}
+        expected = self.client.get(self.url, params).data['stats']
+        call_command('rollup_product_stats', stdout=StringIO())
+        self.product.save()
+        self.assertEqual(self.client.get(self.url, params).data['stats'],
+                         expected)
+
+    # the items stay where they were counted when the sale window changes
+    def test_rebuild_after_sale_window_changes(self):
+        params = {'from': self.day(100), 'granularity': 'week'}
+        expected = self.client.get(self.url, params).data['stats']
+        response = self.client.patch(
+            '/api/v1/products/{}/'.format(self.product.id),
+            {'sale_start': (timezone.now() - timedelta(days=100))
+             .strftime('%I:%M %p %d %B %Y'), 'sale_end': None}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url, params).data['stats'],
+                         expected)
+        call_command('rollup_product_stats', stdout=StringIO())
+        self.product.save()
+        self.assertEqual(self.client.get(self.url, params).data['stats'],
+                         expected)
+
+    def test_invalid_parameters(self):
+        for params in ({'from': 'yesterday'}, {'granularity': 'year'},
+                       {'from': self.day(0), 'to': self.day(1)}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.test import override_settings
+from django.utils import timezone
+
+from store.models import Product
+from store.tests.base import StoreTestCase
+
+
+@override_settings(STOREFRONT_PAGE_SIZE=2)
+class StorefrontTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.order_by('id').first()
+
+    def test_index_is_paginated(self):
+        response = self.client.get('/')
+        self.assertContains(response, 'class="product"', count=2)
+        self.assertContains(response, 'href="?page=2"')
+        response = self.client.get('/', {'page': 2})
+        self.assertContains(response, 'href="?page=1"')
+        self.assertEqual(self.client.get('/', {'page': 999}).status_code,
+                         404)
+        self.assertEqual(self.client.get('/', {'page': 'x'}).status_code,
+                         404)
+
+    def test_index_is_served_from_cache(self):
+        self.assertEqual(self.client.get('/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        self.product.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get('/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Renamed')
+
+    # the markup of the products that didn't change is reused
+    def test_index_reuses_product_fragments(self):
+        self.client.get('/')
+        # without going through save(), the version doesn't change
+        Product.objects.filter(id=self.product.id).update(name='Stale')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.order_by('id').last().save()
+        response = self.client.get('/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertNotContains(response, 'Stale')
+
+    def test_show_product(self):
+        self.product.price = 10
+        self.product.sale_start = None
+        self.product.save()
+        url = '/products/{}/'.format(self.product.id)
+        response = self.client.get(url)
+        self.assertContains(response, 'Price: $10.00')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        self.product.sale_start = timezone.now() - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertContains(self.client.get(url), 'SALE: $9.00')
+        self.assertEqual(self.client.get('/products/0/').status_code, 404)
@@ -0,0 +1,155 @@
+import sys
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
+
+from store import throttling
+from store.models import Product, ShoppingCart
+from store.tests.base import StoreTestCase, timing_test
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK=dict(
+        settings.REST_FRAMEWORK,
+        DEFAULT_THROTTLE_RATES=dict(
+            settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **rates)))
+
+
+class ThrottlingTestCase(StoreTestCase):
+    product_attrs = {'name': 'New Product', 'description': 'Awesome product',
+                     'price': '1.00'}
+
+    @throttle_rates(product_create='2/min')
+    def test_create_throttled(self):
+        for attempt in range(2):
+            response = self.client.post('/api/v1/products/new',
+                                        self.product_attrs)
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/v1/products/new',
+                                    self.product_attrs)
+        self.assertEqual(response.status_code, 429)
+        # a token is back every 30 seconds
+        self.assertTrue(0 < int(response['Retry-After']) <= 30)
+
+        # the other clients have their own bucket
+        response = self.client.post('/api/v1/products/new',
+                                    self.product_attrs,
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 201)
+
+    # the clients can't get a new bucket by sending X-Forwarded-For
+    @throttle_rates(product_create='1/min')
+    def test_forwarded_for_ignored(self):
+        for address, status in (('10.0.0.3', 201), ('10.0.0.4', 429)):
+            response = self.client.post('/api/v1/products/new',
+                                        self.product_attrs,
+                                        HTTP_X_FORWARDED_FOR=address)
+            self.assertEqual(response.status_code, status)
+
+    # a token per product, the bulk requests share the bucket of the
+    # creations
+    @throttle_rates(product_create='3/min')
+    def test_bulk_takes_a_token_per_product(self):
+        response = self.client.post('/api/v1/products/bulk',
+                                    [self.product_attrs] * 2, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/v1/products/bulk',
+                                    [self.product_attrs] * 2, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.client.post(
+            '/api/v1/products/new', self.product_attrs).status_code, 201)
+        self.assertEqual(self.client.post(
+            '/api/v1/products/new', self.product_attrs).status_code, 429)
+
+    @throttle_rates(cart_update='1/min')
+    def test_cart_changes_throttled(self):
+        cart = ShoppingCart.objects.create(name='Cart', address='Address')
+        session = self.client.session
+        session['shopping_cart_id'] = cart.id
+        session.save()
+        url = '/api/v1/carts/{}/items/'.format(cart.id)
+        product = Product.objects.first()
+        self.assertEqual(self.client.post(url, {
+            'product': product.id, 'quantity': 1}).status_code, 201)
+        self.assertEqual(self.client.post(url, {
+            'product': product.id, 'quantity': 1}).status_code, 429)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @throttle_rates(product_search='1/min')
+    def test_only_searches_throttled(self):
+        self.assertEqual(self.client.get(
+            '/api/v1/products/', {'search': 'water'}).status_code, 200)
+        self.assertEqual(self.client.get(
+            '/api/v1/products/', {'search': 'soda'}).status_code, 429)
+        self.assertEqual(self.client.get(
+            '/api/v1/products/export.csv', {'search': 'soda'}).status_code, 429)
+        self.assertEqual(self.client.get(
+            '/api/v1/products/').status_code, 200)
+
+    @throttle_rates(product_create='1/min', product_update='1/min')
+    def test_writes_have_their_own_buckets(self):
+        product = Product.objects.first()
+        url = '/api/v1/products/{}/'.format(product.id)
+        self.assertEqual(self.client.post(
+            '/api/v1/products/new', self.product_attrs).status_code, 201)
+        self.assertEqual(self.client.patch(
+            url, {'name': 'Renamed'}).status_code, 200)
+        self.assertEqual(self.client.patch(
+            url, {'name': 'Renamed again'}).status_code, 429)
+        # the reads are not throttled
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @throttle_rates(product_search='1/min')
+    def test_stats(self):
+        for attempt in range(3):
+            self.client.get('/api/v1/products/', {'search': 'water'})
+        response = self.client.get('/api/v1/throttle/stats')
+        self.assertEqual(response.data, {
+            'product_create': 0, 'product_update': 0, 'product_search': 2,
+            'cart_update': 0})
+
+    @throttle_rates(product_search=None)
+    def test_turned_off(self):
+        for attempt in range(3):
+            self.assertEqual(self.client.get(
+                '/api/v1/products/', {'search': 'water'}).status_code, 200)
+
+    @throttle_rates(product_search='1/min')
+    async def test_async_search_throttled(self):
+        response = await self.async_client.get(
+            '/api/v1/async/products/', {'search': 'water'})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(
+            '/api/v1/async/products/', {'search': 'water'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        # the sync and async views share the buckets
+        self.assertEqual(self.client.get(
+            '/api/v1/products/', {'search': 'water'}).status_code, 429)
+
+    def test_bucket_refills(self):
+        with mock.patch('time.time', return_value=1000.0) as now:
+            for attempt in range(3):
+                self.assertIsNone(throttling.take_token('bucket', 3, 10))
+            self.assertEqual(throttling.take_token('bucket', 3, 10), 10)
+            now.return_value = 1010.0
+            self.assertIsNone(throttling.take_token('bucket', 3, 10))
+            self.assertEqual(throttling.take_token('bucket', 3, 10), 10)
+            # two tokens are back 20 seconds later
+            self.assertEqual(throttling.take_token('bucket', 3, 10, 2), 20)
+            now.return_value = 1030.0
+            self.assertIsNone(throttling.take_token('bucket', 3, 10, 2))
+
+    # reports the time taken by a throttled request to take a token
+    @timing_test
+    def test_overhead(self):
+        runs = 1000
+        start = time.perf_counter()
+        for run in range(runs):
+            throttling.take_token('bucket', runs, 0.001)
+        mean = (time.perf_counter() - start) / runs
+        sys.stderr.write('\nthrottle overhead: {:.1f} µs per request\n'
+                         .format(mean * 1e6))
+        self.assertLess(mean, 0.001)
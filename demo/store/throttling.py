@@ -0,0 +1,222 @@
+import hashlib
+import math
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from store import instrumentation
+from store.cache import aincrement_counter, increment_counter
+
+# the bucket of a client for a scope, and the number of requests throttled
+# in a scope, shared by all the processes through the cache
+BUCKET_KEY = 'store:throttle:{}:{}'
+THROTTLED_KEY = 'store:throttle:{}:throttled'
+
+
+# The buckets use the generic cell rate algorithm: instead of a number of
+# tokens and when they were last refilled, which would have to be read and
+# written back, a bucket is the time when it will be full again (its
+# theoretical arrival time, in milliseconds). Taking a token pushes that
+# time one interval later with an atomic cache.incr(), and the request is
+# let through when the bucket doesn't have to be full for longer than
+# capacity intervals; otherwise the increment is taken back. The key
+# expires when the bucket is full again, which is how an idle bucket gets
+# its tokens back. Caches that count expiry in seconds keep it up to one
+# second longer, during which the bucket refills from the time it expired
+# rather than from now.
+# Several tokens (at most capacity) are taken at once by pushing the time
+# that many intervals later.
+# Returns None when the tokens were taken, or the seconds until they are
+# back.
+def take_token(key, capacity, interval, tokens=1):
+    now, step, cost = bucket_steps(interval, tokens)
+    try:
+        full_at = cache.incr(key, cost)
+    except ValueError:
+        # a missing bucket is full
+        if cache.add(key, now + cost, timeout=math.ceil(tokens * interval)):
+            return None
+        full_at = cache.incr(key, cost)
+    wait = bucket_wait(full_at, now, capacity, step)
+    if wait is not None:
+        try:
+            cache.decr(key, cost)
+        except ValueError:
+            pass
+        return wait
+    cache.touch(key, timeout=bucket_timeout(full_at, now))
+    return None
+
+
+# the same, for the async views
+async def atake_token(key, capacity, interval, tokens=1):
+    now, step, cost = bucket_steps(interval, tokens)
+    try:
+        full_at = await cache.aincr(key, cost)
+    except ValueError:
+        if await cache.aadd(key, now + cost,
+                            timeout=math.ceil(tokens * interval)):
+            return None
+        full_at = await cache.aincr(key, cost)
+    wait = bucket_wait(full_at, now, capacity, step)
+    if wait is not None:
+        try:
+            await cache.adecr(key, cost)
+        except ValueError:
+            pass
+        return wait
+    await cache.atouch(key, timeout=bucket_timeout(full_at, now))
+    return None
+
+
+# the current time, the interval and the time pushed by the tokens, in
+# milliseconds
+def bucket_steps(interval, tokens):
+    step = milliseconds(interval)
+    return milliseconds(time.time()), step, tokens * step
+
+
+# the seconds until the tokens are back when the bucket had to be full for
+# longer than capacity intervals, or None
+def bucket_wait(full_at, now, capacity, step):
+    if full_at - now > capacity * step:
+        return (full_at - now - capacity * step) / 1000
+    return None
+
+
+# a bucket is kept until it is full again
+def bucket_timeout(full_at, now):
+    return math.ceil((full_at - now) / 1000)
+
+
+def milliseconds(seconds):
+    return int(seconds * 1000)
+
+
+# DRF throttle with a token bucket per client for its scope, whose rate is
+# set in the DEFAULT_THROTTLE_RATES of the REST_FRAMEWORK setting, e.g.
+# 'product_create': '60/min' lets a client create 60 products at once, then
+# one per second. A rate of None turns the throttle off. The clients are
+# told when to retry with the Retry-After header of the 429 responses, and
+# the throttled requests are counted per scope, see throttle_stats().
+# The clients are told apart by their user, or their address as given by
+# get_ident(): with the NUM_PROXIES of the REST_FRAMEWORK setting, the
+# X-Forwarded-For header the clients send themselves is ignored. The
+# identity is hashed into the key, which keeps it short and safe for the
+# cache whatever the header holds.
+class TokenBucketThrottle(SimpleRateThrottle):
+    cache_format = BUCKET_KEY
+    # the methods of the requests throttled, all of them when empty
+    methods: tuple[str, ...] = ()
+
+    def __init__(self):
+        super().__init__()
+        # set by allow_request(), for wait()
+        self.wait_seconds = None
+
+    # read when the throttle is created, so that the tests can change it
+    def get_rate(self):
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def get_cache_key(self, request, view):
+        if self.methods and request.method not in self.methods:
+            return None
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = 'user-{}'.format(user.pk)
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format.format(
+            self.scope, hashlib.sha256(ident.encode()).hexdigest())
+
+    # the tokens taken by the request
+    def get_tokens(self, request):
+        return 1
+
+    def allow_request(self, request, view):
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        with instrumentation.timed('throttle'):
+            self.wait_seconds = take_token(key, *self.bucket(request))
+            if self.wait_seconds is not None:
+                instrumentation.count('throttled')
+                increment_counter(THROTTLED_KEY.format(self.scope))
+        return self.wait_seconds is None
+
+    async def aallow_request(self, request, view):
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        self.wait_seconds = await atake_token(key, *self.bucket(request))
+        if self.wait_seconds is not None:
+            instrumentation.count('throttled')
+            await aincrement_counter(THROTTLED_KEY.format(self.scope))
+        return self.wait_seconds is None
+
+    # the capacity, the interval and the tokens of take_token()
+    def bucket(self, request):
+        return (self.num_requests, self.duration / self.num_requests,
+                min(self.get_tokens(request), self.num_requests))
+
+    def get_key(self, request, view):
+        if self.rate is None:
+            return None
+        return self.get_cache_key(request, view)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ProductCreateThrottle(TokenBucketThrottle):
+    scope = 'product_create'
+
+
+class ProductUpdateThrottle(TokenBucketThrottle):
+    scope = 'product_update'
+    methods = ('PUT', 'PATCH', 'DELETE')
+
+
+# The bulk endpoint takes a token per product of the request, so that it
+# doesn't get around the rates of the single product writes. The requests
+# with more products than the capacity of the bucket wait for it to be full.
+class BulkThrottleMixin:
+    def get_tokens(self, request):
+        return max(1, len(request.data)) \
+            if isinstance(request.data, list) else 1
+
+
+class ProductBulkCreateThrottle(BulkThrottleMixin, ProductCreateThrottle):
+    methods = ('POST',)
+
+
+class ProductBulkUpdateThrottle(BulkThrottleMixin, ProductUpdateThrottle):
+    pass
+
+
+# the changes to the shopping carts
+class CartThrottle(TokenBucketThrottle):
+    scope = 'cart_update'
+    methods = ('POST', 'DELETE')
+
+
+# only the searches, which are much more expensive than the other lists
+class ProductSearchThrottle(TokenBucketThrottle):
+    scope = 'product_search'
+
+    def get_cache_key(self, request, view):
+        if not view.search_terms():
+            return None
+        return super().get_cache_key(request, view)
+
+
+# the number of throttled requests per scope, e.g. {'product_create': 3}
+def throttle_stats():
+    scopes = list(api_settings.DEFAULT_THROTTLE_RATES)
+    counters = cache.get_many([THROTTLED_KEY.format(scope)
+                               for scope in scopes])
+    return {scope: counters.get(THROTTLED_KEY.format(scope), 0)
+            for scope in scopes}
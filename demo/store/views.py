@@ -1,28 +1,126 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import F
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
 
-from store.models import Product, ShoppingCart
+from store import cache as product_cache
+from store import instrumentation
+from store.models import Product, ShoppingCart, ShoppingCartItem
 
 
-def index(request):
-    context = {
-        'products': Product.objects.all(),
+# The storefront pages are cached whole (see store/cache.py), so a hit
+# doesn't render anything or run any query. On a miss, the markup of every
+# product is also cached as a template fragment keyed by the version of the
+# product, so only the products that changed are rendered again.
+def cached_page(request, key, build):
+    entry = product_cache.get_entry(key)
+    hit = entry is not None
+    if entry is None:
+        def build_entry():
+            response, expires = build()
+            return {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'expires': expires,
+            }
+
+        entry, hit = product_cache.build_entry(key, build_entry)
+    response = HttpResponse(entry['content'],
+                            content_type=entry['content_type'])
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+# the timeout and the cache generation used by the {% cache %} fragments
+def fragment_context():
+    return {
+        'fragment_timeout': settings.PRODUCTS_CACHE_TIMEOUT,
+        'cache_generation': product_cache.get_version(
+            product_cache.GENERATION_KEY),
     }
-    return render(request, 'store/product_list.html', context)
 
 
+# The products are shown STOREFRONT_PAGE_SIZE at a time, e.g. ?page=2, so
+# the render time of a page doesn't grow with the catalog. The pages don't
+# show the prices, so they don't change when a sale starts or ends.
+def index(request):
+    try:
+        page_number = int(request.GET.get('page', 1))
+    except ValueError as exc:
+        raise Http404 from exc
+
+    def build():
+        paginator = Paginator(
+            Product.objects.only('id', 'name', 'photo', 'photo_variants',
+                                 'version').order_by('id'),
+            settings.STOREFRONT_PAGE_SIZE)
+        try:
+            page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise Http404 from exc
+        context = {
+            'page': page,
+            'products': page.object_list,
+            **fragment_context(),
+        }
+        response = render(request, 'store/product_list.html', context)
+        return response, product_cache.get_expires()
+
+    return cached_page(
+        request,
+        product_cache.catalog_page_key('index', request, page_number),
+        build)
+
+
+# The page expires when the sale of the product starts or ends.
 def show(request, product_id):
-    context = {
-        'product': Product.objects.get(id=product_id),
-    }
-    return render(request, 'store/product.html', context)
+    def build():
+        product = get_object_or_404(Product.objects.with_sale_info(),
+                                    id=product_id)
+        _, next_boundary = product_cache.sale_boundaries(
+            [(product.sale_start, product.sale_end)], timezone.now())
+        context = {
+            'product': product,
+            **fragment_context(),
+        }
+        response = render(request, 'store/product.html', context)
+        return response, product_cache.get_expires(next_boundary)
 
+    return cached_page(
+        request, product_cache.product_page_key('show', request, product_id),
+        build)
 
+
+# The cart of the visitor is the one whose id is stored in their session.
+# Without one, an empty cart is shown.
 def cart(request):
+    items = ShoppingCartItem.objects.none()
+    totals = ShoppingCart.totals_from_subtotal(None)
+    cart_id = request.session.get('shopping_cart_id')
+    if cart_id is not None:
+        items = ShoppingCartItem.objects.filter(
+            shopping_cart_id=cart_id,
+        ).annotate(name=F('product__name')).order_by('id')
+        totals = ShoppingCart.objects.filter(id=cart_id).totals().get(
+            cart_id, totals)
+
     context = {
-        'items': [],
-        'subtotal': 1.0,
-        'tax_rate': int(ShoppingCart.TAX_RATE * 100.0),
-        'tax_total': 2.0,
-        'total': 3.0,
+        'items': items,
+        'subtotal': totals['subtotal'],
+        'tax_rate': int(ShoppingCart.TAX_RATE * 100),
+        'tax_total': totals['taxes'],
+        'total': totals['total'],
     }
     return render(request, 'store/cart.html', context)
+
+
+# The measures of the instrumentation middleware, in the Prometheus text
+# format. Only served to the INTERNAL_IPS.
+def metrics(request):
+    if not settings.INSTRUMENTATION_ENABLED or \
+            request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(instrumentation.registry.render(),
+                        content_type='text/plain; version=0.0.4')